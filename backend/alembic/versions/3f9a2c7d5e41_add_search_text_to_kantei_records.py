@@ -0,0 +1,124 @@
+"""add_search_text_to_kantei_records
+
+Revision ID: 3f9a2c7d5e41
+Revises: cc4f18169325
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+import re
+import unicodedata
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a2c7d5e41'
+down_revision: Union[str, Sequence[str], None] = 'cc4f18169325'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FTS_TABLE = 'kantei_records_fts'
+BACKFILL_BATCH_SIZE = 500
+
+
+def _normalize(value):
+    """main.normalize_search_text と同じ正規化（マイグレーションはアプリに依存させない）"""
+    normalized = unicodedata.normalize('NFKC', value or '')
+    normalized = ''.join(
+        chr(ord(ch) - 0x60) if 'ァ' <= ch <= 'ヶ' else ch
+        for ch in normalized
+    )
+    return re.sub(r'\s+', '', normalized).lower()
+
+
+def _build_search_text(client_name, name_for_seimei):
+    parts = []
+    for name in (client_name, name_for_seimei):
+        normalized = _normalize(name)
+        if normalized and normalized not in parts:
+            parts.append(normalized)
+    return ' '.join(parts)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('kantei_records', sa.Column('search_text', sa.Text(), nullable=True, comment='検索用正規化氏名'))
+
+    # 既存レコードのバックフィル（全件をメモリに載せないようID順にバッチ処理）
+    bind = op.get_bind()
+    kantei_records = sa.table(
+        'kantei_records',
+        sa.column('id', sa.Integer),
+        sa.column('client_name', sa.String),
+        sa.column('client_info', sa.JSON),
+        sa.column('search_text', sa.Text),
+    )
+    update_stmt = (
+        kantei_records.update()
+        .where(kantei_records.c.id == sa.bindparam('record_id'))
+        .values(search_text=sa.bindparam('search_text'))
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(kantei_records.c.id, kantei_records.c.client_name, kantei_records.c.client_info)
+            .where(kantei_records.c.id > last_id)
+            .order_by(kantei_records.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(update_stmt, [
+            {
+                'record_id': row.id,
+                'search_text': _build_search_text(row.client_name, (row.client_info or {}).get('name_for_seimei')),
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    if bind.dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index(
+            'idx_kantei_search_trgm',
+            'kantei_records',
+            ['search_text'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'search_text': 'gin_trgm_ops'},
+        )
+    elif bind.dialect.name == 'sqlite':
+        # 外部コンテンツ型FTS5テーブル + 同期用トリガー
+        op.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+            "search_text, content='kantei_records', content_rowid='id', tokenize='trigram')"
+        )
+        op.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON kantei_records BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON kantei_records BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END"
+        )
+        op.execute(
+            f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF search_text ON kantei_records BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+            f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END"
+        )
+        op.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('idx_kantei_search_trgm', table_name='kantei_records')
+    elif bind.dialect.name == 'sqlite':
+        op.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au')
+        op.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad')
+        op.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai')
+        op.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+    op.drop_column('kantei_records', 'search_text')
@@ -0,0 +1,46 @@
+"""add_processing_lease_to_kantei_records
+
+Revision ID: 8b1d4e6f2a90
+Revises: 3f9a2c7d5e41
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1d4e6f2a90'
+down_revision: Union[str, Sequence[str], None] = '3f9a2c7d5e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('kantei_records', sa.Column('processing_heartbeat_at', sa.DateTime(), nullable=True, comment='診断処理リースの最終更新時刻'))
+    op.add_column('kantei_records', sa.Column('processing_attempts', sa.Integer(), server_default='0', nullable=False, comment='診断処理の実行回数'))
+
+    # 既存の処理中レコードは最終更新時刻をリース時刻とみなす
+    op.execute(
+        "UPDATE kantei_records SET processing_heartbeat_at = updated_at "
+        "WHERE status = 'processing'"
+    )
+
+    op.create_index(
+        'idx_kantei_processing_heartbeat',
+        'kantei_records',
+        ['processing_heartbeat_at'],
+        unique=False,
+        sqlite_where=sa.text("status = 'processing'"),
+        postgresql_where=sa.text("status = 'processing'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_kantei_processing_heartbeat', table_name='kantei_records')
+    op.drop_column('kantei_records', 'processing_attempts')
+    op.drop_column('kantei_records', 'processing_heartbeat_at')
@@ -0,0 +1,93 @@
+"""add_summary_columns_to_kantei_records
+
+Revision ID: c52e7a9b1f03
+Revises: 8b1d4e6f2a90
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c52e7a9b1f03'
+down_revision: Union[str, Sequence[str], None] = '8b1d4e6f2a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SUMMARY_COLUMNS = ('diagnosis_pattern', 'honmeisei', 'getsumeisei', 'seimei_score')
+BACKFILL_BATCH_SIZE = 500
+
+
+def _parse_score(value):
+    """main.parse_seimei_score と同じ変換（マイグレーションはアプリに依存させない）"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    match = re.search(r'\d+', str(value or ''))
+    return int(match.group()) if match else None
+
+
+def _summary(client_info, calculation_result):
+    client_info = client_info or {}
+    calculation_result = calculation_result or {}
+    kyusei = calculation_result.get('kyusei') or {}
+    seimei_data = (calculation_result.get('seimei') or {}).get('data') or {}
+    return {
+        'diagnosis_pattern': client_info.get('diagnosis_pattern') or 'all',
+        'honmeisei': kyusei.get('honmeisei') or None,
+        'getsumeisei': kyusei.get('getsumeisei') or None,
+        'seimei_score': _parse_score(seimei_data.get('総評点数')),
+    }
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('kantei_records', sa.Column('diagnosis_pattern', sa.String(length=20), nullable=True, comment='診断パターン'))
+    op.add_column('kantei_records', sa.Column('honmeisei', sa.String(length=20), nullable=True, comment='本命星'))
+    op.add_column('kantei_records', sa.Column('getsumeisei', sa.String(length=20), nullable=True, comment='月命星'))
+    op.add_column('kantei_records', sa.Column('seimei_score', sa.Integer(), nullable=True, comment='姓名判断の総評点数'))
+
+    # 既存レコードのバックフィル（JSON列が大きいためID順にバッチ処理）
+    bind = op.get_bind()
+    kantei_records = sa.table(
+        'kantei_records',
+        sa.column('id', sa.Integer),
+        sa.column('client_info', sa.JSON),
+        sa.column('calculation_result', sa.JSON),
+        *(sa.column(name) for name in SUMMARY_COLUMNS),
+    )
+    update_stmt = (
+        kantei_records.update()
+        .where(kantei_records.c.id == sa.bindparam('record_id'))
+        .values({name: sa.bindparam(name) for name in SUMMARY_COLUMNS})
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(kantei_records.c.id, kantei_records.c.client_info, kantei_records.c.calculation_result)
+            .where(kantei_records.c.id > last_id)
+            .order_by(kantei_records.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(update_stmt, [
+            {'record_id': row.id, **_summary(row.client_info, row.calculation_result)}
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    for name in SUMMARY_COLUMNS:
+        op.create_index(op.f(f'ix_kantei_records_{name}'), 'kantei_records', [name], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name in reversed(SUMMARY_COLUMNS):
+        op.drop_index(op.f(f'ix_kantei_records_{name}'), table_name='kantei_records')
+        op.drop_column('kantei_records', name)
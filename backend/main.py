@@ -25,24 +25,60 @@ import time
 print(f"=== DEBUG: 起動時刻 {time.strftime('%Y-%m-%d %H:%M:%S')} ===")
 
 # 必要なライブラリをインポート
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, status, File, UploadFile
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, status, File, UploadFile, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey, create_engine
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, ForeignKey, Index, create_engine, and_, or_, column, text
+from sqlalchemy import select, insert, update, delete, event, case
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker, Session
 from sqlalchemy.sql import func
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from passlib.context import CryptContext
 from jose import JWTError, jwt
-from datetime import datetime, timedelta
-import subprocess
+from datetime import date, datetime, timedelta
 import json
+import mimetypes
 import os
 import uuid
+import base64
+import re
+import shutil
+import unicodedata
+import urllib.parse
 import asyncio
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
+import math
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from xml.sax.saxutils import escape as xml_escape
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape as html_escape
+from PIL import Image as PILImage, ImageDraw, ImageFont, ImageOps
+from reportlab.graphics.shapes import Drawing, Line, Polygon, String as DrawingString
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Image, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
 
 # 環境変数読み込み
 from dotenv import load_dotenv
@@ -54,15 +90,188 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # パスワードハッシュ化設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# BCRYPT_ROUNDS を変更すると、既存ハッシュはログイン成功時に新しいコストで再ハッシュされる
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+# bcrypt はCPUを占有するため、イベントループを止めないよう専用スレッドプールで実行する
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+password_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 security = HTTPBearer()
 
 # データベース設定
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./unmei.db")
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "20"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "30"))
+
+def to_async_database_url(url: str) -> str:
+    """同期ドライバのURLを非同期ドライバ（asyncpg / aiosqlite）のURLに変換"""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    for prefix in ("postgresql+psycopg2:", "postgresql:", "postgres:"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg:" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_database_url(DATABASE_URL))
+
+# 同期エンジン（スクリプト・マイグレーション用。リクエスト処理では使用しない）
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# 非同期エンジン（リクエストハンドラ・バックグラウンド処理用）
+async_engine_options = {}
+if not ASYNC_DATABASE_URL.startswith("sqlite"):
+    async_engine_options = {
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_pre_ping": True,
+    }
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_options)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
+# SQLite運用プロファイル（接続ごとにPRAGMAを適用）
+# WALにより読み取りはバックグラウンド診断処理の書き込みにブロックされない
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+SQLITE_MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("SQLITE_MAINTENANCE_INTERVAL_SECONDS", "600"))
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite接続時にWAL・同期レベル・キャッシュ等の設定を適用"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+if DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+if ASYNC_DATABASE_URL.startswith("sqlite"):
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
+async def run_sqlite_maintenance(checkpoint_mode: str = "PASSIVE"):
+    """WALチェックポイントと統計情報の更新（PRAGMA optimize）を実行"""
+    async with async_engine.connect() as conn:
+        await conn.exec_driver_sql(f"PRAGMA wal_checkpoint({checkpoint_mode})")
+        await conn.exec_driver_sql("PRAGMA optimize")
+
+async def sqlite_maintenance_loop():
+    """定期的にSQLiteのメンテナンスを実行するバックグラウンドタスク"""
+    while True:
+        await asyncio.sleep(SQLITE_MAINTENANCE_INTERVAL_SECONDS)
+        try:
+            await run_sqlite_maintenance()
+        except Exception as e:
+            print(f"SQLiteメンテナンスエラー: {str(e)}")
+
+# クエリ計測（全SQLの実行時間をエンドポイント別に集計し、遅いクエリとN+1の疑いをログ出力）
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+QUERY_COUNT_WARNING_THRESHOLD = int(os.getenv("QUERY_COUNT_WARNING_THRESHOLD", "20"))
+QUERY_STATS_MAX_STATEMENTS = int(os.getenv("QUERY_STATS_MAX_STATEMENTS", "500"))
+# リクエスト単位の計測状態（ミドルウェアで設定、SQLAlchemyのイベントから参照）
+current_query_scope = contextvars.ContextVar("current_query_scope", default=None)
+query_stats = {"statements": {}, "endpoints": {}, "started_at": datetime.now().isoformat()}
+
+def describe_query_parameters(parameters, executemany: bool):
+    """パラメータの値は出さず、型の構成のみを返す（ログに個人情報を残さないため）"""
+    if executemany:
+        first = parameters[0] if parameters else None
+        return f"{len(parameters)} rows x {describe_query_parameters(first, False)}"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+def _query_endpoint(scope) -> str:
+    """ルーティング後はパステンプレート（/api/diagnosis/{diagnosis_id} など）で集計する"""
+    if scope is None:
+        return "background"
+    asgi_scope = scope["asgi_scope"]
+    route = asgi_scope.get("route")
+    path = getattr(route, "path", None) or asgi_scope.get("path", "")
+    return f"{asgi_scope.get('method', '')} {path}"
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._query_started_at) * 1000
+    scope = current_query_scope.get()
+    endpoint = _query_endpoint(scope)
+    if scope is not None:
+        scope["count"] += 1
+        scope["total_ms"] += elapsed_ms
+
+    sql = " ".join(statement.split())[:500]
+    key = (endpoint, sql)
+    stats = query_stats["statements"].get(key)
+    if stats is None:
+        if len(query_stats["statements"]) >= QUERY_STATS_MAX_STATEMENTS:
+            stats = None
+        else:
+            stats = query_stats["statements"][key] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "slow": 0}
+    if stats is not None:
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+    if elapsed_ms >= SLOW_QUERY_THRESHOLD_MS:
+        if stats is not None:
+            stats["slow"] += 1
+        print(
+            f"DEBUG: 遅いクエリ {elapsed_ms:.1f}ms endpoint={endpoint} "
+            f"params={describe_query_parameters(parameters, executemany)} sql={sql[:200]}"
+        )
+
+for _instrumented_engine in (engine, async_engine.sync_engine):
+    event.listen(_instrumented_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_instrumented_engine, "after_cursor_execute", _after_cursor_execute)
+
+def record_request_query_stats(scope):
+    """リクエスト終了時にエンドポイント別のクエリ数を集計し、N+1の疑いがあれば警告"""
+    endpoint = _query_endpoint(scope)
+    stats = query_stats["endpoints"].setdefault(
+        endpoint, {"requests": 0, "queries": 0, "total_ms": 0.0, "max_queries": 0, "flagged": 0}
+    )
+    stats["requests"] += 1
+    stats["queries"] += scope["count"]
+    stats["total_ms"] += scope["total_ms"]
+    stats["max_queries"] = max(stats["max_queries"], scope["count"])
+    if scope["count"] > QUERY_COUNT_WARNING_THRESHOLD:
+        stats["flagged"] += 1
+        print(f"DEBUG: N+1の疑い endpoint={endpoint} queries={scope['count']} db_time={scope['total_ms']:.1f}ms")
+
+class QueryInstrumentationMiddleware:
+    """リクエストごとにクエリ計測スコープを設定するASGIミドルウェア（ストリーミング応答の送信完了まで計測）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        query_scope = {"asgi_scope": scope, "count": 0, "total_ms": 0.0}
+        token = current_query_scope.set(query_scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_query_scope.reset(token)
+            record_request_query_stats(query_scope)
+
 # データベースモデル定義
 class User(Base):
     __tablename__ = "users"
@@ -111,10 +320,20 @@ class KanteiRecord(Base):
     client_email = Column(String(255), nullable=True)
     client_info = Column(JSON, nullable=False)
     calculation_result = Column(JSON, nullable=False)
+    # 検索用の正規化済み氏名（SQLiteはFTS5、PostgreSQLはpg_trgmインデックスをマイグレーションで作成）
+    search_text = Column(Text, nullable=True)
+    # 一覧表示・絞り込み用のサマリー列（client_info / calculation_result から非正規化）
+    diagnosis_pattern = Column(String(20), nullable=True, index=True)
+    honmeisei = Column(String(20), nullable=True, index=True)
+    getsumeisei = Column(String(20), nullable=True, index=True)
+    seimei_score = Column(Integer, nullable=True, index=True)
     pdf_url = Column(String(500), nullable=True)
     pdf_file_size = Column(Integer, nullable=True)
     pdf_generated_at = Column(DateTime, nullable=True)
     status = Column(String(50), default="created", nullable=False)
+    # 診断処理のリース（処理中は定期的に更新。途絶えた記録はスイーパーが再実行または失敗にする）
+    processing_heartbeat_at = Column(DateTime, nullable=True)
+    processing_attempts = Column(Integer, default=0, server_default="0", nullable=False)
     custom_message = Column(Text, nullable=True)
     appraiser_comment = Column(String(500), nullable=True, comment="鑑定士コメント（2-3行）")
     created_at = Column(DateTime, default=func.now(), nullable=False)
@@ -122,16 +341,22 @@ class KanteiRecord(Base):
     deleted_at = Column(DateTime, nullable=True)
     user = relationship("User", back_populates="kantei_records")
 
+    __table_args__ = (
+        # 一覧取得（user_id + created_at のキーセットページング）用の複合インデックス
+        Index("idx_kantei_user_created", "user_id", "created_at"),
+        # 処理中レコードのみを対象とする部分インデックス（スイーパー用）
+        Index(
+            "idx_kantei_processing_heartbeat",
+            "processing_heartbeat_at",
+            sqlite_where=text("status = 'processing'"),
+            postgresql_where=text("status = 'processing'"),
+        ),
+    )
+
 # データベースセッション管理
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
-
-def get_database_session():
-    return SessionLocal()
 
 # 認証関数
 def verify_password(plain_password, hashed_password):
@@ -140,6 +365,23 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    """verify_password をスレッドプールで実行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """get_password_hash をスレッドプールで実行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hash_executor, get_password_hash, password)
+
+async def verify_and_update_password_async(plain_password, hashed_password):
+    """検証し、コスト変更などで再ハッシュが必要なら新しいハッシュも返す (verified, new_hash)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        password_hash_executor, pwd_context.verify_and_update, plain_password, hashed_password
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -150,7 +392,46 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# 認証済みユーザー（プリンシパル）の短期キャッシュ
+# キーはトークンの subject（email）。パスワード変更・無効化・管理者昇格時に破棄する
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+principal_cache: Dict[str, Any] = {}
+
+
+def build_token_claims(user: User) -> dict:
+    """アクセストークンに埋め込むユーザー識別・ロールのクレーム"""
+    return {
+        "sub": user.email,
+        "uid": user.id,
+        "role": "admin" if user.is_superuser else "user",
+    }
+
+
+def invalidate_user_principal(email: Optional[str]):
+    """キャッシュ済みプリンシパルを破棄（次のリクエストでDBから再読み込み）"""
+    if email:
+        principal_cache.pop(email, None)
+
+
+def _cache_user_principal(email: str, user: User):
+    if len(principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in principal_cache.items() if expires_at < now]:
+            principal_cache.pop(key, None)
+        while len(principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+            # 挿入順が最も古いエントリから削除
+            principal_cache.pop(next(iter(principal_cache)))
+    principal_cache[email] = (time.monotonic() + PRINCIPAL_CACHE_TTL_SECONDS, user)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_principal_on_user_update(mapper, connection, target):
+    """ORM経由でユーザーが更新された場合（権限変更・無効化など）はキャッシュを破棄"""
+    invalidate_user_principal(target.email)
+
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -163,15 +444,31 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-
-    db = get_database_session()
-    user = db.query(User).filter(User.email == email).first()
-    db.close()
-    if user is None:
+    user_id = payload.get("uid")
+
+    cached = principal_cache.get(email)
+    if cached is not None:
+        expires_at, user = cached
+        # uid クレームがあれば一致も確認（同じメールで再登録されたユーザーとの取り違え防止）
+        if expires_at >= time.monotonic() and (user_id is None or user.id == user_id):
+            return user
+        principal_cache.pop(email, None)
+
+    async with AsyncSessionLocal() as db:
+        if user_id is not None:
+            user = await db.get(User, user_id)
+            if user is not None and user.email != email:
+                user = None
+        else:
+            # uid クレームを持たない旧形式のトークン
+            result = await db.execute(select(User).where(User.email == email))
+            user = result.scalar_one_or_none()
+    if user is None or not user.is_active:
         raise credentials_exception
+    _cache_user_principal(email, user)
     return user
 
-def get_current_admin_user(current_user: User = Depends(get_current_user)):
+async def get_current_admin_user(current_user: User = Depends(get_current_user)):
     if not current_user.is_superuser:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -221,8 +518,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# クエリ計測
+app.add_middleware(QueryInstrumentationMiddleware)
+
+# SQLiteメンテナンスタスク（SQLite使用時のみ）
+sqlite_maintenance_task = None
+
+@app.on_event("startup")
+async def start_sqlite_maintenance():
+    global sqlite_maintenance_task
+    if ASYNC_DATABASE_URL.startswith("sqlite") and SQLITE_MAINTENANCE_INTERVAL_SECONDS > 0:
+        sqlite_maintenance_task = asyncio.create_task(sqlite_maintenance_loop())
+
+@app.on_event("shutdown")
+async def stop_sqlite_maintenance():
+    if sqlite_maintenance_task:
+        sqlite_maintenance_task.cancel()
+        try:
+            # 終了時にWALを本体へ書き戻して切り詰める
+            await run_sqlite_maintenance("TRUNCATE")
+        except Exception as e:
+            print(f"SQLiteメンテナンスエラー: {str(e)}")
+
 # 静的ファイル配信設定
-app.mount("/static", StaticFiles(directory="/tmp/pdf_storage"), name="static")
+# 旧バージョンが /static で公開していたPDFの置き場（現在は書き込まず、保持管理で残ったファイルを削除するだけ）
+PDF_STORAGE_DIR = "/tmp/pdf_storage"
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 # Puppeteerブリッジのパス
@@ -254,6 +574,13 @@ class DiagnosisResult(BaseModel):
     status: str  # "processing", "completed", "failed"
     error_message: Optional[str] = None
 
+class BulkReportRequest(BaseModel):
+    ids: Optional[List[int]] = None  # 省略時は条件（diagnosis_pattern / 日付）に一致する完了済みの鑑定書すべて
+    format: str = "pdf"  # "pdf" または "docx"
+    diagnosis_pattern: Optional[str] = None
+    date_from: Optional[str] = None  # YYYY-MM-DD
+    date_to: Optional[str] = None    # YYYY-MM-DD
+
 # テンプレート設定関連モデル
 class TemplateSettingsUpdate(BaseModel):
     business_name: Optional[str] = None
@@ -305,12 +632,148 @@ def _convert_font_size_to_scale(font_size):
     else:  # medium or default
         return "1.0"
 
-def get_user_template_settings(user_id: int):
-    """ユーザーのテンプレート設定を取得（存在しない場合はデフォルト設定を作成）"""
-    db = get_database_session()
+# テンプレート設定キャッシュ
+# キーは user_id + settings_version。更新時に settings_version を上げ、ユーザーごとの
+# 現行バージョンを指すポインタを書き換えることで、古い読み取り結果の書き戻しを防ぐ
+TEMPLATE_SETTINGS_CACHE_TTL_SECONDS = int(os.getenv("TEMPLATE_SETTINGS_CACHE_TTL_SECONDS", "300"))
+# "memory"（プロセス内）または "redis"（複数ワーカー構成で共有）
+TEMPLATE_SETTINGS_CACHE_BACKEND = os.getenv("TEMPLATE_SETTINGS_CACHE_BACKEND", "memory")
+# プロセス内キャッシュの最大件数（ポインタとデータで1ユーザー2件）
+TEMPLATE_SETTINGS_CACHE_MAX_ENTRIES = int(os.getenv("TEMPLATE_SETTINGS_CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class TemplateSettingsCache:
+    """テンプレート設定のリードスルーキャッシュ（プロセス内 or Redis）"""
+
+    def __init__(self, ttl_seconds: int, backend: str = "memory", redis_url: Optional[str] = None, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # 書き込み順に並ぶ（TTLは一律のため先頭ほど先に期限切れになる）
+        self.entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.redis = None
+        if backend == "redis":
+            try:
+                import redis.asyncio as redis_asyncio
+                self.redis = redis_asyncio.from_url(redis_url, decode_responses=True)
+                print(f"DEBUG: テンプレート設定キャッシュ: Redis を使用 ({redis_url})")
+            except ImportError:
+                print("DEBUG: redis パッケージが無いため、テンプレート設定キャッシュはプロセス内で動作します")
+
+    @staticmethod
+    def _pointer_key(user_id: int) -> str:
+        return f"template_settings:{user_id}:version"
+
+    @staticmethod
+    def _data_key(user_id: int, version: str) -> str:
+        return f"template_settings:{user_id}:{version}"
+
+    async def _get(self, key: str) -> Optional[str]:
+        if self.redis is not None:
+            return await self.redis.get(key)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self.entries.pop(key, None)
+            return None
+        return value
+
+    async def _set(self, key: str, value: str, only_if_absent: bool = False):
+        if self.redis is not None:
+            await self.redis.set(key, value, ex=self.ttl_seconds, nx=only_if_absent)
+            return
+        if only_if_absent and await self._get(key) is not None:
+            return
+        now = time.monotonic()
+        self.entries[key] = (now + self.ttl_seconds, value)
+        self.entries.move_to_end(key)
+        # 読まれないまま期限切れになったエントリと、上限を超えた古いエントリを書き込み時に捨てる
+        while self.entries:
+            oldest_key, (expires_at, _) = next(iter(self.entries.items()))
+            if expires_at >= now and len(self.entries) <= self.max_entries:
+                break
+            self.entries.pop(oldest_key)
+
+    async def _delete(self, key: str):
+        if self.redis is not None:
+            await self.redis.delete(key)
+        else:
+            self.entries.pop(key, None)
+
+    async def get(self, user_id: int) -> Optional[dict]:
+        try:
+            version = await self._get(self._pointer_key(user_id))
+            if version is None:
+                return None
+            cached = await self._get(self._data_key(user_id, version))
+            # JSONで保持しているため、呼び出し側が変更してもキャッシュは汚れない
+            return json.loads(cached) if cached is not None else None
+        except Exception as e:
+            print(f"DEBUG: テンプレート設定キャッシュ読み取り失敗（DBにフォールバック）: {e}")
+            return None
+
+    async def put(self, user_id: int, settings: dict, authoritative: bool):
+        """キャッシュに格納する。authoritative=False（読み取り経路）では既存ポインタを上書きしない"""
+        try:
+            version = settings["settings_version"]
+            if authoritative:
+                # 旧バージョンのエントリは参照されなくなるため削除
+                previous = await self._get(self._pointer_key(user_id))
+                if previous is not None and previous != version:
+                    await self._delete(self._data_key(user_id, previous))
+            await self._set(self._data_key(user_id, version), json.dumps(settings, ensure_ascii=False))
+            await self._set(self._pointer_key(user_id), version, only_if_absent=not authoritative)
+        except Exception as e:
+            print(f"DEBUG: テンプレート設定キャッシュ書き込み失敗: {e}")
+
+
+template_settings_cache = TemplateSettingsCache(
+    TEMPLATE_SETTINGS_CACHE_TTL_SECONDS, TEMPLATE_SETTINGS_CACHE_BACKEND, REDIS_URL, TEMPLATE_SETTINGS_CACHE_MAX_ENTRIES
+)
+
+
+def _next_settings_version(version: Optional[str]) -> str:
+    """settings_version を1つ進める（"1.0" → "1.1" → ... → "1.10"）"""
     try:
+        major, minor = str(version or "1.0").split(".", 1)
+        return f"{int(major)}.{int(minor) + 1}"
+    except ValueError:
+        return "1.1"
+
+
+def _template_settings_to_dict(settings: TemplateSettingsDB) -> dict:
+    """Pydanticモデル形式で返す（フロントエンドの期待するフィールド名に合わせる）"""
+    return {
+        "business_name": settings.business_name,
+        "operator_name": settings.operator_name,
+        "color_theme": settings.color_theme,
+        "font_family": settings.font_family,
+        "font_size": _convert_font_scale_to_size(settings.font_scale),  # font_scaleをfont_sizeとして返す
+        "layout_style": settings.layout_style,
+        "logo_url": settings.logo_url,
+        "custom_css": settings.custom_css,
+        # フロントエンドが期待する追加フィールド
+        "diagnosis_title": settings.diagnosis_title or "鑑定書",  # 専用フィールドから読み込み
+        "primary_color": "#2c3e50",  # デフォルト値
+        "accent_color": "#34495e",   # デフォルト値
+        "title_font": settings.title_font or "default",   # 専用フィールドから読み込み
+        "body_font": settings.body_font or "default",     # 専用フィールドから読み込み
+        "settings_version": settings.settings_version or "1.0",
+    }
+
+async def get_user_template_settings(user_id: int, use_cache: bool = True):
+    """ユーザーのテンプレート設定を取得（存在しない場合はデフォルト設定を作成）"""
+    if use_cache:
+        cached = await template_settings_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+    async with AsyncSessionLocal() as db:
         print(f"DEBUG: 設定取得 user_id={user_id}")
-        settings = db.query(TemplateSettingsDB).filter(TemplateSettingsDB.user_id == user_id).first()
+        result = await db.execute(select(TemplateSettingsDB).where(TemplateSettingsDB.user_id == user_id))
+        settings = result.scalar_one_or_none()
 
         if not settings:
             # 設定が存在しない場合はデフォルトを作成
@@ -325,37 +788,22 @@ def get_user_template_settings(user_id: int):
                 layout_style="standard"
             )
             db.add(settings)
-            db.commit()
-            db.refresh(settings)
+            await db.commit()
+            await db.refresh(settings)
         else:
             print(f"DEBUG: 既存設定を読み込み: color_theme={settings.color_theme}, font_family={settings.font_family}, font_scale={settings.font_scale}, title_font={settings.title_font}, body_font={settings.body_font}, custom_css={settings.custom_css}")
 
-        # Pydanticモデル形式で返す（フロントエンドの期待するフィールド名に合わせる）
-        return {
-            "business_name": settings.business_name,
-            "operator_name": settings.operator_name,
-            "color_theme": settings.color_theme,
-            "font_family": settings.font_family,
-            "font_size": _convert_font_scale_to_size(settings.font_scale),  # font_scaleをfont_sizeとして返す
-            "layout_style": settings.layout_style,
-            "logo_url": settings.logo_url,
-            "custom_css": settings.custom_css,
-            # フロントエンドが期待する追加フィールド
-            "diagnosis_title": settings.diagnosis_title or "鑑定書",  # 専用フィールドから読み込み
-            "primary_color": "#2c3e50",  # デフォルト値
-            "accent_color": "#34495e",   # デフォルト値
-            "title_font": settings.title_font or "default",   # 専用フィールドから読み込み
-            "body_font": settings.body_font or "default"      # 専用フィールドから読み込み
-        }
-    finally:
-        db.close()
+        user_settings = _template_settings_to_dict(settings)
+
+    await template_settings_cache.put(user_id, user_settings, authoritative=False)
+    return dict(user_settings)
 
-def update_user_template_settings(user_id: int, settings_update: dict):
+async def update_user_template_settings(user_id: int, settings_update: dict):
     """ユーザーのテンプレート設定を更新"""
-    db = get_database_session()
-    try:
+    async with AsyncSessionLocal() as db:
         print(f"DEBUG: user_id={user_id}, settings_update={settings_update}")
-        settings = db.query(TemplateSettingsDB).filter(TemplateSettingsDB.user_id == user_id).first()
+        result = await db.execute(select(TemplateSettingsDB).where(TemplateSettingsDB.user_id == user_id))
+        settings = result.scalar_one_or_none()
 
         if not settings:
             # 設定が存在しない場合は新規作成
@@ -393,59 +841,245 @@ def update_user_template_settings(user_id: int, settings_update: dict):
                     setattr(settings, key, value or "")
                 print(f"DEBUG: {key} に設定: {value}")
 
-        db.commit()
-        db.refresh(settings)
-        print(f"DEBUG: データベース保存完了")
+        # 更新ごとに settings_version を進め、キャッシュの現行バージョンを差し替える
+        settings.settings_version = _next_settings_version(settings.settings_version)
+        await db.commit()
+        await db.refresh(settings)
+        print(f"DEBUG: データベース保存完了 settings_version={settings.settings_version}")
+        user_settings = _template_settings_to_dict(settings)
+
+    await template_settings_cache.put(user_id, user_settings, authoritative=True)
+    # 旧バージョンの設定で生成した鑑定書キャッシュは使われなくなるため削除
+    purge_report_artifacts(user_id)
+    return dict(user_settings)
 
-        # Pydanticモデル形式で返す（フロントエンドの期待するフィールド名に合わせる）
-        return {
-            "business_name": settings.business_name,
-            "operator_name": settings.operator_name,
-            "color_theme": settings.color_theme,
-            "font_family": settings.font_family,
-            "font_size": _convert_font_scale_to_size(settings.font_scale),  # font_scaleをfont_sizeとして返す
-            "layout_style": settings.layout_style,
-            "logo_url": settings.logo_url,
-            "custom_css": settings.custom_css,
-            # フロントエンドが期待する追加フィールド
-            "diagnosis_title": settings.diagnosis_title or "鑑定書",  # 専用フィールドから読み込み
-            "primary_color": "#2c3e50",  # デフォルト値
-            "accent_color": "#34495e",   # デフォルト値
-            "title_font": settings.title_font or "default",   # 専用フィールドから読み込み
-            "body_font": settings.body_font or "default"      # 専用フィールドから読み込み
-        }
-    finally:
-        db.close()
 
 # データベースヘルパー関数
-def get_kantei_record_by_id(db, record_id: int):
+def normalize_search_text(value: Optional[str]) -> str:
+    """氏名検索用に正規化（全角半角統一・カタカナ→ひらがな・空白除去・小文字化）"""
+    normalized = unicodedata.normalize("NFKC", value or "")
+    normalized = "".join(
+        chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch
+        for ch in normalized
+    )
+    return re.sub(r"\s+", "", normalized).lower()
+
+def build_search_text(client_name: Optional[str], name_for_seimei: Optional[str] = None) -> str:
+    """client_name と姓名判断用の名前から search_text 列の値を生成"""
+    parts = []
+    for name in (client_name, name_for_seimei):
+        normalized = normalize_search_text(name)
+        if normalized and normalized not in parts:
+            parts.append(normalized)
+    return " ".join(parts)
+
+def parse_seimei_score(value) -> Optional[int]:
+    """総評点数を整数に変換（"未取得" などは None）"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    match = re.search(r"\d+", str(value or ""))
+    return int(match.group()) if match else None
+
+def build_diagnosis_summary(calculation_result: Optional[dict]) -> dict:
+    """calculation_result からサマリー列（本命星・月命星・総評点数）の値を生成"""
+    calculation_result = calculation_result or {}
+    kyusei = calculation_result.get("kyusei") or {}
+    seimei_data = (calculation_result.get("seimei") or {}).get("data") or {}
+    return {
+        "honmeisei": kyusei.get("honmeisei") or None,
+        "getsumeisei": kyusei.get("getsumeisei") or None,
+        "seimei_score": parse_seimei_score(seimei_data.get("総評点数")),
+    }
+
+async def get_kantei_record_by_id(db, record_id: int):
     """IDで鑑定記録を取得"""
-    return db.query(KanteiRecord).filter(KanteiRecord.id == record_id).first()
+    result = await db.execute(select(KanteiRecord).where(KanteiRecord.id == record_id))
+    return result.scalar_one_or_none()
 
-def create_kantei_record(db, user_id: int, client_name: str, request_data):
+async def create_kantei_record(db, user_id: int, client_name: str, request_data):
     """新しい鑑定記録を作成"""
 
+    name_for_seimei = getattr(request_data, 'name', None) or getattr(request_data, 'name_for_seimei', None)
+    diagnosis_pattern = getattr(request_data, 'diagnosis_pattern', 'all')
+
     kantei_record = KanteiRecord(
         user_id=user_id,
         client_name=client_name,
         client_email=None,
+        search_text=build_search_text(client_name, name_for_seimei),
+        diagnosis_pattern=diagnosis_pattern or "all",
         client_info={
             "name": client_name,
             "birth_date": request_data.birth_date,
             "gender": request_data.gender,
-            "name_for_seimei": getattr(request_data, 'name', None) or getattr(request_data, 'name_for_seimei', None),
-            "diagnosis_pattern": getattr(request_data, 'diagnosis_pattern', 'all'),
+            "name_for_seimei": name_for_seimei,
+            "diagnosis_pattern": diagnosis_pattern,
             "birth_time": getattr(request_data, 'birth_time', None)
         },
         calculation_result={},
-        status="processing"
+        status="processing",
+        processing_heartbeat_at=datetime.utcnow()
     )
 
     db.add(kantei_record)
-    db.commit()
-    db.refresh(kantei_record)
+    await db.commit()
+    await db.refresh(kantei_record)
     return kantei_record
 
+# 診断一覧のページング設定
+DIAGNOSIS_LIST_DEFAULT_LIMIT = int(os.getenv("DIAGNOSIS_LIST_DEFAULT_LIMIT", "50"))
+DIAGNOSIS_LIST_MAX_LIMIT = int(os.getenv("DIAGNOSIS_LIST_MAX_LIMIT", "200"))
+
+def encode_diagnosis_cursor(created_at: datetime, record_id: int) -> str:
+    """一覧の最終行 (created_at, id) を不透明なカーソル文字列に変換"""
+    raw = f"{created_at.isoformat()}|{record_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_diagnosis_cursor(cursor: str):
+    """カーソル文字列を (created_at, id) に復元（不正な場合は ValueError）"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at_text, record_id_text = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at_text), int(record_id_text)
+    except Exception:
+        raise ValueError("無効なカーソルです")
+
+def parse_date_filter(value: Optional[str], field_name: str):
+    """YYYY-MM-DD形式の日付フィルタを datetime に変換（不正な場合は ValueError）"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError(f"{field_name} はYYYY-MM-DD形式で指定してください")
+
+# 氏名検索設定（FTS5 trigram は3文字未満の検索語に使えないため LIKE にフォールバック）
+KANTEI_SEARCH_FTS_TABLE = "kantei_records_fts"
+SEARCH_MIN_FTS_LENGTH = 3
+_sqlite_fts_available = None
+
+async def is_sqlite_fts_available(db) -> bool:
+    """SQLiteでFTS5検索テーブルが作成済みか確認（結果はプロセス内でキャッシュ）"""
+    global _sqlite_fts_available
+    if _sqlite_fts_available is None:
+        result = await db.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": KANTEI_SEARCH_FTS_TABLE}
+        )
+        _sqlite_fts_available = result.first() is not None
+    return _sqlite_fts_available
+
+async def apply_name_search(query, db, search: str):
+    """
+    client_name / 姓名判断用の名前による部分一致検索条件を追加
+
+    SQLite: FTS5 (trigram) の MATCH でrowidを絞り込む
+    PostgreSQL: search_text の LIKE（pg_trgm GINインデックスが使われる）
+    """
+    normalized = normalize_search_text(search)
+    if not normalized:
+        return query
+
+    dialect = async_engine.dialect.name
+    if (dialect == "sqlite" and len(normalized) >= SEARCH_MIN_FTS_LENGTH
+            and await is_sqlite_fts_available(db)):
+        fts_query = '"' + normalized.replace('"', '""') + '"'
+        matched_ids = text(
+            f"SELECT rowid FROM {KANTEI_SEARCH_FTS_TABLE} WHERE {KANTEI_SEARCH_FTS_TABLE} MATCH :fts_query"
+        ).bindparams(fts_query=fts_query).columns(column("rowid"))
+        return query.where(KanteiRecord.id.in_(matched_ids))
+
+    return query.where(KanteiRecord.search_text.contains(normalized, autoescape=True))
+
+async def query_diagnosis_page(db, user_id: int, limit: int, cursor: Optional[str] = None,
+                         status_filter: Optional[str] = None,
+                         date_from: Optional[str] = None, date_to: Optional[str] = None,
+                         search: Optional[str] = None,
+                         honmeisei: Optional[str] = None,
+                         diagnosis_pattern: Optional[str] = None,
+                         min_score: Optional[int] = None, max_score: Optional[int] = None):
+    """
+    鑑定記録一覧を1ページ分取得（キーセットページング）
+
+    idx_kantei_user_created (user_id, created_at) を使うため、並び順は
+    created_at DESC, id DESC で固定し、JSON列は読み込まない（表示・絞り込みはサマリー列を使用）。
+    戻り値: (行リスト, 次ページのカーソル or None)
+    """
+    query = select(
+        KanteiRecord.id,
+        KanteiRecord.client_name,
+        KanteiRecord.created_at,
+        KanteiRecord.status,
+        KanteiRecord.diagnosis_pattern,
+        KanteiRecord.honmeisei,
+        KanteiRecord.getsumeisei,
+        KanteiRecord.seimei_score
+    ).where(KanteiRecord.user_id == user_id)
+
+    if status_filter:
+        query = query.where(KanteiRecord.status == status_filter)
+
+    if honmeisei:
+        query = query.where(KanteiRecord.honmeisei == honmeisei)
+
+    if diagnosis_pattern:
+        query = query.where(KanteiRecord.diagnosis_pattern == diagnosis_pattern)
+
+    if min_score is not None:
+        query = query.where(KanteiRecord.seimei_score >= min_score)
+
+    if max_score is not None:
+        query = query.where(KanteiRecord.seimei_score <= max_score)
+
+    if search:
+        query = await apply_name_search(query, db, search)
+
+    start = parse_date_filter(date_from, "date_from")
+    if start:
+        query = query.where(KanteiRecord.created_at >= start)
+
+    end = parse_date_filter(date_to, "date_to")
+    if end:
+        # date_to はその日の終わりまでを含める
+        query = query.where(KanteiRecord.created_at < end + timedelta(days=1))
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_diagnosis_cursor(cursor)
+        query = query.where(or_(
+            KanteiRecord.created_at < cursor_created_at,
+            and_(KanteiRecord.created_at == cursor_created_at, KanteiRecord.id < cursor_id)
+        ))
+
+    # 1件多く取得して次ページの有無を判定
+    result = await db.execute(query.order_by(
+        KanteiRecord.created_at.desc(),
+        KanteiRecord.id.desc()
+    ).limit(limit + 1))
+    rows = result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_diagnosis_cursor(last.created_at, last.id)
+
+    return rows, next_cursor
+
+def diagnosis_list_item(record) -> dict:
+    """一覧・検索APIのレスポンス行（フロントエンド互換形式）"""
+    return {
+        "id": str(record.id),  # 数値IDを文字列に変換
+        "client_name": record.client_name,
+        "created_at": record.created_at.isoformat(),
+        "status": record.status,
+        "diagnosis_pattern": record.diagnosis_pattern or "all",
+        "honmeisei": record.honmeisei,
+        "getsumeisei": record.getsumeisei,
+        "seimei_score": record.seimei_score
+    }
+
 @app.get("/")
 async def root():
     return {"message": "診断鑑定システム API - 動作中"}
@@ -458,15 +1092,16 @@ async def health_check():
 @app.post("/api/auth/register", response_model=dict)
 async def register(user: UserCreate):
     """ユーザー登録"""
-    db = get_database_session()
+    db = AsyncSessionLocal()
     try:
         # 既存ユーザーチェック
-        existing_user = db.query(User).filter(User.email == user.email).first()
+        result = await db.execute(select(User).where(User.email == user.email))
+        existing_user = result.scalar_one_or_none()
         if existing_user:
             raise HTTPException(status_code=400, detail="Email already registered")
 
         # パスワードハッシュ化
-        hashed_password = get_password_hash(user.password)
+        hashed_password = await get_password_hash_async(user.password)
 
         # ユーザー作成
         db_user = User(
@@ -479,8 +1114,8 @@ async def register(user: UserCreate):
             subscription_status="active"
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
 
         return {
             "success": True,
@@ -489,26 +1124,37 @@ async def register(user: UserCreate):
             "email": db_user.email
         }
     finally:
-        db.close()
+        await db.close()
 
 @app.post("/api/auth/login", response_model=Token)
 async def login(user_credentials: UserLogin):
     """ログイン"""
-    db = get_database_session()
+    db = AsyncSessionLocal()
     try:
         # ユーザー認証
-        user = db.query(User).filter(User.email == user_credentials.email).first()
-        if not user or not verify_password(user_credentials.password, user.hashed_password):
+        result = await db.execute(select(User).where(User.email == user_credentials.email))
+        user = result.scalar_one_or_none()
+        verified, new_hash = (False, None)
+        if user:
+            verified, new_hash = await verify_and_update_password_async(user_credentials.password, user.hashed_password)
+        if not verified:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect email or password",
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
+        # BCRYPT_ROUNDS 変更後の初回ログインで再ハッシュ
+        if new_hash:
+            print(f"DEBUG: パスワードハッシュを再計算 user_id={user.id}")
+            await db.execute(update(User).where(User.id == user.id).values(hashed_password=new_hash))
+            await db.commit()
+            invalidate_user_principal(user.email)
+
         # JWTトークン作成
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data=build_token_claims(user), expires_delta=access_token_expires
         )
 
         return {
@@ -518,7 +1164,7 @@ async def login(user_credentials: UserLogin):
             "email": user.email
         }
     finally:
-        db.close()
+        await db.close()
 
 @app.post("/api/auth/logout")
 async def logout():
@@ -533,35 +1179,37 @@ async def verify_auth(current_user: User = Depends(get_current_user)):
 @app.post("/api/auth/change-password")
 async def change_password(password_data: PasswordChangeRequest, current_user: User = Depends(get_current_user)):
     """パスワード変更"""
-    db = get_database_session()
+    db = AsyncSessionLocal()
     try:
         # 現在のパスワードを確認
-        if not verify_password(password_data.current_password, current_user.hashed_password):
+        if not await verify_password_async(password_data.current_password, current_user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Current password is incorrect"
             )
 
         # 新しいパスワードをハッシュ化
-        new_hashed_password = get_password_hash(password_data.new_password)
+        new_hashed_password = await get_password_hash_async(password_data.new_password)
 
-        # パスワードを更新
-        current_user.hashed_password = new_hashed_password
-        db.add(current_user)
-        db.commit()
+        # パスワードを更新（current_userは別セッションで取得済みのためUPDATE文で更新）
+        await db.execute(
+            update(User).where(User.id == current_user.id).values(hashed_password=new_hashed_password)
+        )
+        await db.commit()
+        invalidate_user_principal(current_user.email)
 
         return {
             "success": True,
             "message": "Password changed successfully"
         }
     finally:
-        db.close()
+        await db.close()
 
 # テンプレート設定エンドポイント（簡単な実装）
 @app.get("/api/template/settings")
 async def get_template_settings(current_user: User = Depends(get_current_user)):
     """テンプレート設定取得エンドポイント（ユーザー固有）"""
-    user_settings = get_user_template_settings(current_user.id)
+    user_settings = await get_user_template_settings(current_user.id)
     return user_settings
 
 @app.put("/api/template/update")
@@ -569,7 +1217,7 @@ async def update_template_settings(settings: TemplateSettingsUpdate, current_use
     """テンプレート設定更新エンドポイント（ユーザー固有）"""
 
     # ユーザー固有の設定を更新
-    updated_settings = update_user_template_settings(
+    updated_settings = await update_user_template_settings(
         current_user.id,
         settings.dict(exclude_unset=True)
     )
@@ -580,74 +1228,171 @@ async def update_template_settings(settings: TemplateSettingsUpdate, current_use
         "data": updated_settings
     }
 
+# ロゴアップロード設定
+LOGO_UPLOAD_DIR = "uploads/logos"
+LOGO_VARIANT_DIR = os.path.join(LOGO_UPLOAD_DIR, "variants")
+LOGO_MAX_BYTES = int(os.getenv("LOGO_MAX_BYTES", str(5 * 1024 * 1024)))
+# 展開後の画素数の上限（小さなファイルで巨大な画像を展開させる攻撃への対策）
+LOGO_MAX_PIXELS = int(os.getenv("LOGO_MAX_PIXELS", str(40_000_000)))
+LOGO_UPLOAD_CHUNK_SIZE = 64 * 1024
+LOGO_ALLOWED_TYPES = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
+LOGO_FORMAT_EXTENSIONS = {"JPEG": "jpg", "PNG": "png", "GIF": "gif", "WEBP": "webp"}
+# 派生画像: 名前 -> (最大幅, 最大高さ, 形式)
+# report は鑑定書用（40mm×20mm を約300dpiで表示できる大きさ、DOCXに埋め込めるようPNG）、thumb は画面表示用
+LOGO_VARIANTS = {
+    "report": (480, 240, "PNG"),
+    "thumb": (160, 160, "WEBP"),
+}
+LOGO_SAVE_OPTIONS = {"PNG": {"optimize": True}, "WEBP": {"quality": 85, "method": 6}}
+
+def _logo_stem(logo_url: Optional[str]) -> Optional[str]:
+    """logo_url（/uploads/logos/logo_{user_id}_{hash}.{ext}）からファイル名の拡張子なし部分を取り出す"""
+    if not logo_url:
+        return None
+    return os.path.splitext(os.path.basename(logo_url))[0] or None
+
+def logo_variant_path(stem: str, variant: str) -> str:
+    extension = LOGO_VARIANTS[variant][2].lower()
+    return os.path.join(LOGO_VARIANT_DIR, f"{stem}_{variant}.{extension}")
+
+def logo_variant_url(stem: str, variant: str) -> str:
+    return "/" + logo_variant_path(stem, variant).replace(os.sep, "/")
+
+def build_logo_variants(source_path: str, stem: str) -> dict:
+    """アップロード済みのロゴから派生画像を生成する（同じ内容のファイル名は同じになるため、既存のものは作り直さない）"""
+    os.makedirs(LOGO_VARIANT_DIR, exist_ok=True)
+    missing = [name for name in LOGO_VARIANTS if not os.path.exists(logo_variant_path(stem, name))]
+    if missing:
+        with PILImage.open(source_path) as image:
+            # アニメーションGIF等は先頭フレームのみ、EXIFの回転情報は反映する
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+            image = image.convert("RGBA" if has_alpha else "RGB")
+            for name in missing:
+                max_width, max_height, image_format = LOGO_VARIANTS[name]
+                variant = image.copy()
+                variant.thumbnail((max_width, max_height), PILImage.LANCZOS)
+                path = logo_variant_path(stem, name)
+                temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+                variant.save(temp_path, format=image_format, **LOGO_SAVE_OPTIONS[image_format])
+                os.replace(temp_path, path)
+    return {name: logo_variant_url(stem, name) for name in LOGO_VARIANTS}
+
+def remove_logo_files(logo_url: Optional[str]):
+    """ロゴ本体と派生画像を削除する（uploads/logos 以外を指す logo_url は無視）"""
+    stem = _logo_stem(logo_url)
+    if not stem:
+        return
+    upload_dir = os.path.abspath(LOGO_UPLOAD_DIR)
+    paths = [os.path.abspath(logo_url.lstrip("/").replace("/", os.sep))]
+    paths.extend(os.path.abspath(logo_variant_path(stem, name)) for name in LOGO_VARIANTS)
+    for path in paths:
+        if os.path.commonpath([upload_dir, path]) == upload_dir and os.path.isfile(path):
+            os.remove(path)
+
+def report_logo_path(logo_url: Optional[str], base_dir: Optional[str] = None) -> Optional[str]:
+    """鑑定書に埋め込むロゴのパス（鑑定書用の派生画像があればそちら、派生画像のない旧アップロードは元画像）"""
+    stem = _logo_stem(logo_url)
+    if not stem:
+        return None
+    for relative_path in (logo_variant_path(stem, "report"), logo_url.lstrip("/")):
+        candidate = os.path.join(base_dir or os.getcwd(), relative_path)
+        if os.path.exists(candidate):
+            return os.path.abspath(candidate)
+    return None
+
 @app.post("/api/template/upload-logo")
 async def upload_logo(logo_file: UploadFile = File(...), current_user: User = Depends(get_current_user)):
-    """ロゴファイルアップロードエンドポイント（本番対応版）"""
+    """ロゴファイルアップロードエンドポイント
+
+    ファイルはチャンク単位でディスクへ書き出し、サイズ上限は読み込みながら判定する。
+    保存後に Pillow で鑑定書用・サムネイル用の派生画像を一度だけ生成する。
+    """
 
     # ファイル形式チェック
-    allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif", "image/webp"]
-    if logo_file.content_type not in allowed_types:
+    if logo_file.content_type not in LOGO_ALLOWED_TYPES:
         raise HTTPException(status_code=400, detail="対応していないファイル形式です。JPEG、PNG、GIF、WebPのみ対応しています。")
 
-    # ファイルサイズチェック (5MB制限)
-    max_size = 5 * 1024 * 1024  # 5MB
-    content = await logo_file.read()
-    if len(content) > max_size:
-        raise HTTPException(status_code=400, detail="ファイルサイズが大きすぎます。5MB以下にしてください。")
-
+    os.makedirs(LOGO_UPLOAD_DIR, exist_ok=True)
+    temp_path = os.path.join(LOGO_UPLOAD_DIR, f".upload_{current_user.id}_{uuid.uuid4().hex[:8]}.tmp")
+    digest = hashlib.sha256()
+    file_size = 0
     try:
-        # アップロードディレクトリの作成
-        upload_dir = "uploads/logos"
-        os.makedirs(upload_dir, exist_ok=True)
-
-        # ユニークなファイル名生成（セキュリティ対策）
-        file_extension = logo_file.filename.split('.')[-1].lower()
-        unique_filename = f"logo_{current_user.id}_{uuid.uuid4().hex[:8]}.{file_extension}"
-        file_path = os.path.join(upload_dir, unique_filename)
-
-        # ファイル保存
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-
-        # ロゴURL生成（相対パス）
+        with open(temp_path, "wb") as buffer:
+            while True:
+                chunk = await logo_file.read(LOGO_UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_size += len(chunk)
+                # ファイルサイズチェック（上限を超えた時点で打ち切る）
+                if file_size > LOGO_MAX_BYTES:
+                    raise HTTPException(status_code=400, detail=f"ファイルサイズが大きすぎます。{LOGO_MAX_BYTES // (1024 * 1024)}MB以下にしてください。")
+                digest.update(chunk)
+                buffer.write(chunk)
+
+        # Content-Type は申告値のため、実際に画像として読めるかを確認（拡張子も中身の形式から決める）
+        try:
+            with PILImage.open(temp_path) as image:
+                image_format = image.format
+                width, height = image.size
+        except Exception:
+            raise HTTPException(status_code=400, detail="画像ファイルとして読み込めませんでした。")
+        if image_format not in LOGO_FORMAT_EXTENSIONS:
+            raise HTTPException(status_code=400, detail="対応していないファイル形式です。JPEG、PNG、GIF、WebPのみ対応しています。")
+        if width * height > LOGO_MAX_PIXELS:
+            raise HTTPException(status_code=400, detail="画像の解像度が大きすぎます。")
+
+        # 同じ内容のファイルは同じ名前になる（派生画像の再生成を省略）
+        stem = f"logo_{current_user.id}_{digest.hexdigest()[:16]}"
+        unique_filename = f"{stem}.{LOGO_FORMAT_EXTENSIONS[image_format]}"
+        os.replace(temp_path, os.path.join(LOGO_UPLOAD_DIR, unique_filename))
         logo_url = f"/uploads/logos/{unique_filename}"
 
-        # データベースに保存（既存設定を更新）
-        update_user_template_settings(
+        variants = await asyncio.to_thread(build_logo_variants, os.path.join(LOGO_UPLOAD_DIR, unique_filename), stem)
+
+        # データベースに保存（既存設定を更新）し、差し替え前のロゴを削除
+        previous_settings = await get_user_template_settings(current_user.id, use_cache=False)
+        await update_user_template_settings(
             current_user.id,
             {"logo_url": logo_url}
         )
+        previous_url = previous_settings.get("logo_url")
+        if previous_url and previous_url != logo_url:
+            remove_logo_files(previous_url)
 
         return {
             "success": True,
             "logo_url": logo_url,
-            "file_size": len(content),
+            "report_logo_url": variants["report"],
+            "thumbnail_url": variants["thumb"],
+            "file_size": file_size,
+            "width": width,
+            "height": height,
             "message": "ロゴファイルが正常にアップロードされました"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"ロゴアップロードエラー: {str(e)}")
         raise HTTPException(status_code=500, detail="ファイルアップロードに失敗しました")
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 @app.delete("/api/template/logo")
 async def delete_logo(current_user: User = Depends(get_current_user)):
-    """ロゴファイル削除エンドポイント"""
+    """ロゴファイル削除エンドポイント（派生画像も削除）"""
     try:
-        # 現在の設定を取得
-        user_settings = get_user_template_settings(current_user.id)
+        # 現在の設定を取得（ファイル削除を伴うためキャッシュを使わずDBから読む）
+        user_settings = await get_user_template_settings(current_user.id, use_cache=False)
 
         if user_settings.get('logo_url'):
-            # ファイル削除
-            logo_path = user_settings['logo_url'].replace('/', os.sep)
-            if logo_path.startswith(os.sep):
-                logo_path = logo_path[1:]  # 先頭のスラッシュを除去
-
-            full_path = os.path.join(os.getcwd(), logo_path)
-            if os.path.exists(full_path):
-                os.remove(full_path)
+            remove_logo_files(user_settings['logo_url'])
 
             # データベースからロゴURLを削除
-            update_user_template_settings(
+            await update_user_template_settings(
                 current_user.id,
                 {"logo_url": None}
             )
@@ -702,10 +1447,9 @@ async def calculate_seimei(request: SeimeiRequest):
 @app.post("/api/diagnosis")
 async def create_diagnosis(request: DiagnosisRequest, background_tasks: BackgroundTasks, current_user: User = Depends(get_current_user)):
     """統合診断作成API（データベースのみ使用）"""
+    # データベースセッションを取得
+    db = AsyncSessionLocal()
     try:
-        # データベースセッションを取得
-        db = get_database_session()
-
         # 姓名判断用の名前を決定
         name_for_seimei = request.name or request.name_for_seimei or request.client_name
 
@@ -713,7 +1457,7 @@ async def create_diagnosis(request: DiagnosisRequest, background_tasks: Backgrou
         user_id = current_user.id
 
         # データベースに鑑定記録を作成
-        kantei_record = create_kantei_record(
+        kantei_record = await create_kantei_record(
             db=db,
             user_id=user_id,
             client_name=request.client_name,
@@ -731,8 +1475,6 @@ async def create_diagnosis(request: DiagnosisRequest, background_tasks: Backgrou
             request.birth_time
         )
 
-        db.close()
-
         return {
             "success": True,
             "diagnosis_id": str(kantei_record.id),
@@ -742,15 +1484,382 @@ async def create_diagnosis(request: DiagnosisRequest, background_tasks: Backgrou
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"診断作成エラー: {str(e)}")
+    finally:
+        await db.close()
+
+@app.get("/api/diagnosis/search")
+async def search_diagnoses(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(DIAGNOSIS_LIST_DEFAULT_LIMIT, ge=1, le=DIAGNOSIS_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    current_user: User = Depends(get_current_user)
+):
+    """クライアント名検索API（部分一致・全角半角/ひらがなカタカナ区別なし）"""
+    db = AsyncSessionLocal()
+    try:
+        rows, next_cursor = await query_diagnosis_page(
+            db,
+            current_user.id,
+            limit,
+            cursor=cursor,
+            status_filter=status_filter,
+            search=q
+        )
+
+        diagnoses = [diagnosis_list_item(record) for record in rows]
+
+        return {
+            "query": q,
+            "diagnoses": diagnoses,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"診断検索エラー: {str(e)}")
+    finally:
+        await db.close()
+
+# 診断データのエクスポート設定（サーバーサイドカーソルでバッチ単位に読み出し、一定メモリで送信）
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+# エクスポート／インポートで共通の列（id はインポート時には使用しない）
+DIAGNOSIS_EXPORT_COLUMNS = [
+    "id", "client_name", "client_email", "client_info", "calculation_result", "status",
+    "diagnosis_pattern", "honmeisei", "getsumeisei", "seimei_score",
+    "custom_message", "appraiser_comment", "created_at", "updated_at",
+]
+DIAGNOSIS_EXPORT_JSON_COLUMNS = {"client_info", "calculation_result"}
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def serialize_export_rows(rows, export_format: str, include_header: bool) -> bytes:
+    """1バッチ分の行を NDJSON または CSV のバイト列に変換"""
+    if export_format == "ndjson":
+        lines = [
+            json.dumps({name: _export_value(getattr(row, name)) for name in DIAGNOSIS_EXPORT_COLUMNS}, ensure_ascii=False)
+            for row in rows
+        ]
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if include_header:
+        # Excelで文字化けしないようBOMを付与
+        buffer.write("\ufeff")
+        writer.writerow(DIAGNOSIS_EXPORT_COLUMNS)
+    for row in rows:
+        values = []
+        for name in DIAGNOSIS_EXPORT_COLUMNS:
+            value = _export_value(getattr(row, name))
+            if name in DIAGNOSIS_EXPORT_JSON_COLUMNS:
+                value = json.dumps(value, ensure_ascii=False)
+            values.append("" if value is None else value)
+        writer.writerow(values)
+    return buffer.getvalue().encode("utf-8")
+
+async def stream_diagnosis_export(user_id: int, export_format: str, compress: bool,
+                                  status_filter: Optional[str] = None,
+                                  date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """鑑定記録をバッチ単位でストリーミング（gzip は逐次圧縮）"""
+    query = select(*(getattr(KanteiRecord, name) for name in DIAGNOSIS_EXPORT_COLUMNS)).where(
+        KanteiRecord.user_id == user_id
+    )
+    if status_filter:
+        query = query.where(KanteiRecord.status == status_filter)
+    start = parse_date_filter(date_from, "date_from")
+    if start:
+        query = query.where(KanteiRecord.created_at >= start)
+    end = parse_date_filter(date_to, "date_to")
+    if end:
+        query = query.where(KanteiRecord.created_at < end + timedelta(days=1))
+    query = query.order_by(KanteiRecord.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query)
+        first_batch = True
+        async for rows in result.partitions():
+            chunk = serialize_export_rows(rows, export_format, include_header=first_batch)
+            first_batch = False
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if first_batch and export_format == "csv":
+            # 0件でもヘッダーは出力する
+            chunk = serialize_export_rows([], export_format, include_header=True)
+            yield compressor.compress(chunk) if compressor else chunk
+
+    if compressor:
+        yield compressor.flush()
+
+@app.get("/api/diagnosis/export")
+async def export_diagnoses(
+    export_format: str = Query("ndjson", alias="format"),
+    gzip: bool = False,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """診断データ一括エクスポートAPI（NDJSON/CSV・ストリーミング）"""
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="format は ndjson または csv を指定してください")
+    try:
+        # 日付形式はストリーミング開始前に検証する
+        parse_date_filter(date_from, "date_from")
+        parse_date_filter(date_to, "date_to")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = f"diagnoses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    media_type = EXPORT_FORMATS[export_format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        stream_diagnosis_export(current_user.id, export_format, gzip, status_filter, date_from, date_to),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# 診断データのインポート設定
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_MAX_ERROR_DETAILS = 100
+# 結果付きの行で受け付けるステータス（processing はスイーパーが再計算して結果を上書きするため不可）
+IMPORT_ALLOWED_STATUSES = {"completed", "partial", "failed"}
+DIAGNOSIS_PATTERNS = {"all", "kyusei_only", "seimei_only"}
+# client_info の代わりにトップレベルで指定できる項目（他ツールからのフラットなCSV向け）
+IMPORT_CLIENT_INFO_FIELDS = ["birth_date", "gender", "name_for_seimei", "diagnosis_pattern", "birth_time"]
+
+def detect_import_format(filename: Optional[str], explicit_format: Optional[str] = None) -> str:
+    """明示指定または拡張子（.ndjson/.jsonl/.csv、.gz 可）から入力形式を判定"""
+    if explicit_format:
+        if explicit_format not in EXPORT_FORMATS:
+            raise ValueError("format は ndjson または csv を指定してください")
+        return explicit_format
+    name = (filename or "").lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".ndjson") or name.endswith(".jsonl"):
+        return "ndjson"
+    raise ValueError("ファイル形式を判定できません。format に ndjson または csv を指定してください")
+
+def open_import_stream(binary_stream):
+    """バイナリストリームをテキストとして開く（gzip は先頭バイトで判定して逐次展開）"""
+    if hasattr(binary_stream, "peek"):
+        head = binary_stream.peek(2)[:2]
+    else:
+        head = binary_stream.read(2)
+        binary_stream.seek(0)
+    if head == b"\x1f\x8b":
+        binary_stream = gzip.GzipFile(fileobj=binary_stream, mode="rb")
+    return io.TextIOWrapper(binary_stream, encoding="utf-8-sig", newline="")
+
+def iter_import_records(text_stream, import_format: str):
+    """入力を1行ずつ読み出して (行番号, dict) を返す（全体をメモリに載せない）"""
+    if import_format == "csv":
+        reader = csv.DictReader(text_stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(text_stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_number, ValueError("JSONとして解析できません")
+            continue
+        yield line_number, record
+
+def _import_json_field(value, field_name: str) -> dict:
+    if value in (None, ""):
+        return {}
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise ValueError(f"{field_name} がJSONとして解析できません")
+    if not isinstance(value, dict):
+        raise ValueError(f"{field_name} はオブジェクトで指定してください")
+    return value
+
+def _import_text_field(value, field_name: str) -> Optional[str]:
+    """文字列項目を取り出す（NDJSON で数値などが来た場合は ValueError）"""
+    if value in (None, ""):
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{field_name} は文字列で指定してください")
+    return value
+
+def validate_import_record(raw, user_id: int) -> dict:
+    """インポート行を検証し、kantei_records への INSERT 用の値に変換（不正な場合は ValueError）"""
+    if isinstance(raw, Exception):
+        raise raw
+    if not isinstance(raw, dict):
+        raise ValueError("行がオブジェクトではありません")
+
+    client_name = str(raw.get("client_name") or "").strip()
+    if not client_name:
+        raise ValueError("client_name は必須です")
+    if len(client_name) > 255:
+        raise ValueError("client_name が長すぎます（255文字以内）")
+
+    client_info = _import_json_field(raw.get("client_info"), "client_info")
+    for field in IMPORT_CLIENT_INFO_FIELDS:
+        if raw.get(field) not in (None, ""):
+            client_info[field] = raw[field]
+    for field in IMPORT_CLIENT_INFO_FIELDS:
+        _import_text_field(client_info.get(field), field)
+    client_info.setdefault("name", client_name)
+    client_info["diagnosis_pattern"] = client_info.get("diagnosis_pattern") or "all"
+
+    parse_date_filter(client_info.get("birth_date"), "birth_date")
+    if not client_info.get("birth_date"):
+        raise ValueError("birth_date は必須です")
+    if client_info.get("gender") not in ("male", "female"):
+        raise ValueError("gender は male または female を指定してください")
+    if client_info["diagnosis_pattern"] not in DIAGNOSIS_PATTERNS:
+        raise ValueError("diagnosis_pattern が不正です")
+
+    calculation_result = _import_json_field(raw.get("calculation_result"), "calculation_result")
+    if calculation_result:
+        record_status = _import_text_field(raw.get("status"), "status") or "completed"
+        if record_status == "processing":
+            raise ValueError("calculation_result がある行に status=processing は指定できません")
+        if record_status not in IMPORT_ALLOWED_STATUSES:
+            raise ValueError(f"status が不正です: {record_status}")
+    else:
+        # 結果が無い行は処理待ちとして登録し、スイーパーが順次計算する
+        record_status = "processing"
+
+    appraiser_comment = _import_text_field(raw.get("appraiser_comment"), "appraiser_comment")
+    if appraiser_comment and len(appraiser_comment) > 500:
+        raise ValueError("appraiser_comment が長すぎます（500文字以内）")
+
+    values = {
+        "user_id": user_id,
+        "client_name": client_name,
+        "client_email": _import_text_field(raw.get("client_email"), "client_email"),
+        "client_info": client_info,
+        "calculation_result": calculation_result,
+        "status": record_status,
+        "search_text": build_search_text(client_name, client_info.get("name_for_seimei")),
+        "diagnosis_pattern": client_info["diagnosis_pattern"],
+        "custom_message": _import_text_field(raw.get("custom_message"), "custom_message"),
+        "appraiser_comment": appraiser_comment,
+        **build_diagnosis_summary(calculation_result),
+    }
+    if raw.get("created_at"):
+        try:
+            values["created_at"] = datetime.fromisoformat(str(raw["created_at"]))
+        except ValueError:
+            raise ValueError("created_at はISO 8601形式で指定してください")
+    return values
+
+async def import_diagnosis_records(user_id: int, records, batch_size: int = IMPORT_BATCH_SIZE):
+    """
+    (行番号, dict) のイテレータをバッチ単位で一括INSERT（executemany）し、進捗を返す非同期ジェネレータ
+
+    バッチごとにコミットし、{"type": "progress", ...} を、最後に {"type": "summary", ...} を返す。
+    """
+    summary = {"processed": 0, "imported": 0, "queued": 0, "failed": 0, "errors": []}
+
+    def record_error(line_number, message):
+        summary["failed"] += 1
+        if len(summary["errors"]) < IMPORT_MAX_ERROR_DETAILS:
+            summary["errors"].append({"line": line_number, "error": message})
+
+    async def flush(batch):
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(KanteiRecord), [values for _, values in batch])
+                await db.commit()
+        except Exception as e:
+            # バッチ単位でロールバックされるため、バッチ内の全行を失敗として記録
+            for line_number, _ in batch:
+                record_error(line_number, f"登録エラー: {str(e)}")
+            return
+        summary["imported"] += len(batch)
+        summary["queued"] += sum(1 for _, values in batch if values["status"] == "processing")
+
+    batch = []
+    for line_number, raw in records:
+        summary["processed"] += 1
+        try:
+            batch.append((line_number, validate_import_record(raw, user_id)))
+        except (TypeError, ValueError) as e:
+            # 想定外の型による例外でもストリームを止めず、その行だけ失敗として記録
+            record_error(line_number, str(e))
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+            yield {"type": "progress", **{k: v for k, v in summary.items() if k != "errors"}}
+    if batch:
+        await flush(batch)
+
+    if summary["queued"]:
+        # 処理待ちの行はスイーパーに任せる（次回実行を待たずに1回起動）
+        task = asyncio.create_task(sweep_stuck_diagnoses())
+        requeued_diagnosis_tasks.add(task)
+        task.add_done_callback(requeued_diagnosis_tasks.discard)
+
+    yield {"type": "summary", **summary}
+
+@app.post("/api/diagnosis/import")
+async def import_diagnoses(
+    import_file: UploadFile = File(...),
+    import_format: Optional[str] = Query(None, alias="format"),
+    current_user: User = Depends(get_current_user)
+):
+    """診断データ一括インポートAPI（NDJSON/CSV、gzip可。進捗をNDJSONでストリーミング返却）"""
+    try:
+        import_format = detect_import_format(import_file.filename, import_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # UploadFile はレスポンス送信前に閉じられるため、ストリーミング処理用の一時ファイルへ移す
+    spool = tempfile.TemporaryFile()
+    while chunk := await import_file.read(1024 * 1024):
+        spool.write(chunk)
+    spool.seek(0)
+
+    async def progress_stream():
+        # 一時ファイルから行単位で読み出すため、ファイルサイズによらず一定メモリで処理できる
+        try:
+            text_stream = open_import_stream(spool)
+            records = iter_import_records(text_stream, import_format)
+            async for event_data in import_diagnosis_records(current_user.id, records):
+                yield json.dumps(event_data, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "error": f"インポートエラー: {str(e)}"}, ensure_ascii=False) + "\n"
+        finally:
+            spool.close()
+
+    return StreamingResponse(progress_stream(), media_type="application/x-ndjson")
 
 @app.get("/api/diagnosis/{diagnosis_id}")
 async def get_diagnosis(diagnosis_id: str, admin_mode: bool = True, current_user: User = Depends(get_current_user)):
     """診断結果取得API（データベース専用）"""
+    db = AsyncSessionLocal()
     try:
-        db = get_database_session()
-
         # データベースから鑑定記録を取得
-        kantei_record = get_kantei_record_by_id(db, int(diagnosis_id))
+        kantei_record = await get_kantei_record_by_id(db, int(diagnosis_id))
         if not kantei_record:
             raise HTTPException(status_code=404, detail="診断が見つかりません")
 
@@ -763,7 +1872,9 @@ async def get_diagnosis(diagnosis_id: str, admin_mode: bool = True, current_user
             "id": str(kantei_record.id),
             "client_name": kantei_record.client_name,
             "created_at": kantei_record.created_at.isoformat(),
-            "status": kantei_record.status
+            "status": kantei_record.status,
+            "pdf_file_size": kantei_record.pdf_file_size,
+            "pdf_generated_at": kantei_record.pdf_generated_at.isoformat() if kantei_record.pdf_generated_at else None
         }
 
         # クライアント基本情報（プレビュー用）
@@ -785,212 +1896,343 @@ async def get_diagnosis(diagnosis_id: str, admin_mode: bool = True, current_user
             if "seimei" in kantei_record.calculation_result:
                 result["seimei_result"] = kantei_record.calculation_result["seimei"]
 
-        db.close()
         return result
 
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="無効な診断IDです")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"診断取得エラー: {str(e)}")
+    finally:
+        await db.close()
 
 @app.get("/api/diagnosis")
-async def list_diagnoses(current_user: User = Depends(get_current_user)):
-    """診断一覧取得API（データベース連携版）"""
+async def list_diagnoses(
+    limit: int = Query(DIAGNOSIS_LIST_DEFAULT_LIMIT, ge=1, le=DIAGNOSIS_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    honmeisei: Optional[str] = None,
+    diagnosis_pattern: Optional[str] = None,
+    min_score: Optional[int] = None,
+    max_score: Optional[int] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """診断一覧取得API（キーセットページング・必要列のみ取得）"""
+    db = AsyncSessionLocal()
     try:
-        # データベースからKanteiRecordを取得
-        db = get_database_session()
-
         # 認証されたユーザーの鑑定記録のみ取得（最新順）
-        kantei_records = db.query(KanteiRecord).filter(KanteiRecord.user_id == current_user.id).order_by(KanteiRecord.created_at.desc()).all()
+        rows, next_cursor = await query_diagnosis_page(
+            db,
+            current_user.id,
+            limit,
+            cursor=cursor,
+            status_filter=status_filter,
+            date_from=date_from,
+            date_to=date_to,
+            honmeisei=honmeisei,
+            diagnosis_pattern=diagnosis_pattern,
+            min_score=min_score,
+            max_score=max_score
+        )
 
         # フロントエンド互換形式に変換
-        diagnoses = []
-        for record in kantei_records:
-            diagnoses.append({
-                "id": str(record.id),  # 数値IDを文字列に変換
-                "client_name": record.client_name,
-                "created_at": record.created_at.isoformat(),
-                "status": record.status
-            })
-
-        db.close()
+        diagnoses = [diagnosis_list_item(record) for record in rows]
 
-        return {"diagnoses": diagnoses}
+        return {
+            "diagnoses": diagnoses,
+            "next_cursor": next_cursor,
+            "has_more": next_cursor is not None
+        }
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"=== DEBUG: データベース取得エラー: {e} ===")
         raise HTTPException(status_code=500, detail=f"診断一覧取得エラー: {str(e)}")
+    finally:
+        await db.close()
 
 @app.post("/api/diagnosis/{diagnosis_id}/complete")
 async def force_complete_diagnosis(diagnosis_id: str):
     """診断を強制的に完了状態にする（デバッグ用・データベース専用）"""
+    db = AsyncSessionLocal()
     try:
-        db = get_database_session()
-        kantei_record = get_kantei_record_by_id(db, int(diagnosis_id))
+        kantei_record = await get_kantei_record_by_id(db, int(diagnosis_id))
 
         if not kantei_record:
             raise HTTPException(status_code=404, detail="診断が見つかりません")
 
         kantei_record.status = "completed"
-        db.commit()
-        db.close()
+        await db.commit()
 
         return {"success": True, "message": "診断を完了状態に設定しました"}
 
+    except HTTPException:
+        raise
     except ValueError:
         raise HTTPException(status_code=400, detail="無効な診断IDです")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"エラー: {str(e)}")
+    finally:
+        await db.close()
+
+# 常駐PDFレンダラー設定
+SYSTEM_DIR = os.getenv("SYSTEM_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "system"))
+PDF_RENDERER_SERVICE_PATH = os.getenv("PDF_RENDERER_SERVICE_PATH", os.path.join(SYSTEM_DIR, "pdf_renderer_service.js"))
+# 同時にレンダリングするPDFの数（レンダラー側のページプールのサイズと揃える）
+PDF_RENDER_CONCURRENCY = int(os.getenv("PDF_RENDER_CONCURRENCY", "2"))
+PDF_RENDER_TIMEOUT_SECONDS = float(os.getenv("PDF_RENDER_TIMEOUT_SECONDS", "60"))
+PDF_RENDERER_STARTUP_TIMEOUT_SECONDS = float(os.getenv("PDF_RENDERER_STARTUP_TIMEOUT_SECONDS", "30"))
+
+class ChromiumRenderer:
+    """常駐Chromium（system/pdf_renderer_service.js）へのPDF変換クライアント
+
+    ブラウザ起動はプロセス寿命中に1回だけ行い、リクエストは標準入力に1行1JSONで送る。
+    応答はidで対応付けるため複数のレンダリングを並行して待てる。
+    レンダラーが落ちた場合は次のリクエストで自動的に再起動する。
+    """
 
-@app.post("/api/diagnosis/{diagnosis_id}/pdf")
-async def generate_pdf(diagnosis_id: str):
-    """PDF生成API（データベース専用）"""
-    try:
-        db = get_database_session()
-        kantei_record = get_kantei_record_by_id(db, int(diagnosis_id))
+    def __init__(self, script_path: str, concurrency: int, timeout: float):
+        self.script_path = script_path
+        self.timeout = timeout
+        self.concurrency = max(1, concurrency)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.process = None
+        self.reader_task = None
+        self.ready = None
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.next_id = 0
+        self.start_lock = asyncio.Lock()
+        self.stats = {"renders": 0, "failures": 0, "restarts": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    async def _ensure_started(self):
+        async with self.start_lock:
+            if self.process and self.process.returncode is None:
+                return
+            if self.process is not None:
+                self.stats["restarts"] += 1
+                print("DEBUG: PDFレンダラーが停止していたため再起動します")
+
+            env = dict(os.environ, PDF_RENDERER_PAGES=str(self.concurrency))
+            self.process = await asyncio.create_subprocess_exec(
+                "node",
+                self.script_path,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=None,
+                cwd=os.path.dirname(self.script_path),
+                env=env,
+                limit=1024 * 1024,
+            )
+            self.ready = asyncio.get_running_loop().create_future()
+            self.reader_task = asyncio.create_task(self._read_responses(self.process, self.ready))
+            try:
+                await asyncio.wait_for(asyncio.shield(self.ready), timeout=PDF_RENDERER_STARTUP_TIMEOUT_SECONDS)
+            except Exception:
+                await self._kill()
+                raise
+            print(f"DEBUG: PDFレンダラー起動完了 (pid={self.process.pid}, pages={self.concurrency})")
+
+    async def _read_responses(self, process, ready: asyncio.Future):
+        """レンダラーの標準出力を読み、idごとの待機中Futureへ結果を渡す"""
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"DEBUG: PDFレンダラーの不正な出力: {line[:200]!r}")
+                    continue
+                if message.get("type") == "ready":
+                    if not ready.done():
+                        ready.set_result(message)
+                    continue
+                future = self.pending.pop(message.get("id"), None)
+                if future and not future.done():
+                    future.set_result(message)
+        finally:
+            await process.wait()
+            error = RuntimeError(f"PDFレンダラーが終了しました (exit={process.returncode})")
+            if not ready.done():
+                ready.set_exception(error)
+            # 終了したプロセスに送ったリクエストは全て失敗として返す
+            if process is self.process:
+                for future in self.pending.values():
+                    if not future.done():
+                        future.set_exception(error)
+                self.pending.clear()
+
+    async def _kill(self):
+        if self.process and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+    async def render(self, html_path: str, pdf_path: str) -> Dict[str, Any]:
+        """HTMLファイルをPDFに変換する（同時実行数はセマフォで制限）"""
+        queued_at = time.perf_counter()
+        async with self.semaphore:
+            started = time.perf_counter()
+            await self._ensure_started()
+            self.next_id += 1
+            request_id = self.next_id
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request_id] = future
+            request = {"id": request_id, "html_path": html_path, "pdf_path": pdf_path}
+            try:
+                self.process.stdin.write((json.dumps(request) + "\n").encode("utf-8"))
+                await self.process.stdin.drain()
+                result = await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.pending.pop(request_id, None)
+                self.stats["failures"] += 1
+                # 応答しないブラウザは作り直す
+                await self._kill()
+                raise RuntimeError(f"PDF生成がタイムアウトしました ({self.timeout:.0f}秒)")
+            except (BrokenPipeError, ConnectionResetError) as e:
+                self.pending.pop(request_id, None)
+                self.stats["failures"] += 1
+                raise RuntimeError(f"PDFレンダラーへの送信に失敗しました: {str(e)}")
+            except Exception:
+                self.pending.pop(request_id, None)
+                self.stats["failures"] += 1
+                raise
+
+        wait_ms = (started - queued_at) * 1000
+        total_ms = (time.perf_counter() - started) * 1000
+        if not result.get("success"):
+            self.stats["failures"] += 1
+            raise RuntimeError(result.get("error") or "PDF生成に失敗しました")
+
+        self.stats["renders"] += 1
+        self.stats["total_ms"] += total_ms
+        self.stats["max_ms"] = max(self.stats["max_ms"], total_ms)
+        print(
+            f"DEBUG: PDF生成 {os.path.basename(pdf_path)} "
+            f"待ち {wait_ms:.0f}ms / 変換 {result.get('render_ms', 0)}ms / 合計 {total_ms:.0f}ms / {result.get('file_size', 0)} bytes"
+        )
+        return {**result, "wait_ms": round(wait_ms, 1), "total_ms": round(total_ms, 1)}
 
-        if not kantei_record:
-            raise HTTPException(status_code=404, detail="診断が見つかりません")
+    async def close(self):
+        """標準入力を閉じてレンダラーにブラウザを終了させる"""
+        if not self.process or self.process.returncode is not None:
+            return
+        try:
+            self.process.stdin.close()
+            await asyncio.wait_for(self.process.wait(), timeout=5)
+        except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError):
+            await self._kill()
+        if self.reader_task:
+            self.reader_task.cancel()
 
-        if kantei_record.status != "completed":
-            raise HTTPException(status_code=400, detail="診断が完了していません")
-        # 簡易PDF生成（実際のPDFサービスの代わり）
-        import tempfile
-        import os
-        from datetime import datetime
+chromium_renderer = ChromiumRenderer(PDF_RENDERER_SERVICE_PATH, PDF_RENDER_CONCURRENCY, PDF_RENDER_TIMEOUT_SECONDS)
 
-        # 一時的なPDFファイルを作成
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"kantei_{diagnosis_id}_{timestamp}.pdf"
-
-        # PDFディレクトリを作成
-        pdf_dir = "/tmp/pdf_storage"
-        os.makedirs(pdf_dir, exist_ok=True)
-        pdf_path = os.path.join(pdf_dir, filename)
-
-        # 計算結果を取得
-        kyusei_data = kantei_record.calculation_result.get('kyusei', {}) if kantei_record.calculation_result else {}
-        seimei_data = kantei_record.calculation_result.get('seimei', {}) if kantei_record.calculation_result else {}
-
-        # 簡易PDF生成（HTMLからPDFに変換）
-        html_content = f"""
-        <!DOCTYPE html>
-        <html lang="ja">
-        <head>
-            <meta charset="UTF-8">
-            <title>鑑定書 - {kantei_record.client_name}様</title>
-            <style>
-                body {{ font-family: 'Yu Gothic', 'Hiragino Sans', sans-serif; margin: 40px; }}
-                .header {{ text-align: center; margin-bottom: 40px; }}
-                .title {{ font-size: 24px; font-weight: bold; }}
-                .client-info {{ margin-bottom: 30px; }}
-                .section {{ margin-bottom: 30px; }}
-                .section-title {{ font-size: 18px; font-weight: bold; color: #333; border-bottom: 2px solid #007bff; padding-bottom: 5px; }}
-                .info-item {{ margin: 10px 0; }}
-                .star-info {{ background: #f8f9fa; padding: 15px; border-radius: 5px; }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <div class="title">九星気学・姓名判断 鑑定書</div>
-                <p>鑑定日: {kantei_record.created_at.strftime('%Y年%m月%d日')}</p>
-            </div>
-
-            <div class="client-info">
-                <h2>依頼者情報</h2>
-                <div class="info-item"><strong>お名前:</strong> {kantei_record.client_name}</div>
-                <div class="info-item"><strong>生年月日:</strong> {kantei_record.client_info.get('birth_date', '未取得') if kantei_record.client_info else '未取得'}</div>
-                <div class="info-item"><strong>性別:</strong> {'男性' if kantei_record.client_info.get('gender') == 'male' else '女性' if kantei_record.client_info else '未取得'}</div>
-            </div>
-
-            <div class="section">
-                <div class="section-title">九星気学鑑定結果</div>
-                <div class="star-info">
-                    <p><strong>本命星:</strong> {kyusei_data.get('honmeisei', '未取得')}</p>
-                    <p><strong>月命星:</strong> {kyusei_data.get('getsumeisei', '未取得')}</p>
-                    <p><strong>年齢:</strong> {kyusei_data.get('age', '未取得')}歳</p>
-                </div>
-            </div>
-
-            {"<div class='section'><div class='section-title'>姓名判断結果</div><div class='star-info'><p><strong>総評点数:</strong> " + str(seimei_data.get('score', '未取得')) + "点</p></div></div>" if seimei_data else ""}
-
-            <div class="section">
-                <div class="section-title">総合鑑定</div>
-                <p>九星気学と姓名判断の結果を総合した詳細な解釈内容は、今後のアップデートで追加予定です。</p>
-            </div>
-        </body>
-        </html>
-        """
-
-        # HTMLファイルを一時保存
-        html_path = pdf_path.replace('.pdf', '.html')
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-
-        # PuppeteerでHTMLをPDFに変換
-        html_to_pdf_script = "/Users/lennon/projects/inoue4/system/html_to_pdf.js"
+@app.on_event("shutdown")
+async def stop_chromium_renderer():
+    await chromium_renderer.close()
 
-        try:
-            # Node.jsスクリプトを実行してPDFを生成
-            result = subprocess.run(
-                ["node", html_to_pdf_script, html_path, pdf_path],
-                capture_output=True,
-                text=True,
-                check=True,
-                cwd=os.path.dirname(html_to_pdf_script)
-            )
+async def render_report_pdf_chromium(report: dict, path: str) -> bytes:
+    """レイアウト別HTMLテンプレートから常駐ChromiumでPDFを生成（REPORT_PDF_RENDERER=chromium の場合）
 
-            # 成功した場合、PDFパスを設定
-            pdf_url = pdf_path
+    中間ファイルは鑑定書キャッシュ内に .tmp として置き、変換後に削除する（残った場合は保持管理が回収）。
+    """
+    temp_base = f"{path}.{uuid.uuid4().hex[:8]}"
+    html_path, pdf_path = f"{temp_base}.html.tmp", f"{temp_base}.pdf.tmp"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(html_path, "w", encoding="utf-8") as f:
+            f.write(render_report_html(report))
+        await chromium_renderer.render(html_path, pdf_path)
+        with open(pdf_path, "rb") as f:
+            return f.read()
+    finally:
+        for temp_path in (html_path, pdf_path):
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
 
-            # HTMLファイルを削除（オプション）
-            # os.unlink(html_path)
+@app.post("/api/diagnosis/{diagnosis_id}/pdf")
+async def generate_pdf(diagnosis_id: int, current_user: User = Depends(get_current_user)):
+    """PDF生成API（データベース専用）
 
-        except subprocess.CalledProcessError as e:
-            # PDF生成失敗時はHTMLのままにする
-            print(f"PDF生成エラー: {e.stderr}")
-            pdf_url = html_path
+    鑑定書キャッシュに生成するだけで、ファイルは認証付きのダウンロードAPI（pdf_url）から取得する。
+    ダウンロードAPIと同じキャッシュを使うため、続けてダウンロードしても再生成されない。
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(KanteiRecord).where(
+            KanteiRecord.id == diagnosis_id,
+            KanteiRecord.user_id == current_user.id
+        ))
+        kantei_record = result.scalar_one_or_none()
 
-        # ファイル名を適切に設定
-        if pdf_url.endswith('.pdf'):
-            actual_filename = filename
-            message = "PDF生成が完了しました"
-        else:
-            actual_filename = filename.replace('.pdf', '.html')
-            message = "PDF生成が完了しました（HTMLファイルとして生成）"
+    if not kantei_record:
+        raise HTTPException(status_code=404, detail="診断が見つかりません")
 
-        return {
-            "success": True,
-            "pdf_url": pdf_url,
-            "filename": actual_filename,
-            "message": message
-        }
+    if kantei_record.status not in ['completed', 'partial']:
+        raise HTTPException(status_code=400, detail="診断が完了していません")
 
+    try:
+        user_settings = await get_user_template_settings(current_user.id)
+        await render_report_artifact(kantei_record, user_settings, "pdf")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"PDF生成エラー: {str(e)}")
 
+    return {
+        "success": True,
+        "pdf_url": f"/api/diagnosis/{kantei_record.id}/pdf/download",
+        "filename": f"kantei_{kantei_record.id}.pdf",
+        "message": "PDF生成が完了しました"
+    }
+
 @app.get("/api/diagnosis/{diagnosis_id}/pdf/download")
-async def download_pdf(diagnosis_id: str):
-    """PDF ダウンロードAPI（データベース専用）"""
-    try:
-        db = get_database_session()
-        kantei_record = get_kantei_record_by_id(db, int(diagnosis_id))
+async def download_pdf(
+    diagnosis_id: int,
+    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
+):
+    """PDF ダウンロードAPI（データベース専用）
 
-        if not kantei_record:
-            raise HTTPException(status_code=404, detail="診断が見つかりません")
+    キャッシュ済みの鑑定書PDFをファイルのまま配信する（ETag 対応。Range / If-Range は ETag が強い場合のみ）。
+    未生成の場合はここで生成してキャッシュに保存する。
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(select(KanteiRecord).where(
+            KanteiRecord.id == diagnosis_id,
+            KanteiRecord.user_id == current_user.id
+        ))
+        kantei_record = result.scalar_one_or_none()
 
-        db.close()
+    if not kantei_record:
+        raise HTTPException(status_code=404, detail="診断が見つかりません")
 
-        # 実際の実装ではファイルの存在確認とダウンロード処理
-        return {
-            "message": "PDF ダウンロード機能は実装中です",
-            "diagnosis_id": diagnosis_id
-        }
+    if kantei_record.status not in ['completed', 'partial']:
+        raise HTTPException(status_code=400, detail="診断が完了していません")
 
-    except ValueError:
-        raise HTTPException(status_code=400, detail="無効な診断IDです")
+    try:
+        user_settings = await get_user_template_settings(current_user.id)
+        report = build_report_document(kantei_record, user_settings)
+        etag = report_etag(report_artifact_key(report, "pdf"), "pdf")
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+        pdf_path = await render_report_artifact(kantei_record, user_settings, "pdf", report, pin=True)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"エラー: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"PDF生成エラー: {str(e)}")
+
+    # FileResponse が Content-Length / Accept-Ranges / 206 部分応答を処理する（配信が終わるまで削除されない）
+    filename = urllib.parse.quote(f"kantei_{kantei_record.id}.pdf")
+    return ArtifactFileResponse(
+        pdf_path,
+        media_type=REPORT_MEDIA_TYPES["pdf"],
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{filename}",
+            "ETag": etag,
+            "Cache-Control": "private, no-cache",
+        }
+    )
 
 async def run_puppeteer_bridge(system_type: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
     """Puppeteerブリッジを実行"""
@@ -1888,14 +3130,37 @@ async def process_diagnosis(diagnosis_id: str, birth_date: str, gender: str, nam
 async def process_diagnosis_db(record_id: int, birth_date: str, gender: str, name_for_seimei: Optional[str],
                               diagnosis_pattern: str = "all", birth_time: Optional[str] = None):
     """データベース専用バックグラウンド診断処理（パターン対応版）"""
+    heartbeat_task = None
+    # このリースで書き込める条件（スイーパーに再取得された後は古い実行の結果を書き込まない）
+    lease_condition = None
     try:
-        db = get_database_session()
-
-        # 鑑定記録を取得
-        kantei_record = get_kantei_record_by_id(db, record_id)
+        # 鑑定記録を取得し、処理リースを取得（ブリッジ実行中はDB接続を保持しない）
+        async with AsyncSessionLocal() as db:
+            kantei_record = await get_kantei_record_by_id(db, record_id)
+            if kantei_record:
+                leased = await db.execute(
+                    update(KanteiRecord)
+                    .where(KanteiRecord.id == record_id, KanteiRecord.status == "processing")
+                    .values(
+                        processing_heartbeat_at=datetime.utcnow(),
+                        processing_attempts=KanteiRecord.processing_attempts + 1
+                    )
+                    .returning(KanteiRecord.processing_attempts)
+                )
+                attempt = leased.scalar_one_or_none()
+                await db.commit()
         if not kantei_record:
             print(f"鑑定記録 {record_id} が見つかりません")
             return
+        if attempt is None:
+            print(f"DEBUG: 鑑定記録 {record_id} は処理中ではないため診断をスキップしました")
+            return
+        lease_condition = and_(
+            KanteiRecord.id == record_id,
+            KanteiRecord.status == "processing",
+            KanteiRecord.processing_attempts == attempt
+        )
+        heartbeat_task = asyncio.create_task(diagnosis_heartbeat_loop(record_id))
 
         calculation_result = {}
 
@@ -2525,29 +3790,148 @@ async def process_diagnosis_db(record_id: int, birth_date: str, gender: str, nam
                 kantei_record.status = "failed"
                 print(f"鑑定記録 {record_id} は失敗（九星気学失敗）")
 
-        db.commit()
-        db.close()
+        async with AsyncSessionLocal() as db:
+            written = await db.execute(
+                update(KanteiRecord)
+                .where(lease_condition)
+                .values(
+                    calculation_result=calculation_result,
+                    status=kantei_record.status,
+                    **build_diagnosis_summary(calculation_result)
+                )
+            )
+            await db.commit()
+
+        if written.rowcount == 0:
+            print(f"DEBUG: 鑑定記録 {record_id} はリースが失われたため結果を破棄しました")
+        elif kantei_record.status in ("completed", "partial"):
+            # 完了直後にダウンロードされることが多いため、鑑定書を先に生成しておく
+            enqueue_report_prerender(record_id)
 
     except Exception as e:
         print(f"鑑定記録 {record_id} で例外が発生しました: {str(e)}")
+        if lease_condition is None:
+            return
         try:
-            db = get_database_session()
-            kantei_record = get_kantei_record_by_id(db, record_id)
-            if kantei_record:
-                kantei_record.status = "failed"
-                db.commit()
-            db.close()
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(KanteiRecord).where(lease_condition).values(status="failed")
+                )
+                await db.commit()
         except:
             pass
+    finally:
+        if heartbeat_task:
+            heartbeat_task.cancel()
+
+# 処理中のまま放置された診断の回収（プロセス停止でバックグラウンド処理が失われた場合）
+DIAGNOSIS_HEARTBEAT_INTERVAL_SECONDS = int(os.getenv("DIAGNOSIS_HEARTBEAT_INTERVAL_SECONDS", "30"))
+DIAGNOSIS_LEASE_SECONDS = int(os.getenv("DIAGNOSIS_LEASE_SECONDS", "300"))
+DIAGNOSIS_MAX_ATTEMPTS = int(os.getenv("DIAGNOSIS_MAX_ATTEMPTS", "3"))
+DIAGNOSIS_SWEEP_INTERVAL_SECONDS = int(os.getenv("DIAGNOSIS_SWEEP_INTERVAL_SECONDS", "60"))
+# 1回のスイープで再実行する最大件数（インポート直後などに大量のブリッジ処理が同時に走らないように）
+DIAGNOSIS_SWEEP_BATCH_SIZE = int(os.getenv("DIAGNOSIS_SWEEP_BATCH_SIZE", "20"))
+diagnosis_sweeper_task = None
+# 再実行したタスクの参照を保持（GCで破棄されないように）
+requeued_diagnosis_tasks = set()
+
+async def diagnosis_heartbeat_loop(record_id: int):
+    """処理中の診断のリースを定期的に延長"""
+    while True:
+        await asyncio.sleep(DIAGNOSIS_HEARTBEAT_INTERVAL_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(
+                    update(KanteiRecord)
+                    .where(KanteiRecord.id == record_id, KanteiRecord.status == "processing")
+                    .values(processing_heartbeat_at=datetime.utcnow())
+                )
+                await db.commit()
+        except Exception as e:
+            print(f"鑑定記録 {record_id} のハートビート更新エラー: {str(e)}")
+
+def _stale_processing_condition(cutoff: datetime):
+    """リース切れの処理中レコード（部分インデックス idx_kantei_processing_heartbeat を使用）"""
+    return and_(
+        KanteiRecord.status == "processing",
+        or_(KanteiRecord.processing_heartbeat_at < cutoff, KanteiRecord.processing_heartbeat_at.is_(None))
+    )
+
+async def sweep_stuck_diagnoses():
+    """リース切れの診断を一括で失敗にするか、再実行のため取得し直す"""
+    cutoff = datetime.utcnow() - timedelta(seconds=DIAGNOSIS_LEASE_SECONDS)
+    async with AsyncSessionLocal() as db:
+        # 再試行上限に達したものは一括で失敗に
+        failed = await db.execute(
+            update(KanteiRecord)
+            .where(_stale_processing_condition(cutoff), KanteiRecord.processing_attempts >= DIAGNOSIS_MAX_ATTEMPTS)
+            .values(status="failed")
+            .returning(KanteiRecord.id)
+        )
+        failed_ids = [row.id for row in failed]
+
+        # 残りはリースを取り直してから再実行（同じ条件で更新するため他ワーカーと二重実行しない）
+        claim_ids = (
+            select(KanteiRecord.id)
+            .where(_stale_processing_condition(cutoff))
+            .order_by(KanteiRecord.id)
+            .limit(DIAGNOSIS_SWEEP_BATCH_SIZE)
+        )
+        claimed = await db.execute(
+            update(KanteiRecord)
+            .where(KanteiRecord.id.in_(claim_ids), _stale_processing_condition(cutoff))
+            .values(processing_heartbeat_at=datetime.utcnow())
+            .returning(KanteiRecord.id, KanteiRecord.client_name, KanteiRecord.client_info)
+        )
+        requeue_rows = claimed.all()
+        await db.commit()
+
+    for row in requeue_rows:
+        client_info = row.client_info or {}
+        task = asyncio.create_task(process_diagnosis_db(
+            row.id,
+            client_info.get("birth_date"),
+            client_info.get("gender"),
+            client_info.get("name_for_seimei") or row.client_name,
+            client_info.get("diagnosis_pattern") or "all",
+            client_info.get("birth_time")
+        ))
+        requeued_diagnosis_tasks.add(task)
+        task.add_done_callback(requeued_diagnosis_tasks.discard)
+
+    if failed_ids or requeue_rows:
+        print(f"DEBUG: 放置診断の回収: 失敗={failed_ids}, 再実行={[row.id for row in requeue_rows]}")
+    return {"failed": failed_ids, "requeued": [row.id for row in requeue_rows]}
+
+async def diagnosis_sweeper_loop():
+    """起動直後と一定間隔でスイーパーを実行"""
+    while True:
+        try:
+            await sweep_stuck_diagnoses()
+        except Exception as e:
+            print(f"放置診断の回収エラー: {str(e)}")
+        await asyncio.sleep(DIAGNOSIS_SWEEP_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_diagnosis_sweeper():
+    global diagnosis_sweeper_task
+    if DIAGNOSIS_SWEEP_INTERVAL_SECONDS > 0:
+        diagnosis_sweeper_task = asyncio.create_task(diagnosis_sweeper_loop())
+
+@app.on_event("shutdown")
+async def stop_diagnosis_sweeper():
+    if diagnosis_sweeper_task:
+        diagnosis_sweeper_task.cancel()
 
 # 管理者権限付与エンドポイント
 @app.post("/api/auth/promote-to-admin")
 async def promote_to_admin(credentials: UserLogin):
     """ユーザーを管理者に昇格させる"""
-    db = next(get_db())
+    db = AsyncSessionLocal()
     try:
         # ユーザーの存在確認とパスワード検証
-        user = db.query(User).filter(User.email == credentials.email).first()
+        result = await db.execute(select(User).where(User.email == credentials.email))
+        user = result.scalar_one_or_none()
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -2555,7 +3939,7 @@ async def promote_to_admin(credentials: UserLogin):
             )
 
         # パスワード検証
-        if not verify_password(credentials.password, user.hashed_password):
+        if not await verify_password_async(credentials.password, user.hashed_password):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="パスワードが正しくありません"
@@ -2563,40 +3947,1640 @@ async def promote_to_admin(credentials: UserLogin):
 
         # 管理者権限を付与
         user.is_superuser = True
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
+        invalidate_user_principal(user.email)
 
         return {"success": True, "message": f"{credentials.email} に管理者権限を付与しました"}
 
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"管理者権限付与エラー: {str(e)}")
     finally:
-        db.close()
+        await db.close()
 
 # 失敗した診断データ削除エンドポイント
 @app.delete("/api/diagnosis/failed")
 async def delete_failed_diagnoses(current_user: User = Depends(get_current_user)):
     """失敗した診断データを削除"""
-    db = next(get_db())
+    db = AsyncSessionLocal()
     try:
         # ユーザーの失敗した診断を削除
-        deleted_count = db.query(KanteiRecord).filter(
+        result = await db.execute(delete(KanteiRecord).where(
             KanteiRecord.user_id == current_user.id,
             KanteiRecord.status == "failed"
-        ).delete()
+        ))
+        deleted_count = result.rowcount
 
-        db.commit()
+        await db.commit()
 
         return {"success": True, "message": f"{deleted_count}件の失敗した診断データを削除しました"}
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"削除エラー: {str(e)}")
     finally:
-        db.close()
+        await db.close()
+
+# 方位盤（年盤・月盤・日盤）
+# 計算規則は system/kyusei-logic-engine（bans/ 以下の TypeScript 版）、描画は canvases/Canvas.ts の配置に合わせる。
+# 盤の種類は中宮の星×表示する吉凶の組み合わせで数百通りしかないため、描画結果は lru_cache でメモ化する。
+HOIBAN_CACHE_SIZE = int(os.getenv("HOIBAN_CACHE_SIZE", "512"))
+# 節入り（立春〜小寒）の近似式の係数 (月, D, A, 年の補正)。Setu.ts と同じ
+HOIBAN_SETSU = [
+    (2, 4.8693, 0.242713, -1), (3, 6.3968, 0.242512, 0), (4, 5.6280, 0.242231, 0), (5, 6.3771, 0.241945, 0),
+    (6, 6.5733, 0.241731, 0), (7, 8.0091, 0.241642, 0), (8, 8.4102, 0.241703, 0), (9, 8.5186, 0.241898, 0),
+    (10, 9.1414, 0.242179, 0), (11, 8.2396, 0.242469, 0), (12, 7.9152, 0.242689, 0), (1, 6.3811, 0.242778, -1),
+]
+HOIBAN_GESHI = (6, 22.2747, 0.241669, 0)
+HOIBAN_TOUJI = (12, 22.6587, 0.242752, 0)
+# 2010-04-27 以前は日干支 28（壬辰）までを前の甲子に切り替える（QseiDayCreater.toKirikae）
+HOIBAN_KIRIKAE_JUDGE = date(2010, 4, 27)
+# 方位は 北, 東北, 東, 東南, 南, 西南, 西, 西北 の順（添字 0〜7）
+HOIBAN_DIRECTIONS = ["北", "東北", "東", "東南", "南", "西南", "西", "西北"]
+HOIBAN_BOARD_TYPES = {"year": "年盤", "month": "月盤", "day": "日盤"}
+# 後天定位盤（五黄中宮）の八方位の星
+HOIBAN_KOUTEN_JOUI = [1, 8, 3, 4, 9, 2, 7, 6]
+HOIBAN_STAR_NAMES = {1: "一白", 2: "二黒", 3: "三碧", 4: "四緑", 5: "五黄", 6: "六白", 7: "七赤", 8: "八白", 9: "九紫"}
+HOIBAN_STAR_NUMERALS = "一二三四五六七八九"
+# 星の定位（後天定位盤での方位、五黄は中央）と五行
+HOIBAN_STAR_HOUI = {1: 0, 2: 5, 3: 2, 4: 3, 5: None, 6: 7, 7: 6, 8: 1, 9: 4}
+HOIBAN_STAR_GOGYOU = {1: "水", 2: "土", 3: "木", 4: "木", 5: "土", 6: "金", 7: "金", 8: "土", 9: "火"}
+# 五行ごとの (生気の五行, 退気の五行)
+HOIBAN_GOGYOU_RELATIONS = {"木": ("水", "火"), "火": ("木", "土"), "土": ("火", "金"), "金": ("土", "水"), "水": ("金", "木")}
+HOIBAN_MONTH_TABLE = [
+    [8, 2, 5], [7, 1, 4], [6, 9, 3], [5, 8, 2], [4, 7, 1], [3, 6, 9],
+    [2, 5, 8], [1, 4, 7], [9, 3, 6], [8, 2, 5], [7, 1, 4], [6, 9, 3],
+]
+# 十二支（子=0）の方位、小児殺の星、三合（大三合は次の支の方位）
+HOIBAN_ETO_HOUI = [0, 1, 1, 2, 3, 3, 4, 5, 5, 6, 7, 7]
+HOIBAN_KOJI = [8, 9, 2, 3, 5, 6, 8, 9, 2, 3, 5, 6]
+HOIBAN_SANGOU = [(11, 3, 7), (2, 6, 10), (5, 9, 1), (8, 0, 4)]
+# 天道の方位（九星の月 2月〜13月）
+HOIBAN_TENDOU = [4, 5, 0, 6, 7, 2, 0, 1, 4, 2, 3, 6]
+# 既定の表示設定（Config.ts の DEFAULT_KIPOU_MAP）。太歳・月建・日辰・同会・輪重は既定で非表示のため扱わない
+HOIBAN_KYOU_STRONG = 100
+HOIBAN_KIPOU_STRONG = 10
+HOIBAN_KIPOU_LEVELS = {
+    "最大吉方": HOIBAN_KIPOU_STRONG, "吉方": HOIBAN_KIPOU_STRONG, "天道": 0, "大三合": 0,
+    "五黄殺": HOIBAN_KYOU_STRONG, "暗剣殺": HOIBAN_KYOU_STRONG, "本命殺": HOIBAN_KYOU_STRONG, "月命殺": HOIBAN_KYOU_STRONG,
+    "歳破": HOIBAN_KYOU_STRONG, "月破": HOIBAN_KYOU_STRONG, "日破": HOIBAN_KYOU_STRONG,
+    "本命的殺": HOIBAN_KYOU_STRONG, "月命的殺": HOIBAN_KYOU_STRONG, "小児殺": HOIBAN_KYOU_STRONG, "定位対冲": 0,
+}
+HOIBAN_KIPOU_NAMES = {"最大吉方", "吉方", "天道", "大三合"}
+HOIBAN_KIPOU_MAX = 4
+HOIBAN_FILLS = {HOIBAN_KYOU_STRONG: "#C0C0C0", HOIBAN_KIPOU_STRONG: "#FFD6EA"}
+HOIBAN_HAKAI_NAMES = {"year": "歳破", "month": "月破", "day": "日破"}
+
+def _hoiban_setsu_date(year: int, setsu: tuple) -> date:
+    month, d, a, offset = setsu
+    y = year + offset
+    return date(year, month, int(d + a * (y - 1900)) - int((y - 1900) / 4))
+
+@lru_cache(maxsize=256)
+def _hoiban_setsu_enters(year: int) -> tuple:
+    """その年の節入り日（立春〜翌年の小寒）"""
+    enters = [_hoiban_setsu_date(year, setsu) for setsu in HOIBAN_SETSU[:-1]]
+    enters.append(_hoiban_setsu_date(year + 1, HOIBAN_SETSU[-1]))
+    return tuple(enters)
+
+def hoiban_kyusei_month(day: date) -> tuple:
+    """九星の暦での (年, 月の添字) を返す。月の添字は 0=2月（立春〜）… 11=13月（小寒〜）"""
+    enters = _hoiban_setsu_enters(day.year)
+    if day < enters[0]:
+        return day.year - 1, 10 if day < _hoiban_setsu_enters(day.year - 1)[-1] else 11
+    for index in range(1, 11):
+        if day < enters[index]:
+            return day.year, index - 1
+    return day.year, 10
+
+def _hoiban_day_kanshi(day: date) -> int:
+    """日干支（甲子=0 の60進）"""
+    return (day.toordinal() - 678576 + 50) % 60
+
+def hoiban_year_star(day: date) -> int:
+    mod = hoiban_kyusei_month(day)[0] % 9
+    return 11 - (mod if mod > 1 else mod + 9)
+
+def hoiban_month_star(day: date) -> int:
+    year, month_index = hoiban_kyusei_month(day)
+    return HOIBAN_MONTH_TABLE[month_index][(hoiban_year_star(day) - 1) % 3]
+
+def _hoiban_kirikae(day: date) -> date:
+    """夏至・冬至に最も近い甲子の日（日家九星の切り替え日）"""
+    kanshi = _hoiban_day_kanshi(day)
+    limit = 28 if day <= HOIBAN_KIRIKAE_JUDGE else 29
+    return day - timedelta(days=kanshi) if kanshi <= limit else day + timedelta(days=60 - kanshi)
+
+@lru_cache(maxsize=256)
+def _hoiban_next_kirikae(before: date, ascending: bool) -> tuple:
+    """切り替え日 before の次の切り替え日と、閏（240日空いて30日前倒し）かどうか"""
+    if ascending:
+        solstice = _hoiban_setsu_date(before.year + (1 if before.month >= 10 else 0), HOIBAN_GESHI)
+    else:
+        solstice = _hoiban_setsu_date(before.year, HOIBAN_TOUJI)
+    next_kirikae = _hoiban_kirikae(solstice)
+    uruu = (next_kirikae - before).days == 240
+    return (next_kirikae - timedelta(days=30) if uruu else next_kirikae), uruu
+
+def hoiban_day_star(day: date) -> int:
+    """日家九星（夏至後の甲子から陰遁で九紫→一白、冬至後の甲子から陽遁で一白→九紫）"""
+    kirikae = _hoiban_kirikae(_hoiban_setsu_date(day.year - 1, HOIBAN_GESHI))
+    ascending, uruu = False, False
+    while True:
+        next_kirikae, next_uruu = _hoiban_next_kirikae(kirikae, ascending)
+        if day < next_kirikae:
+            break
+        kirikae, ascending, uruu = next_kirikae, not ascending, next_uruu
+    steps = (day - kirikae).days
+    if ascending:
+        return ((6 if uruu else 0) + steps) % 9 + 1
+    return ((2 if uruu else 8) - steps) % 9 + 1
+
+def hoiban_kiban(center: int) -> tuple:
+    """中宮の星から八方位の星を求める（後天定位盤を回座させる）"""
+    return tuple((star - 5 + center - 1) % 9 + 1 for star in HOIBAN_KOUTEN_JOUI)
+
+def _hoiban_waki(star: int) -> set:
+    gogyou = HOIBAN_STAR_GOGYOU[star]
+    return {other for other, value in HOIBAN_STAR_GOGYOU.items() if value == gogyou and other != star}
+
+def _hoiban_kipous(star: int) -> set:
+    """相生・比和の星（五黄を除く）"""
+    seiki, taiki = HOIBAN_GOGYOU_RELATIONS[HOIBAN_STAR_GOGYOU[star]]
+    related = {other for other, value in HOIBAN_STAR_GOGYOU.items() if value in (seiki, taiki)}
+    return (_hoiban_waki(star) | related) - {5}
+
+@lru_cache(maxsize=HOIBAN_CACHE_SIZE)
+def hoiban_birth_kipous(birth_year_star: int, birth_month_star: int) -> tuple:
+    """本命星・月命星から (最大吉方の星, 吉方の星) を求める（QseiGroupBase.maxKipous / bigKipous）"""
+    year_kipous = _hoiban_kipous(birth_year_star) - {birth_month_star}
+    month_kipous = _hoiban_kipous(birth_month_star) - {birth_year_star}
+    max_kipous = year_kipous & month_kipous
+    if birth_year_star == birth_month_star:
+        max_kipous -= _hoiban_waki(birth_year_star)
+    return frozenset(max_kipous), frozenset(year_kipous - max_kipous)
+
+def _hoiban_sort_effects(names: list) -> tuple:
+    """Canvas.ts と同じ並べ替え・取り消し・件数制限（凶を吉より優先、最上位が強い凶なら吉は表示しない）"""
+    names = sorted(names, key=lambda name: (-HOIBAN_KIPOU_LEVELS[name], name in HOIBAN_KIPOU_NAMES))
+    if names and HOIBAN_KIPOU_LEVELS[names[0]] >= 2 and names[0] not in HOIBAN_KIPOU_NAMES:
+        names = [name for name in names if name not in HOIBAN_KIPOU_NAMES]
+    return tuple(names[:HOIBAN_KIPOU_MAX])
+
+def hoiban_raw_effects(board_type: str, day: date, birth_year_star: int, birth_month_star: int) -> tuple:
+    """盤の中宮の星と、各方位の吉凶（Kipou.ts の effects と同じ順序、既定で非表示のものは除く）"""
+    year, month_index = hoiban_kyusei_month(day)
+    year_eto = (year + 56) % 60 % 12
+    if board_type == "year":
+        center, eto = hoiban_year_star(day), year_eto
+    elif board_type == "month":
+        center, eto = hoiban_month_star(day), (((year + 1) % 5) * 12 + (month_index + 2 - (12 if month_index + 2 > 12 else 0))) % 60 % 12
+    else:
+        center, eto = hoiban_day_star(day), _hoiban_day_kanshi(day) % 12
+    kiban = hoiban_kiban(center)
+    hakai = (HOIBAN_ETO_HOUI[eto] + 4) % 8
+    honmei = kiban.index(birth_year_star) if birth_year_star in kiban else -1
+    getsumei = kiban.index(birth_month_star) if birth_month_star in kiban else -1
+    max_kipous, big_kipous = hoiban_birth_kipous(birth_year_star, birth_month_star)
+    sangou = next(group for group in HOIBAN_SANGOU if year_eto in group)
+    daisangou = HOIBAN_ETO_HOUI[sangou[(sangou.index(year_eto) + 1) % 3]]
+    koji = HOIBAN_KOJI[year_eto]
+    effects = []
+    for index, star in enumerate(kiban):
+        names = []
+        if star == 5:
+            names.append("五黄殺")
+        if kiban[(index + 4) % 8] == 5:
+            names.append("暗剣殺")
+        if index == hakai:
+            names.append(HOIBAN_HAKAI_NAMES[board_type])
+        if honmei >= 0:
+            if index == honmei:
+                names.append("本命殺")
+            if index == (honmei + 4) % 8:
+                names.append("本命的殺")
+        if getsumei >= 0:
+            if index == getsumei:
+                names.append("月命殺")
+            if index == (getsumei + 4) % 8:
+                names.append("月命的殺")
+        if star != 5 and (HOIBAN_STAR_HOUI[star] + 4) % 8 == index:
+            names.append("定位対冲")
+        if star in max_kipous:
+            names.append("最大吉方")
+        if star in big_kipous:
+            names.append("吉方")
+        if board_type == "year" and index == daisangou:
+            names.append("大三合")
+        if board_type in ("month", "day") and index == HOIBAN_TENDOU[month_index]:
+            names.append("天道")
+        if board_type == "month" and star == koji:
+            names.append("小児殺")
+        effects.append(names)
+    return center, effects
+
+def hoiban_board(board_type: str, day: date, birth_year_star: int, birth_month_star: int) -> tuple:
+    """描画用の (中宮の星, 各方位の表示する吉凶) を返す。戻り値はそのまま描画のメモ化キーになる"""
+    center, effects = hoiban_raw_effects(board_type, day, birth_year_star, birth_month_star)
+    return center, tuple(_hoiban_sort_effects(names) for names in effects)
+
+# 描画（viewBox 360×360 の座標系。北が下・東が左の伝統的な向き）
+HOIBAN_VIEW_SIZE = 360
+HOIBAN_POINT_DEGREES = [285, 255, 195, 165, 105, 75, 15, 345]
+HOIBAN_COMPASS = [(0, "北"), (2, "東"), (4, "南"), (6, "西")]
+HOIBAN_LABEL_SIZE = 11
+HOIBAN_LABEL_LEADING = 13
+# docx に埋め込むPNGの一辺（px）
+HOIBAN_PNG_SIZE = int(os.getenv("HOIBAN_PNG_SIZE", "720"))
+
+def _hoiban_point(radius: float, degree: float) -> tuple:
+    center = HOIBAN_VIEW_SIZE / 2
+    return (round(center + radius * math.cos(math.radians(degree)), 2), round(center - radius * math.sin(math.radians(degree)), 2))
+
+@lru_cache(maxsize=HOIBAN_CACHE_SIZE)
+def hoiban_layout(center: int, board_type: str, effects: tuple) -> tuple:
+    """盤を描画要素（polygon / line / text）の列に変換する。SVG・PDF・PNG の各描画はこの結果だけを使う
+
+    text は (x, y（ベースライン）, 文字列, サイズ, 色, 揃え start|middle|end, 太字, 和文フォントがない場合の代替文字列)
+    """
+    size = HOIBAN_VIEW_SIZE
+    outer_radius, inner_radius = size * 0.28, size * 0.08
+    outer = [_hoiban_point(outer_radius, degree) for degree in HOIBAN_POINT_DEGREES]
+    inner = [_hoiban_point(inner_radius, degree) for degree in HOIBAN_POINT_DEGREES]
+    middle = (size / 2, size / 2)
+    elements = []
+    for index, names in enumerate(effects):
+        fill = HOIBAN_FILLS.get(HOIBAN_KIPOU_LEVELS[names[0]]) if names else None
+        if fill:
+            elements.append(("polygon", (middle, outer[index], outer[(index + 1) % 8]), fill, None))
+    elements.append(("polygon", tuple(outer), None, "#000000"))
+    for outer_point, inner_point in zip(outer, inner):
+        elements.append(("line", outer_point, inner_point))
+    elements.append(("polygon", tuple(inner), "#FFFFFF", "#000000"))
+
+    elements.append(("text", middle[0], middle[1] + 8, HOIBAN_STAR_NUMERALS[center - 1], 22, "#000000", "middle", True, str(center)))
+    for index, star in enumerate(hoiban_kiban(center)):
+        x, y = _hoiban_point(size * 0.15, 270 - 45 * index)
+        elements.append(("text", x, y + 7, HOIBAN_STAR_NUMERALS[star - 1], 19, "#000000", "middle", False, str(star)))
+    for index, label in HOIBAN_COMPASS:
+        x, y = _hoiban_point(outer_radius + 9, 270 - 45 * index)
+        elements.append(("text", x, y + 4, label, 11, "#888888", "middle", False, None))
+
+    # 吉凶名は盤の外側に、下側の方位は下へ・上側の方位は上へ・東西は中央揃えで積む
+    for index, names in enumerate(effects):
+        if not names:
+            continue
+        x, y = _hoiban_point(outer_radius + (20 if index % 2 == 0 else 6), 270 - 45 * index)
+        anchor = "middle" if index in (0, 4) else ("end" if index in (1, 2, 3) else "start")
+        if index in (0, 1, 7):
+            first = y + HOIBAN_LABEL_SIZE * 0.8
+        elif index in (3, 4, 5):
+            first = y - HOIBAN_LABEL_SIZE * 0.2 - HOIBAN_LABEL_LEADING * (len(names) - 1)
+        else:
+            first = y + HOIBAN_LABEL_SIZE * 0.35 - HOIBAN_LABEL_LEADING * (len(names) - 1) / 2
+        for line, name in enumerate(names):
+            color = "#FF0000" if name in HOIBAN_KIPOU_NAMES else "#000000"
+            elements.append(("text", x, round(first + HOIBAN_LABEL_LEADING * line, 2), name, HOIBAN_LABEL_SIZE, color, anchor, False, None))
+
+    elements.append(("text", 8, 20, HOIBAN_BOARD_TYPES[board_type], 14, "#000000", "start", True, None))
+    return tuple(elements)
+
+def _hoiban_effects_key(effects) -> tuple:
+    """レポート構造（リスト）から lru_cache のキーにできるタプルへ"""
+    return tuple(tuple(names) for names in effects)
+
+@lru_cache(maxsize=HOIBAN_CACHE_SIZE)
+def hoiban_svg(center: int, board_type: str, effects: tuple) -> str:
+    """盤をSVG文字列にする（font-family は指定せず埋め込み先の文書のフォントを使う）"""
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {HOIBAN_VIEW_SIZE} {HOIBAN_VIEW_SIZE}" '
+        f'width="100%" role="img" aria-label="{HOIBAN_BOARD_TYPES[board_type]}">'
+    ]
+    for element in hoiban_layout(center, board_type, effects):
+        if element[0] == "polygon":
+            points = " ".join(f"{x},{y}" for x, y in element[1])
+            stroke = f'stroke="{element[3]}" stroke-width="1"' if element[3] else 'stroke="none"'
+            parts.append(f'<polygon points="{points}" fill="{element[2] or "none"}" {stroke}/>')
+        elif element[0] == "line":
+            (x1, y1), (x2, y2) = element[1], element[2]
+            parts.append(f'<line x1="{x1}" y1="{y1}" x2="{x2}" y2="{y2}" stroke="#000000" stroke-width="1"/>')
+        else:
+            _, x, y, text_value, font_size, color, anchor, bold, _ = element
+            weight = ' font-weight="bold"' if bold else ""
+            parts.append(f'<text x="{x}" y="{y}" font-size="{font_size}" fill="{color}" text-anchor="{anchor}"{weight}>{xml_escape(text_value)}</text>')
+    parts.append("</svg>")
+    return "".join(parts)
+
+def hoiban_drawing(center: int, board_type: str, effects: tuple, font_name: str, width: float) -> Drawing:
+    """盤を reportlab の Drawing にする（PDF用。Flowable は文書ごとに使い捨てのため描画要素のみメモ化）"""
+    scale = width / HOIBAN_VIEW_SIZE
+    drawing = Drawing(width, width)
+
+    def flip(point):
+        return point[0] * scale, (HOIBAN_VIEW_SIZE - point[1]) * scale
+
+    for element in hoiban_layout(center, board_type, effects):
+        if element[0] == "polygon":
+            points = [value for point in element[1] for value in flip(point)]
+            drawing.add(Polygon(
+                points,
+                fillColor=colors.HexColor(element[2]) if element[2] else None,
+                strokeColor=colors.HexColor(element[3]) if element[3] else None,
+                strokeWidth=0.5,
+            ))
+        elif element[0] == "line":
+            drawing.add(Line(*flip(element[1]), *flip(element[2]), strokeColor=colors.black, strokeWidth=0.5))
+        else:
+            _, x, y, text_value, font_size, color, anchor, _, _ = element
+            drawing.add(DrawingString(*flip((x, y)), text_value, fontName=font_name, fontSize=font_size * scale, fillColor=colors.HexColor(color), textAnchor=anchor))
+    return drawing
+
+@lru_cache(maxsize=32)
+def _hoiban_png_font(font_size: int):
+    """PNG用フォント。和文フォント（REPORT_FONT_GOTHIC_PATH）がない場合は None（星の番号のみ描画）"""
+    if not REPORT_FONT_GOTHIC_PATH:
+        return None
+    return ImageFont.truetype(REPORT_FONT_GOTHIC_PATH, font_size, index=0)
+
+@lru_cache(maxsize=HOIBAN_CACHE_SIZE)
+def hoiban_png(center: int, board_type: str, effects: tuple) -> bytes:
+    """盤をPNGにする（DOCX用。Word はSVGを古い版で表示できないためラスタ画像で埋め込む）"""
+    scale = HOIBAN_PNG_SIZE / HOIBAN_VIEW_SIZE
+    image = PILImage.new("RGB", (HOIBAN_PNG_SIZE, HOIBAN_PNG_SIZE), "#FFFFFF")
+    draw = ImageDraw.Draw(image)
+    anchors = {"start": "ls", "middle": "ms", "end": "rs"}
+    for element in hoiban_layout(center, board_type, effects):
+        if element[0] == "polygon":
+            points = [(x * scale, y * scale) for x, y in element[1]]
+            draw.polygon(points, fill=element[2], outline=element[3], width=max(1, round(scale)) if element[3] else 0)
+        elif element[0] == "line":
+            (x1, y1), (x2, y2) = element[1], element[2]
+            draw.line([(x1 * scale, y1 * scale), (x2 * scale, y2 * scale)], fill="#000000", width=max(1, round(scale)))
+        else:
+            _, x, y, text_value, font_size, color, anchor, _, fallback = element
+            font = _hoiban_png_font(round(font_size * scale))
+            if font is None:
+                if fallback is None:
+                    continue
+                text_value, font = fallback, ImageFont.load_default(round(font_size * scale))
+            draw.text((x * scale, y * scale), text_value, fill=color, font=font, anchor=anchors[anchor])
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+def _hoiban_summary(effects: tuple) -> str:
+    """各方位の吉凶を「吉方位：…／凶方位：…」の文にする（画像を表示できない閲覧環境向け）"""
+    kipou, kyou = [], []
+    for index, names in enumerate(effects):
+        good = [name for name in names if HOIBAN_KIPOU_LEVELS[name] == HOIBAN_KIPOU_STRONG]
+        bad = [name for name in names if HOIBAN_KIPOU_LEVELS[name] == HOIBAN_KYOU_STRONG]
+        if good:
+            kipou.append(f"{HOIBAN_DIRECTIONS[index]}（{'・'.join(good)}）")
+        if bad:
+            kyou.append(f"{HOIBAN_DIRECTIONS[index]}（{'・'.join(bad)}）")
+    return f"吉方位：{'、'.join(kipou) or 'なし'}\n凶方位：{'、'.join(kyou) or 'なし'}"
+
+def build_hoiban_blocks(birth_date_value, report_day: date) -> list:
+    """生年月日と鑑定日から、年盤・月盤・日盤のブロック（盤の図と吉凶の一覧）を作る。生年月日が不正なら空"""
+    try:
+        birth_day = datetime.strptime(str(birth_date_value or ""), "%Y-%m-%d").date()
+    except ValueError:
+        return []
+    birth_year_star, birth_month_star = hoiban_year_star(birth_day), hoiban_month_star(birth_day)
+    boards, rows = [], []
+    for board_type, title in HOIBAN_BOARD_TYPES.items():
+        center, effects = hoiban_board(board_type, report_day, birth_year_star, birth_month_star)
+        boards.append({"board_type": board_type, "center": center, "effects": effects})
+        rows.append([f"{title}（{HOIBAN_STAR_NAMES[center]}中宮）", _hoiban_summary(effects)])
+    return [
+        {"type": "hoiban", "title": f"{report_day.year}年{report_day.month}月{report_day.day}日の方位盤", "boards": boards},
+        {"type": "fields", "rows": rows},
+    ]
+
+# 鑑定書レポート生成（PDF / DOCX 共通）
+# 並列レンダリングのプロセス数（0 の場合はスレッドプールでプロセス内実行）
+REPORT_RENDER_PROCESSES = int(os.getenv("REPORT_RENDER_PROCESSES", "0"))
+REPORT_RENDER_THREADS = int(os.getenv("REPORT_RENDER_THREADS", "4"))
+report_render_executor = None
+
+# プレビュー画面（PreviewView.vue の getThemeColors）と同じ配色
+REPORT_THEME_COLORS = {
+    "default": {"primary": "#3498db", "accent": "#2980b9"},
+    "elegant": {"primary": "#8e44ad", "accent": "#9b59b6"},
+    "warm": {"primary": "#e67e22", "accent": "#d35400"},
+    "natural": {"primary": "#27ae60", "accent": "#2ecc71"},
+    "professional": {"primary": "#34495e", "accent": "#2c3e50"},
+}
+REPORT_FONT_SIZES = {"small": 9.0, "medium": 10.5, "large": 12.0}
+REPORT_MINCHO_FONTS = {"mincho", "noto-serif", "hiragino", "yu-mincho"}
+REPORT_DISCLAIMER = "※この鑑定は参考用であり、結果について当事務所は責任を負いかねます。"
+REPORT_KYUSEI_FIELDS = [
+    ("本命星", "honmeisei"),
+    ("月命星", "getsumeisei"),
+    ("年干支", "year_kanshi"),
+    ("月干支", "month_kanshi"),
+    ("日干支", "day_kanshi"),
+    ("納音", "naon"),
+    ("最大吉方", "max_kichigata"),
+    ("吉方", "kichigata"),
+    ("傾斜", "keisha"),
+    ("同会", "doukai"),
+]
+REPORT_SEIMEI_DETAIL_SECTIONS = ["文字による鑑定", "陰陽による鑑定", "五行による鑑定", "画数による鑑定", "天地による鑑定"]
+REPORT_EMPTY_VALUES = {"", "未取得", "月盤", "年盤", "日盤", "なし", "無し", "-"}
+
+def _report_value(value) -> Optional[str]:
+    """表示しない値（未取得・区切り文字のみ等）を None にする"""
+    if value is None:
+        return None
+    text_value = str(value).strip().rstrip(",、 ")
+    return None if text_value in REPORT_EMPTY_VALUES else text_value
+
+def _seimei_character_keys(seimei_data: dict) -> list:
+    """姓1, 姓2, 名1, 名2 の順に文字キーを並べる（プレビュー画面と同じ順序）"""
+    def sort_key(key):
+        digits = re.sub(r"\D", "", key)
+        return (0 if key.startswith("姓") else 1, int(digits) if digits else 0)
+    return sorted((seimei_data.get("画数") or {}).keys(), key=sort_key)
+
+def _seimei_detail_entries(detail) -> list:
+    """詳細鑑定（dict または list 形式）を [見出し, 本文] のリストに揃える"""
+    entries = []
+    if isinstance(detail, dict):
+        for name, body in detail.items():
+            entries.append([re.sub(r"_\d+$", "", str(name)), str(body or "")])
+    elif isinstance(detail, list):
+        for item in detail:
+            if isinstance(item, dict):
+                heading = str(item.get("文字", ""))
+                if item.get("分類"):
+                    heading = f"{heading}【{item['分類']}】"
+                entries.append([heading, str(item.get("詳細", ""))])
+    return [entry for entry in entries if entry[0] or entry[1]]
+
+def build_report_document(record, settings: dict, base_dir: Optional[str] = None) -> dict:
+    """鑑定記録とテンプレート設定から、レンダラー非依存のレポート構造を組み立てる
+
+    PDF / DOCX の各レンダラーはこの dict だけを入力にする（プロセスプールへ渡せるよう素のデータのみ）。
+    ブロック種別: fields（項目名と値の表）, table（先頭行が見出しの表）, paragraph, entries（見出し付き本文）,
+    hoiban（年盤・月盤・日盤。各レンダラーが hoiban_layout から描画）
+    """
+    calculation_result = record.calculation_result or {}
+    client_info = record.client_info or {}
+    kyusei = calculation_result.get("kyusei") or {}
+    seimei = calculation_result.get("seimei") or {}
+    seimei_data = seimei.get("data") or {}
+    pattern = record.diagnosis_pattern or client_info.get("diagnosis_pattern") or "all"
+    layout = settings.get("layout_style") or "standard"
+
+    if pattern == "kyusei_only":
+        title = "九星気学・吉方位鑑定書"
+    elif pattern == "seimei_only":
+        title = "姓名判断鑑定書"
+    else:
+        title = "九星気学・姓名判断 総合鑑定書"
+
+    sections = []
+    if pattern != "seimei_only":
+        gender = {"male": "男性", "female": "女性"}.get(client_info.get("gender"), "未設定")
+        rows = [["お名前", record.client_name], ["生年月日", client_info.get("birth_date") or "未設定"]]
+        if client_info.get("birth_time"):
+            rows.append(["出生時間", client_info["birth_time"]])
+        if _report_value(kyusei.get("eto")):
+            rows.append(["十二支", kyusei["eto"]])
+        rows.append(["性別", gender])
+        sections.append({"heading": "依頼者情報", "blocks": [{"type": "fields", "rows": rows}]})
+
+    if kyusei and pattern in ("kyusei_only", "all"):
+        rows = [[label, _report_value(kyusei.get(key))] for label, key in REPORT_KYUSEI_FIELDS]
+        rows = [row for row in rows if row[1]]
+        sections.append({"heading": "九星気学・吉方位の鑑定結果", "blocks": [{"type": "fields", "rows": rows}]})
+        # コンパクトレイアウトでは方位盤を省略する
+        if layout != "compact" and record.created_at:
+            hoiban_blocks = build_hoiban_blocks(client_info.get("birth_date"), record.created_at.date())
+            if hoiban_blocks:
+                sections.append({"heading": "方位盤", "blocks": hoiban_blocks})
+
+    if seimei_data and pattern in ("seimei_only", "all"):
+        blocks = []
+        keys = _seimei_character_keys(seimei_data)
+        if keys:
+            characters = seimei_data.get("文字") or {}
+            table = [["文字"] + [str(characters.get(key) or key) for key in keys]]
+            for label in ("画数", "五行", "陰陽"):
+                values = seimei_data.get(label)
+                if values:
+                    table.append([label] + [str(values.get(key, "")) for key in keys])
+            blocks.append({"type": "table", "title": "文字の構成", "rows": table})
+        kakusu = seimei_data.get("格数") or {}
+        kakusu_rows = [[label, str(kakusu[label])] for label in ("天格", "人格", "地格", "総画") if kakusu.get(label)]
+        if kakusu_rows:
+            blocks.append({"type": "fields", "title": "格数", "rows": kakusu_rows})
+        blocks.append({"type": "fields", "title": "鑑定の結果", "rows": [["総評点数", f"{seimei_data.get('総評点数', '未取得')} 点/100"]]})
+        if seimei_data.get("総評メッセージ"):
+            blocks.append({"type": "paragraph", "text": str(seimei_data["総評メッセージ"])})
+        # コンパクトレイアウトでは詳細鑑定を省略する
+        if layout != "compact":
+            details = seimei_data.get("詳細鑑定") or {}
+            for name in REPORT_SEIMEI_DETAIL_SECTIONS:
+                entries = _seimei_detail_entries(details.get(name))
+                if entries:
+                    blocks.append({"type": "entries", "title": name, "items": entries})
+        sections.append({"heading": "姓名判断の鑑定結果", "blocks": blocks})
+
+    if record.appraiser_comment:
+        sections.append({"heading": "鑑定士コメント", "blocks": [{"type": "paragraph", "text": record.appraiser_comment}]})
+
+    logo_path = report_logo_path(settings.get("logo_url"), base_dir)
+
+    font_family = settings.get("font_family") or "default"
+    color_theme = settings.get("color_theme") if settings.get("color_theme") in REPORT_THEME_COLORS else "default"
+    return {
+        "title": title,
+        "business_name": settings.get("business_name") or "",
+        "operator_name": settings.get("operator_name") or "",
+        "date": record.created_at.strftime("%Y年%m月%d日") if record.created_at else "",
+        # 文書のメタデータ（作成日時）に使う。現在時刻を使うと同じキーで内容が変わるため記録の作成日時に固定する
+        "created_at": record.created_at.isoformat() if record.created_at else "",
+        "client_name": record.client_name,
+        "color_theme": color_theme,
+        "theme": REPORT_THEME_COLORS[color_theme],
+        "font": "mincho" if font_family in REPORT_MINCHO_FONTS else "gothic",
+        "font_size": REPORT_FONT_SIZES.get(settings.get("font_size") or "medium", REPORT_FONT_SIZES["medium"]),
+        "layout": layout,
+        "logo_path": logo_path,
+        "sections": sections,
+        "disclaimer": REPORT_DISCLAIMER,
+    }
+
+# 鑑定書HTMLテンプレート（Jinja2、Chromiumレンダラー向け）
+REPORT_TEMPLATE_DIR = os.getenv("REPORT_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates"))
+# コンパイル済みテンプレートのバイトコードキャッシュ（プロセス再起動後もパースを省略）
+REPORT_TEMPLATE_CACHE_DIR = os.getenv("REPORT_TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "seiraban_jinja_cache"))
+# 開発時のみ true（テンプレート変更を再起動なしで反映、その分リクエストごとに更新確認が入る）
+REPORT_TEMPLATE_AUTO_RELOAD = os.getenv("REPORT_TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
+REPORT_HTML_LAYOUTS = {"standard", "compact", "detailed"}
+REPORT_HTML_FONT_STACKS = {
+    "gothic": '"Noto Sans JP", "Yu Gothic", "Hiragino Sans", sans-serif',
+    "mincho": '"Noto Serif JP", "Yu Mincho", "Hiragino Mincho ProN", serif',
+}
+
+def report_text_filter(value) -> Markup:
+    """本文をエスケープし、改行を <br>、【】で囲まれた語を強調表示に変換"""
+    escaped = str(html_escape(value if value is not None else ""))
+    escaped = escaped.replace("\n", "<br>")
+    return Markup(re.sub(r"(【[^】]*】)", r'<span class="emphasis">\1</span>', escaped))
+
+def report_hoiban_svg(board: dict) -> Markup:
+    """方位盤ブロックの盤をインラインSVGにする（メモ化済みのSVG文字列をそのまま埋め込む）"""
+    return Markup(hoiban_svg(board["center"], board["board_type"], _hoiban_effects_key(board["effects"])))
+
+def create_report_template_environment(use_bytecode_cache: bool = True) -> Environment:
+    bytecode_cache = None
+    if use_bytecode_cache:
+        os.makedirs(REPORT_TEMPLATE_CACHE_DIR, exist_ok=True)
+        bytecode_cache = FileSystemBytecodeCache(REPORT_TEMPLATE_CACHE_DIR)
+    environment = Environment(
+        loader=FileSystemLoader(REPORT_TEMPLATE_DIR),
+        autoescape=select_autoescape(["html.j2"]),
+        bytecode_cache=bytecode_cache,
+        auto_reload=REPORT_TEMPLATE_AUTO_RELOAD,
+        trim_blocks=True,
+        lstrip_blocks=True,
+    )
+    environment.filters["report_text"] = report_text_filter
+    environment.globals["hoiban_svg"] = report_hoiban_svg
+    return environment
+
+report_template_env = create_report_template_environment()
+
+def preload_report_templates(environment: Environment = None) -> int:
+    """全テンプレートを読み込んでコンパイル済みの状態にする"""
+    environment = environment or report_template_env
+    names = environment.list_templates(extensions=["j2"])
+    for name in names:
+        environment.get_template(name)
+    return len(names)
+
+def render_report_html(report: dict, environment: Environment = None) -> str:
+    """build_report_document の結果をレイアウト別テンプレートでHTMLにする（配色はテーマ別CSSを include）"""
+    environment = environment or report_template_env
+    layout = report["layout"] if report["layout"] in REPORT_HTML_LAYOUTS else "standard"
+    logo_src = None
+    if report["logo_path"]:
+        # about:blank から読み込むため file:// ではなく data URI で埋め込む
+        mime_type = mimetypes.guess_type(report["logo_path"])[0] or "image/png"
+        with open(report["logo_path"], "rb") as f:
+            logo_src = f"data:{mime_type};base64,{base64.b64encode(f.read()).decode('ascii')}"
+    return environment.get_template(f"report/{layout}.html.j2").render(
+        report=report,
+        logo_src=logo_src,
+        font_stack=Markup(REPORT_HTML_FONT_STACKS[report["font"]]),
+    )
+
+@app.on_event("startup")
+async def load_report_templates():
+    started = time.perf_counter()
+    count = preload_report_templates()
+    print(f"DEBUG: 鑑定書テンプレート読み込み {count}件 {(time.perf_counter() - started) * 1000:.1f}ms")
+
+# PDFに埋め込む日本語フォント（TrueType / TTC）。未指定の場合はCIDフォント（埋め込みなし、閲覧環境のフォントで表示）
+REPORT_FONT_GOTHIC_PATH = os.getenv("REPORT_FONT_GOTHIC_PATH", "")
+REPORT_FONT_MINCHO_PATH = os.getenv("REPORT_FONT_MINCHO_PATH", "")
+# サブセット化済みフォントのキャッシュ件数（フォント名とグリフ列のハッシュ単位）
+REPORT_FONT_SUBSET_CACHE_SIZE = int(os.getenv("REPORT_FONT_SUBSET_CACHE_SIZE", "256"))
+report_font_subset_cache = OrderedDict()
+report_font_subset_cache_lock = threading.Lock()
+report_font_subset_stats = {"hits": 0, "misses": 0}
+
+def _cache_font_subsets(font: TTFont):
+    """reportlab が文書ごとに行うサブセット化（使用グリフのみのフォント生成）の結果をキャッシュ
+
+    reportlab は文書内の出現順に文字をサブセットへ割り当て、その順がフォント内のグリフ番号になるため、
+    キーは集合ではなく順序付きのグリフ列のハッシュにする。同じ文面の再生成（配色・レイアウトの変更、
+    保持管理による削除後、レンダラーのバージョン更新後など）でヒットする。ヒット率は
+    /api/admin/storage-stats の font_subsets で確認できる。
+    TTFontFile は読み取り位置を内部状態に持つため、生成はフォントごとのロックで直列化する。
+    キャッシュの参照・更新は別のロックで短時間だけ保持するので、ヒットや別フォントの生成は待たせない。
+    """
+    make_subset = font.face.makeSubset
+    font_lock = threading.Lock()
+
+    def lookup(key):
+        with report_font_subset_cache_lock:
+            data = report_font_subset_cache.get(key)
+            if data is not None:
+                report_font_subset_cache.move_to_end(key)
+                report_font_subset_stats["hits"] += 1
+            return data
+
+    def cached_make_subset(subset):
+        key = hashlib.sha1(f"{font.fontName}:{','.join(map(str, subset))}".encode("utf-8")).hexdigest()
+        data = lookup(key)
+        if data is not None:
+            return data
+        with font_lock:
+            # 待っている間に同じサブセットが生成されていればそれを使う
+            data = lookup(key)
+            if data is not None:
+                return data
+            data = make_subset(subset)
+            with report_font_subset_cache_lock:
+                report_font_subset_stats["misses"] += 1
+                report_font_subset_cache[key] = data
+                while len(report_font_subset_cache) > REPORT_FONT_SUBSET_CACHE_SIZE:
+                    report_font_subset_cache.popitem(last=False)
+        return data
+
+    font.face.makeSubset = cached_make_subset
+
+def report_font_subset_metrics() -> dict:
+    """サブセットキャッシュの件数とヒット率（プロセスプール使用時は各ワーカー内で集計されるため対象外）"""
+    with report_font_subset_cache_lock:
+        hits, misses = report_font_subset_stats["hits"], report_font_subset_stats["misses"]
+        entries = len(report_font_subset_cache)
+    return {
+        "entries": entries,
+        "max_entries": REPORT_FONT_SUBSET_CACHE_SIZE,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+    }
+
+def register_report_fonts() -> dict:
+    """レポート用フォントを登録（フォントファイルの解析はプロセスごとに1回）"""
+    fonts = {}
+    for style, cid_font, path in (
+        ("gothic", "HeiseiKakuGo-W5", REPORT_FONT_GOTHIC_PATH),
+        ("mincho", "HeiseiMin-W3", REPORT_FONT_MINCHO_PATH),
+    ):
+        if path:
+            font = TTFont(f"Report{style.capitalize()}", path, subfontIndex=0)
+            _cache_font_subsets(font)
+            pdfmetrics.registerFont(font)
+            fonts[style] = font.fontName
+        else:
+            pdfmetrics.registerFont(UnicodeCIDFont(cid_font))
+            fonts[style] = cid_font
+    return fonts
+
+REPORT_PDF_FONTS = register_report_fonts()
+
+def _pdf_markup(text_value: str, color: str) -> str:
+    """本文をParagraph用にエスケープし、【】で囲まれた語をテーマ色で強調する"""
+    escaped = xml_escape(text_value or "").replace("\n", "<br/>")
+    return re.sub(r"(【[^】]*】)", rf'<font color="{color}">\1</font>', escaped)
+
+def render_report_pdf(report: dict) -> bytes:
+    """build_report_document の結果からPDFを生成する（プロセスプールから呼べるようモジュール関数にしている）"""
+    font_name = REPORT_PDF_FONTS[report["font"]]
+    size = report["font_size"]
+    primary = colors.HexColor(report["theme"]["primary"])
+    accent = colors.HexColor(report["theme"]["accent"])
+    light = colors.HexColor("#f4f6f8")
+    compact = report["layout"] == "compact"
+    gap = 2 * mm if compact else 4 * mm
+
+    body = ParagraphStyle("body", fontName=font_name, fontSize=size, leading=size * 1.6, wordWrap="CJK")
+    small = ParagraphStyle("small", parent=body, fontSize=size * 0.85, leading=size * 1.3, textColor=colors.HexColor("#666666"))
+    title_style = ParagraphStyle("title", parent=body, fontSize=size * 2, leading=size * 2.6, alignment=TA_CENTER, textColor=primary)
+    center = ParagraphStyle("center", parent=body, alignment=TA_CENTER)
+    heading = ParagraphStyle("heading", parent=body, fontSize=size * 1.4, leading=size * 2, textColor=colors.white)
+    subheading = ParagraphStyle("subheading", parent=body, fontSize=size * 1.15, leading=size * 1.8, textColor=accent, spaceBefore=gap / 2)
+    entry_heading = ParagraphStyle("entry_heading", parent=body, textColor=primary)
+
+    width = A4[0] - 30 * mm
+    story = []
+
+    # ヘッダー（ロゴ・タイトル・事業者情報）
+    header_cells = []
+    if report["logo_path"]:
+        logo_width, logo_height = ImageReader(report["logo_path"]).getSize()
+        scale = min(40 * mm / logo_width, 20 * mm / logo_height)
+        header_cells.append(Image(report["logo_path"], width=logo_width * scale, height=logo_height * scale))
+    header_cells.append(Paragraph(xml_escape(report["title"]), title_style))
+    if len(header_cells) == 2:
+        header = Table([header_cells], colWidths=[45 * mm, width - 45 * mm])
+        header.setStyle(TableStyle([("VALIGN", (0, 0), (-1, -1), "MIDDLE")]))
+        story.append(header)
+    else:
+        story.append(header_cells[0])
+    if report["business_name"]:
+        operator = f"　鑑定士 {report['operator_name']}" if report["operator_name"] else ""
+        story.append(Paragraph(xml_escape(report["business_name"] + operator), center))
+    story.append(Paragraph(f"鑑定実施日 {xml_escape(report['date'])}", center))
+    story.append(Spacer(1, gap * 2))
+
+    def fields_table(rows):
+        data = [[Paragraph(xml_escape(str(label)), body), Paragraph(_pdf_markup(str(value), report["theme"]["primary"]), body)] for label, value in rows]
+        table = Table(data, colWidths=[35 * mm, width - 35 * mm])
+        table.setStyle(TableStyle([
+            ("BACKGROUND", (0, 0), (0, -1), light),
+            ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#d0d5da")),
+            ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ]))
+        return table
+
+    for section in report["sections"]:
+        heading_table = Table([[Paragraph(xml_escape(section["heading"]), heading)]], colWidths=[width])
+        heading_table.setStyle(TableStyle([("BACKGROUND", (0, 0), (-1, -1), primary)]))
+        story.append(heading_table)
+        story.append(Spacer(1, gap))
+        for block in section["blocks"]:
+            if block.get("title"):
+                story.append(Paragraph(xml_escape(block["title"]), subheading))
+            if block["type"] == "fields":
+                story.append(fields_table(block["rows"]))
+            elif block["type"] == "table":
+                rows = [[Paragraph(xml_escape(str(cell)), center) for cell in row] for row in block["rows"]]
+                first_width = 20 * mm
+                other_width = min(20 * mm, (width - first_width) / max(1, len(rows[0]) - 1))
+                table = Table(rows, colWidths=[first_width] + [other_width] * (len(rows[0]) - 1), hAlign="LEFT")
+                table.setStyle(TableStyle([
+                    ("BACKGROUND", (0, 0), (-1, 0), light),
+                    ("BACKGROUND", (0, 0), (0, -1), light),
+                    ("GRID", (0, 0), (-1, -1), 0.5, colors.HexColor("#d0d5da")),
+                    ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ]))
+                story.append(table)
+            elif block["type"] == "paragraph":
+                story.append(Paragraph(_pdf_markup(block["text"], report["theme"]["primary"]), body))
+            elif block["type"] == "entries":
+                for name, text_value in block["items"]:
+                    story.append(Paragraph(xml_escape(name), entry_heading))
+                    story.append(Paragraph(_pdf_markup(text_value, report["theme"]["primary"]), body))
+            elif block["type"] == "hoiban":
+                board_width = width / len(block["boards"])
+                drawings = [
+                    hoiban_drawing(board["center"], board["board_type"], _hoiban_effects_key(board["effects"]), font_name, board_width)
+                    for board in block["boards"]
+                ]
+                table = Table([drawings], colWidths=[board_width] * len(drawings))
+                table.setStyle(TableStyle([("LEFTPADDING", (0, 0), (-1, -1), 0), ("RIGHTPADDING", (0, 0), (-1, -1), 0)]))
+                story.append(table)
+            story.append(Spacer(1, gap / 2))
+        story.append(Spacer(1, gap))
+
+    footer = " ".join(filter(None, [report["business_name"], f"鑑定士：{report['operator_name']}" if report["operator_name"] else ""]))
+    if footer:
+        story.append(Paragraph(xml_escape(footer), center))
+    story.append(Paragraph(xml_escape(report["disclaimer"]), small))
+
+    def draw_page_number(canvas, doc):
+        canvas.saveState()
+        canvas.setFont(font_name, 8)
+        canvas.drawCentredString(A4[0] / 2, 10 * mm, f"- {doc.page} -")
+        canvas.restoreState()
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=15 * mm,
+        rightMargin=15 * mm,
+        topMargin=20 * mm,
+        bottomMargin=20 * mm,
+        title=report["title"],
+        author=report["business_name"],
+        subject=f"{report['client_name']}様",
+        # 作成日時と /ID を固定し、同じ入力からは同じバイト列を生成する（ETag を強いバリデーターとして使うため）
+        invariant=1,
+    )
+    doc.build(story, onFirstPage=draw_page_number, onLaterPages=draw_page_number)
+    return buffer.getvalue()
+
+# DOCX（OOXML）パーツテンプレート（起動時に一度だけ組み立て、リクエストごとは format のみ）
+DOCX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+DOCX_FONTS = {"gothic": "Yu Gothic", "mincho": "Yu Mincho"}
+DOCX_NAMESPACES = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"'
+)
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+    '<Default Extension="gif" ContentType="image/gif"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/word/footer1.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml"/>'
+    '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '</Types>'
+).encode("utf-8")
+DOCX_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+    '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties" Target="docProps/core.xml"/>'
+    '</Relationships>'
+).encode("utf-8")
+DOCX_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '<Relationship Id="rIdFooter" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/footer" Target="footer1.xml"/>'
+    '{images}'
+    '</Relationships>'
+)
+DOCX_IMAGE_REL = '<Relationship Id="{rid}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target="media/{name}"/>'
+DOCX_CORE = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<dc:title>{title}</dc:title><dc:subject>{subject}</dc:subject><dc:creator>{creator}</dc:creator>'
+    '<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created>'
+    '</cp:coreProperties>'
+)
+DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:docDefaults><w:rPrDefault><w:rPr>'
+    '<w:rFonts w:ascii="{font}" w:hAnsi="{font}" w:eastAsia="{font}" w:cs="{font}"/>'
+    '<w:sz w:val="{size}"/><w:szCs w:val="{size}"/><w:lang w:eastAsia="ja-JP"/>'
+    '</w:rPr></w:rPrDefault><w:pPrDefault><w:pPr><w:spacing w:after="{spacing}" w:line="300" w:lineRule="auto"/></w:pPr></w:pPrDefault></w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:spacing w:after="120"/><w:jc w:val="center"/></w:pPr><w:rPr><w:b/><w:color w:val="{primary}"/><w:sz w:val="{title_size}"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:shd w:val="clear" w:color="auto" w:fill="{primary}"/><w:spacing w:before="240" w:after="120"/><w:outlineLvl w:val="0"/></w:pPr>'
+    '<w:rPr><w:b/><w:color w:val="FFFFFF"/><w:sz w:val="{heading_size}"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:spacing w:before="120" w:after="60"/><w:outlineLvl w:val="1"/></w:pPr>'
+    '<w:rPr><w:b/><w:color w:val="{accent}"/><w:sz w:val="{subheading_size}"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading3"><w:name w:val="heading 3"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:spacing w:after="0"/><w:outlineLvl w:val="2"/></w:pPr><w:rPr><w:b/><w:color w:val="{primary}"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Small"><w:name w:val="Small"/><w:basedOn w:val="Normal"/>'
+    '<w:rPr><w:color w:val="666666"/><w:sz w:val="{small_size}"/></w:rPr></w:style>'
+    '<w:style w:type="table" w:styleId="ReportTable"><w:name w:val="Report Table"/><w:tblPr><w:tblBorders>'
+    '<w:top w:val="single" w:sz="4" w:color="D0D5DA"/><w:left w:val="single" w:sz="4" w:color="D0D5DA"/>'
+    '<w:bottom w:val="single" w:sz="4" w:color="D0D5DA"/><w:right w:val="single" w:sz="4" w:color="D0D5DA"/>'
+    '<w:insideH w:val="single" w:sz="4" w:color="D0D5DA"/><w:insideV w:val="single" w:sz="4" w:color="D0D5DA"/>'
+    '</w:tblBorders><w:tblCellMar><w:left w:w="100" w:type="dxa"/><w:right w:w="100" w:type="dxa"/></w:tblCellMar></w:tblPr></w:style>'
+    '</w:styles>'
+)
+DOCX_FOOTER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:ftr xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:p><w:pPr><w:jc w:val="center"/></w:pPr>'
+    '<w:r><w:t xml:space="preserve">- </w:t></w:r><w:r><w:fldChar w:fldCharType="begin"/></w:r>'
+    '<w:r><w:instrText xml:space="preserve"> PAGE </w:instrText></w:r><w:r><w:fldChar w:fldCharType="end"/></w:r>'
+    '<w:r><w:t xml:space="preserve"> -</w:t></w:r></w:p></w:ftr>'
+).encode("utf-8")
+DOCX_DOCUMENT_START = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:document {DOCX_NAMESPACES}><w:body>'.encode("utf-8")
+# A4・余白（上下20mm / 左右15mm）は PDF と揃える
+DOCX_DOCUMENT_END = (
+    '<w:sectPr><w:footerReference w:type="default" r:id="rIdFooter"/>'
+    '<w:pgSz w:w="11906" w:h="16838"/><w:pgMar w:top="1134" w:right="850" w:bottom="1134" w:left="850" w:header="567" w:footer="567" w:gutter="0"/>'
+    '</w:sectPr></w:body></w:document>'
+).encode("utf-8")
+DOCX_PARAGRAPH = '<w:p>{properties}{runs}</w:p>'
+DOCX_RUN = '<w:r>{properties}<w:t xml:space="preserve">{text}</w:t></w:r>'
+DOCX_BREAK_RUN = '<w:r><w:br/></w:r>'
+DOCX_CELL = '<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/>{shading}<w:vAlign w:val="center"/></w:tcPr>{paragraph}</w:tc>'
+DOCX_CELL_SHADING = '<w:shd w:val="clear" w:color="auto" w:fill="F4F6F8"/>'
+DOCX_TABLE = '<w:tbl><w:tblPr><w:tblStyle w:val="ReportTable"/><w:tblW w:w="{width}" w:type="dxa"/><w:tblLayout w:type="fixed"/></w:tblPr><w:tblGrid>{grid}</w:tblGrid>{rows}</w:tbl>'
+DOCX_IMAGE_RUN = (
+    '<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+    '<wp:extent cx="{cx}" cy="{cy}"/><wp:docPr id="{id}" name="{name}"/>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="{id}" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr>'
+    '</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+)
+DOCX_CENTERED_PARAGRAPH = '<w:p><w:pPr><w:jc w:val="center"/></w:pPr>{runs}</w:p>'
+DOCX_TEXT_WIDTH = 10206  # A4幅 - 左右余白（twip）
+DOCX_EMU_PER_MM = 36000
+
+def _docx_runs(text_value: str, color: str) -> str:
+    """本文をランに分割（改行は w:br、【】で囲まれた語はテーマ色の太字）"""
+    runs = []
+    for line_index, line in enumerate(str(text_value or "").split("\n")):
+        if line_index:
+            runs.append(DOCX_BREAK_RUN)
+        for part in re.split(r"(【[^】]*】)", line):
+            if not part:
+                continue
+            properties = f'<w:rPr><w:b/><w:color w:val="{color}"/></w:rPr>' if part.startswith("【") else ""
+            runs.append(DOCX_RUN.format(properties=properties, text=xml_escape(part)))
+    return "".join(runs)
+
+def _docx_paragraph(text_value: str, color: str, style: Optional[str] = None, align: Optional[str] = None) -> str:
+    properties = ""
+    if style or align:
+        properties = "<w:pPr>" + (f'<w:pStyle w:val="{style}"/>' if style else "") + (f'<w:jc w:val="{align}"/>' if align else "") + "</w:pPr>"
+    return DOCX_PARAGRAPH.format(properties=properties, runs=_docx_runs(text_value, color))
+
+def _docx_table(rows: list, widths: list, color: str, header_row: bool) -> str:
+    grid = "".join(f'<w:gridCol w:w="{width}"/>' for width in widths)
+    xml_rows = []
+    for row_index, row in enumerate(rows):
+        cells = []
+        for cell_index, cell in enumerate(row):
+            shaded = cell_index == 0 or (header_row and row_index == 0)
+            cells.append(DOCX_CELL.format(
+                width=widths[cell_index],
+                shading=DOCX_CELL_SHADING if shaded else "",
+                paragraph=_docx_paragraph(str(cell), color, align="center" if header_row else None),
+            ))
+        xml_rows.append("<w:tr>" + "".join(cells) + "</w:tr>")
+    return DOCX_TABLE.format(width=sum(widths), grid=grid, rows="".join(xml_rows)) + "<w:p/>"
+
+def _docx_logo(logo_path: str):
+    """ロゴ画像を (パーツ名, バイト列, 幅EMU, 高さEMU) で返す（WebP等はPNGに変換）"""
+    with PILImage.open(logo_path) as image:
+        width, height = image.size
+        image_format = (image.format or "").lower()
+        if image_format in ("png", "jpeg", "gif"):
+            with open(logo_path, "rb") as f:
+                data = f.read()
+        else:
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG")
+            data, image_format = buffer.getvalue(), "png"
+    scale = min(40 * DOCX_EMU_PER_MM / width, 20 * DOCX_EMU_PER_MM / height)
+    return f"logo.{image_format}", data, int(width * scale), int(height * scale)
+
+def _docx_hoiban_images(report: dict) -> dict:
+    """方位盤ブロックの盤ごとに (リレーションID, パーツ名, 図形ID) を割り当てる（同じ盤は1つの画像を共有）"""
+    images = {}
+    for section in report["sections"]:
+        for block in section["blocks"]:
+            if block["type"] != "hoiban":
+                continue
+            for board in block["boards"]:
+                key = (board["center"], board["board_type"], _hoiban_effects_key(board["effects"]))
+                if key not in images:
+                    number = len(images) + 1
+                    # 図形ID 1 はロゴ
+                    images[key] = (f"rIdHoiban{number}", f"hoiban{number}.png", number + 1)
+    return images
+
+def _docx_section_xml(section: dict, color: str, accent: str, hoiban_images: dict) -> str:
+    parts = [_docx_paragraph(section["heading"], color, style="Heading1")]
+    for block in section["blocks"]:
+        if block.get("title"):
+            parts.append(_docx_paragraph(block["title"], accent, style="Heading2"))
+        if block["type"] == "fields":
+            parts.append(_docx_table(block["rows"], [2000, DOCX_TEXT_WIDTH - 2000], color, header_row=False))
+        elif block["type"] == "table":
+            columns = len(block["rows"][0])
+            other_width = min(1134, (DOCX_TEXT_WIDTH - 1134) // max(1, columns - 1))
+            parts.append(_docx_table(block["rows"], [1134] + [other_width] * (columns - 1), color, header_row=True))
+        elif block["type"] == "paragraph":
+            parts.append(_docx_paragraph(block["text"], color))
+        elif block["type"] == "entries":
+            for name, text_value in block["items"]:
+                parts.append(_docx_paragraph(name, color, style="Heading3"))
+                parts.append(_docx_paragraph(text_value, color))
+        elif block["type"] == "hoiban":
+            extent = (DOCX_TEXT_WIDTH * 635 // len(block["boards"])) // 1000 * 1000  # twip → EMU
+            runs = []
+            for board in block["boards"]:
+                rid, name, shape_id = hoiban_images[(board["center"], board["board_type"], _hoiban_effects_key(board["effects"]))]
+                runs.append(DOCX_IMAGE_RUN.format(cx=extent, cy=extent, id=shape_id, name=name, rid=rid))
+            parts.append(DOCX_CENTERED_PARAGRAPH.format(runs="".join(runs)))
+    return "".join(parts)
+
+class _ZipChunkWriter:
+    """ZipFile の書き込み先。seek できないため zipfile はデータ記述子付きで逐次書き出す"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+# ZIP の日時の下限（ZIP形式は1980年より前の日時を表せない）
+DOCX_EPOCH = datetime(1980, 1, 1)
+
+def iter_report_docx(report: dict):
+    """build_report_document の結果からDOCXを生成し、ZIPのバイト列をセクション単位で順次返す
+
+    document.xml はセクションごとに書き足し、その都度圧縮済みのバイト列を返すため
+    文書全体をメモリ上に組み立てず、一時ファイルも使わない。
+    """
+    primary = report["theme"]["primary"].lstrip("#")
+    accent = report["theme"]["accent"].lstrip("#")
+    half_points = round(report["font_size"] * 2)
+    writer = _ZipChunkWriter()
+    logo = _docx_logo(report["logo_path"]) if report["logo_path"] else None
+    hoiban_images = _docx_hoiban_images(report)
+    # 同じ入力からは同じバイト列になるよう、作成日時とZIP内の各ファイルの日時を記録の作成日時に固定する
+    created = datetime.fromisoformat(report["created_at"]) if report.get("created_at") else DOCX_EPOCH
+    created = max(created, DOCX_EPOCH)
+
+    def entry(name: str, compress_type: int = zipfile.ZIP_DEFLATED) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=created.timetuple()[:6])
+        info.compress_type = compress_type
+        info.external_attr = 0o600 << 16
+        return info
+
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(entry("[Content_Types].xml"), DOCX_CONTENT_TYPES)
+        archive.writestr(entry("_rels/.rels"), DOCX_PACKAGE_RELS)
+        archive.writestr(entry("docProps/core.xml"), DOCX_CORE.format(
+            title=xml_escape(report["title"]),
+            subject=xml_escape(f"{report['client_name']}様"),
+            creator=xml_escape(report["business_name"]),
+            created=created.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        ))
+        archive.writestr(entry("word/styles.xml"), DOCX_STYLES.format(
+            font=DOCX_FONTS[report["font"]],
+            size=half_points,
+            small_size=round(half_points * 0.85),
+            title_size=half_points * 2,
+            heading_size=round(half_points * 1.4),
+            subheading_size=round(half_points * 1.15),
+            spacing=60 if report["layout"] == "compact" else 120,
+            primary=primary,
+            accent=accent,
+        ))
+        archive.writestr(entry("word/footer1.xml"), DOCX_FOOTER)
+        image_rels = [DOCX_IMAGE_REL.format(rid="rIdLogo", name=logo[0])] if logo else []
+        image_rels.extend(DOCX_IMAGE_REL.format(rid=rid, name=name) for rid, name, _ in hoiban_images.values())
+        archive.writestr(entry("word/_rels/document.xml.rels"), DOCX_DOCUMENT_RELS.format(images="".join(image_rels)))
+        if logo:
+            archive.writestr(entry(f"word/media/{logo[0]}", zipfile.ZIP_STORED), logo[1])
+        for (center, board_type, effects), (_, name, _) in hoiban_images.items():
+            archive.writestr(entry(f"word/media/{name}", zipfile.ZIP_STORED), hoiban_png(center, board_type, effects))
+        yield writer.drain()
+
+        with archive.open(entry("word/document.xml"), "w") as document:
+            document.write(DOCX_DOCUMENT_START)
+            header = [DOCX_CENTERED_PARAGRAPH.format(runs=DOCX_IMAGE_RUN.format(cx=logo[2], cy=logo[3], id=1, name=logo[0], rid="rIdLogo"))] if logo else []
+            header.append(_docx_paragraph(report["title"], primary, style="Title"))
+            if report["business_name"]:
+                operator = f"　鑑定士 {report['operator_name']}" if report["operator_name"] else ""
+                header.append(_docx_paragraph(report["business_name"] + operator, primary, align="center"))
+            header.append(_docx_paragraph(f"鑑定実施日 {report['date']}", primary, align="center"))
+            document.write("".join(header).encode("utf-8"))
+            for section in report["sections"]:
+                document.write(_docx_section_xml(section, primary, accent, hoiban_images).encode("utf-8"))
+                yield writer.drain()
+            footer = " ".join(filter(None, [report["business_name"], f"鑑定士：{report['operator_name']}" if report["operator_name"] else ""]))
+            closing = [_docx_paragraph(footer, primary, align="center")] if footer else []
+            closing.append(_docx_paragraph(report["disclaimer"], primary, style="Small"))
+            document.write("".join(closing).encode("utf-8") + DOCX_DOCUMENT_END)
+    yield writer.drain()
+
+def get_report_render_executor():
+    """レポート生成用のエグゼキューター（初回利用時に作成）"""
+    global report_render_executor
+    if report_render_executor is None:
+        if REPORT_RENDER_PROCESSES > 0:
+            report_render_executor = ProcessPoolExecutor(max_workers=REPORT_RENDER_PROCESSES)
+        else:
+            report_render_executor = ThreadPoolExecutor(max_workers=REPORT_RENDER_THREADS, thread_name_prefix="report")
+    return report_render_executor
+
+async def render_report_pdf_async(report: dict) -> bytes:
+    """イベントループを止めずにPDFを生成"""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    content = await loop.run_in_executor(get_report_render_executor(), render_report_pdf, report)
+    print(f"DEBUG: 鑑定書PDF生成 {(time.perf_counter() - started) * 1000:.0f}ms / {len(content)} bytes")
+    return content
+
+# 生成済みレポートのディスクキャッシュ
+# 構成: {REPORT_CACHE_DIR}/{user_id}/{record_id}/{key}.{pdf|docx}
+# 認証付きのダウンロードAPIからのみ配信する（静的ファイルとしては公開しない）
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "/tmp/report_cache")
+# PDFの生成方法: reportlab（既定、プロセス内で生成）/ chromium（HTMLテンプレートを常駐Chromiumで変換）
+REPORT_PDF_RENDERER = os.getenv("REPORT_PDF_RENDERER", "reportlab")
+# レンダラーの出力が変わる修正を入れたら上げる（既存キャッシュは自動的に使われなくなる）
+REPORT_RENDERER_VERSION = "3"
+REPORT_MEDIA_TYPES = {"pdf": "application/pdf", "docx": DOCX_MEDIA_TYPE}
+
+def report_artifact_key(report: dict, file_format: str) -> str:
+    """レポート構造（build_report_document の出力）の内容ハッシュから決まるキャッシュキー（ETagにも使用）
+
+    updated_at は秒単位のため同一秒内の更新を区別できない。描画に使う入力そのものをハッシュするので、
+    キーと生成したファイルの内容が常に一致する（生成中に記録が更新されても古い内容が新しいキーで保存されない）。
+    """
+    source = "|".join([
+        json.dumps(report, ensure_ascii=False, sort_keys=True, default=str),
+        REPORT_RENDERER_VERSION,
+        REPORT_PDF_RENDERER,
+        file_format,
+        # 埋め込みフォントを切り替えた場合も作り直す
+        REPORT_FONT_GOTHIC_PATH,
+        REPORT_FONT_MINCHO_PATH,
+    ])
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:32]
+
+def report_artifact_path(user_id: int, record_id: int, key: str, file_format: str) -> str:
+    return os.path.join(REPORT_CACHE_DIR, str(user_id), str(record_id), f"{key}.{file_format}")
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match に ETag が含まれるか（弱い比較）"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == etag.removeprefix("W/") for candidate in candidates)
+
+def report_etag(key: str, file_format: str) -> str:
+    """キャッシュキーから ETag を作る
+
+    同じ入力から同じバイト列を生成するレンダラー（reportlab / DOCX）のみ強い ETag にする。
+    Chromium は生成のたびに作成日時が変わるため弱い ETag とし、Range による部分配信も行わない。
+    """
+    if file_format == "pdf" and REPORT_PDF_RENDERER == "chromium":
+        return f'W/"{key}"'
+    return f'"{key}"'
+
+def _remove_stale_artifacts(path: str):
+    """同じ記録・同じ形式の古いキャッシュを削除"""
+    directory, name = os.path.split(path)
+    extension = os.path.splitext(name)[1]
+    for entry in os.listdir(directory):
+        if entry != name and entry.endswith(extension):
+            artifact_store.remove(os.path.join(directory, entry))
+
+def store_report_artifact(path: str, content: bytes, pin: bool = False):
+    """一時ファイルに書いてから置き換え（読み取り中のリクエストに書きかけを見せない）
+
+    pin=True の場合は登録と同時に配信中として固定する（呼び出し側で unpin すること）。
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+    _remove_stale_artifacts(path)
+    artifact_store.add(path, pin=pin)
+
+def iter_and_store_report_artifact(chunks, path: str):
+    """ストリーミング中のチャンクをそのまま返しつつキャッシュへ書き出す（途中で切断された場合は破棄）"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    completed = False
+    try:
+        with open(temp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(temp_path, path)
+        completed = True
+        _remove_stale_artifacts(path)
+        artifact_store.add(path)
+    finally:
+        if not completed and os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+def purge_report_artifacts(user_id: int, record_id: Optional[int] = None):
+    """記録単位（record_id 指定時）またはユーザー単位でキャッシュを削除"""
+    target = os.path.join(REPORT_CACHE_DIR, str(user_id))
+    if record_id is not None:
+        target = os.path.join(target, str(record_id))
+    artifact_store.remove_tree(target)
+
+# 生成ファイルの保持管理（/tmp/pdf_storage と鑑定書キャッシュ）
+# 合計サイズ・最終アクセスからの経過時間の上限を超えた分を、最後にダウンロードされたのが古い順に削除する
+ARTIFACT_STORAGE_MAX_BYTES = int(float(os.getenv("ARTIFACT_STORAGE_MAX_MB", "2048")) * 1024 * 1024)
+ARTIFACT_MAX_AGE_SECONDS = int(float(os.getenv("ARTIFACT_MAX_AGE_HOURS", "168")) * 3600)  # 0 で無効
+# 書きかけの .tmp や PDF化済みの .html をこの秒数より古ければ中間ファイルとして削除する
+ARTIFACT_INTERMEDIATE_MAX_AGE_SECONDS = int(os.getenv("ARTIFACT_INTERMEDIATE_MAX_AGE_SECONDS", "3600"))
+ARTIFACT_CLEANUP_INTERVAL_SECONDS = int(os.getenv("ARTIFACT_CLEANUP_INTERVAL_SECONDS", "600"))
+ARTIFACT_EXTENSIONS = (".pdf", ".docx", ".html")
+
+class ArtifactStore:
+    """生成ファイルのインデックス（パス → サイズ・最終アクセス時刻、LRU順）
+
+    インデックスは起動時にファイルシステムから再構築する。最終アクセス時刻はファイルの
+    mtime にも反映するため、再起動後もダウンロード順が保たれる。
+    配信中のファイルは pin で固定し、unpin されるまで削除しない。固定はインデックスに
+    登録済みのファイルに限り、削除はロック内でインデックスから外してから行うため、
+    固定できたファイルが配信中に消えることはない。
+    """
+
+    def __init__(self, roots, max_bytes: int, max_age_seconds: int, intermediate_max_age_seconds: int):
+        self.roots = roots
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.intermediate_max_age_seconds = intermediate_max_age_seconds
+        self.entries = OrderedDict()  # path -> (size, last_access)
+        self.total_bytes = 0
+        self.pins = {}  # path -> 配信中のリクエスト数
+        # 追加・アクセスはイベントループとスレッドプールの両方から行われる
+        self.lock = threading.Lock()
+        self.stats = {"evicted_files": 0, "evicted_bytes": 0, "intermediates_removed": 0, "hits": 0, "last_cleanup_at": None}
+
+    def _set(self, path: str, size: int, last_access: float):
+        previous = self.entries.pop(path, None)
+        if previous:
+            self.total_bytes -= previous[0]
+        self.entries[path] = (size, last_access)
+        self.total_bytes += size
+
+    def add(self, path: str, pin: bool = False):
+        """生成したファイルを最新として登録し、上限を超えていれば古いものを削除"""
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self.lock:
+            self._set(path, size, time.time())
+            if pin:
+                self.pins[path] = self.pins.get(path, 0) + 1
+            over_budget = self.total_bytes > self.max_bytes
+        if over_budget:
+            self.enforce()
+
+    def touch(self, path: str):
+        """ダウンロード時に呼び出し、LRU順の末尾へ移動する"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return
+            self.entries[path] = (entry[0], now)
+            self.entries.move_to_end(path)
+            self.stats["hits"] += 1
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+
+    def pin(self, path: str) -> bool:
+        """登録済みのファイルを配信中として固定し、最終アクセスを更新（未登録・削除済みなら False）"""
+        with self.lock:
+            if path not in self.entries:
+                return False
+            self.pins[path] = self.pins.get(path, 0) + 1
+        self.touch(path)
+        return True
+
+    def unpin(self, path: str):
+        with self.lock:
+            count = self.pins.get(path, 0) - 1
+            if count > 0:
+                self.pins[path] = count
+            else:
+                self.pins.pop(path, None)
+
+    def _unlink(self, path: str) -> int:
+        """インデックスから外してファイルを削除（ロックを保持した状態で呼ぶ）"""
+        entry = self.entries.pop(path, None)
+        if entry:
+            self.total_bytes -= entry[0]
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return entry[0] if entry else 0
+
+    def remove(self, path: str):
+        """ファイルを削除（配信中の場合は残し、配信後に上限・経過時間の管理で削除する）"""
+        with self.lock:
+            if not self.pins.get(path):
+                self._unlink(path)
+
+    def remove_tree(self, directory: str):
+        """ディレクトリ配下のファイルを削除（配信中のファイルは remove と同様に残す）"""
+        with self.lock:
+            for current, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    path = os.path.join(current, filename)
+                    # 書き込み中の .tmp は生成処理側で置き換えるため残す
+                    if filename.endswith(ARTIFACT_EXTENSIONS) and not self.pins.get(path):
+                        self._unlink(path)
+
+    def _is_intermediate(self, path: str, age: float) -> bool:
+        if path.endswith(".tmp"):
+            return age > self.intermediate_max_age_seconds
+        if path.endswith(".html"):
+            # PDF化に成功したHTMLは不要（旧バージョンが /tmp/pdf_storage に残したもの）
+            return age > self.intermediate_max_age_seconds and os.path.exists(path[:-len(".html")] + ".pdf")
+        return False
+
+    def rebuild(self):
+        """ファイルシステムを走査してインデックスを作り直し、中間ファイルと空ディレクトリを削除"""
+        now = time.time()
+        found = []
+        removed = 0
+        for root in self.roots:
+            if not os.path.isdir(root):
+                continue
+            for directory, subdirectories, filenames in os.walk(root, topdown=False):
+                for filename in filenames:
+                    path = os.path.join(directory, filename)
+                    try:
+                        stat_result = os.stat(path)
+                    except OSError:
+                        continue
+                    if self._is_intermediate(path, now - stat_result.st_mtime):
+                        try:
+                            os.unlink(path)
+                            removed += 1
+                        except OSError:
+                            pass
+                    elif filename.endswith(ARTIFACT_EXTENSIONS):
+                        found.append((stat_result.st_mtime, path, stat_result.st_size))
+                # 作成直後（これから書き込まれる）のディレクトリは残す
+                try:
+                    if directory != root and not os.listdir(directory) and now - os.stat(directory).st_mtime > self.intermediate_max_age_seconds:
+                        os.rmdir(directory)
+                except OSError:
+                    pass
+        found.sort()
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            for last_access, path, size in found:
+                self._set(path, size, last_access)
+            self.stats["intermediates_removed"] += removed
+        return removed
+
+    def enforce(self):
+        """経過時間・合計サイズの上限を超えたファイルをLRU順に削除"""
+        now = time.time()
+        victims = []
+        with self.lock:
+            for path, (size, last_access) in list(self.entries.items()):
+                expired = self.max_age_seconds > 0 and now - last_access > self.max_age_seconds
+                if not expired and self.total_bytes <= self.max_bytes:
+                    break
+                # 生成中・待機中・配信中の鑑定書は削除しない
+                if path in report_render_inflight or self.pins.get(path):
+                    continue
+                self._unlink(path)
+                victims.append((path, size))
+        for path, size in victims:
+            self.stats["evicted_files"] += 1
+            self.stats["evicted_bytes"] += size
+        if victims:
+            print(f"DEBUG: 生成ファイル削除 {len(victims)}件 / {sum(size for _, size in victims)} bytes")
+        return len(victims)
+
+    def cleanup(self):
+        """定期実行：インデックスの再構築（中間ファイル削除を含む）と上限の適用"""
+        removed = self.rebuild()
+        evicted = self.enforce()
+        self.stats["last_cleanup_at"] = datetime.now().isoformat()
+        return {"intermediates_removed": removed, "evicted": evicted}
+
+    def metrics(self) -> dict:
+        with self.lock:
+            items = list(self.entries.items())
+            total_bytes = self.total_bytes
+            pinned = len(self.pins)
+        by_type = {}
+        for path, (size, _) in items:
+            extension = os.path.splitext(path)[1].lstrip(".")
+            bucket = by_type.setdefault(extension, {"files": 0, "bytes": 0})
+            bucket["files"] += 1
+            bucket["bytes"] += size
+        oldest = items[0][1][1] if items else None
+        return {
+            "roots": self.roots,
+            "files": len(items),
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "usage_ratio": round(total_bytes / self.max_bytes, 4) if self.max_bytes else None,
+            "max_age_seconds": self.max_age_seconds,
+            "oldest_access_at": datetime.fromtimestamp(oldest).isoformat() if oldest else None,
+            "by_type": by_type,
+            "pinned_files": pinned,
+            **self.stats,
+        }
+
+artifact_store = ArtifactStore(
+    [PDF_STORAGE_DIR, REPORT_CACHE_DIR],
+    ARTIFACT_STORAGE_MAX_BYTES,
+    ARTIFACT_MAX_AGE_SECONDS,
+    ARTIFACT_INTERMEDIATE_MAX_AGE_SECONDS
+)
+artifact_cleanup_task = None
+
+class ArtifactFileResponse(FileResponse):
+    """pin 済みの生成ファイルを配信し、送信が終わった時点（切断時を含む）で固定を解除する
+
+    ETag が弱い場合は再生成でバイト列が変わり得るため、Range / If-Range を無視して全体を返す
+    （再開したダウンロードが別のファイルの断片を受け取らないように）。
+    """
+
+    def __init__(self, path, *args, **kwargs):
+        super().__init__(path, *args, **kwargs)
+        self.ranges_allowed = not self.headers.get("etag", "").startswith("W/")
+        if not self.ranges_allowed:
+            self.headers["accept-ranges"] = "none"
+
+    async def __call__(self, scope, receive, send):
+        if not self.ranges_allowed:
+            scope = {**scope, "headers": [(name, value) for name, value in scope["headers"] if name not in (b"range", b"if-range")]}
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            artifact_store.unpin(self.path)
+
+async def artifact_cleanup_loop():
+    while True:
+        await asyncio.sleep(ARTIFACT_CLEANUP_INTERVAL_SECONDS)
+        try:
+            await asyncio.to_thread(artifact_store.cleanup)
+        except Exception as e:
+            print(f"生成ファイル整理エラー: {str(e)}")
+
+@app.on_event("startup")
+async def start_artifact_cleanup():
+    global artifact_cleanup_task
+    result = await asyncio.to_thread(artifact_store.cleanup)
+    print(f"DEBUG: 生成ファイルインデックス {len(artifact_store.entries)}件 / {artifact_store.total_bytes} bytes {result}")
+    if ARTIFACT_CLEANUP_INTERVAL_SECONDS > 0:
+        artifact_cleanup_task = asyncio.create_task(artifact_cleanup_loop())
+
+@app.on_event("shutdown")
+async def stop_artifact_cleanup():
+    if artifact_cleanup_task:
+        artifact_cleanup_task.cancel()
+
+# 鑑定書の事前生成（診断完了時に低優先度キューへ投入）
+REPORT_PRERENDER_FORMATS = [f.strip() for f in os.getenv("REPORT_PRERENDER_FORMATS", "pdf").split(",") if f.strip()]
+REPORT_PRERENDER_WORKERS = int(os.getenv("REPORT_PRERENDER_WORKERS", "1"))
+REPORT_PRERENDER_QUEUE_SIZE = int(os.getenv("REPORT_PRERENDER_QUEUE_SIZE", "1000"))
+# 優先度（数値が小さいほど先に処理）。ダウンロード要求はキューを通さず直接生成する
+REPORT_PRIORITY_PRERENDER = 10
+report_prerender_queue = None
+report_prerender_tasks = []
+report_prerender_sequence = 0
+# 生成中のキャッシュパス → 完了待ちFuture（同じ鑑定書を二重に生成しない）
+report_render_inflight: Dict[str, asyncio.Future] = {}
+
+def _render_report_docx_bytes(report: dict) -> bytes:
+    return b"".join(iter_report_docx(report))
+
+async def render_report_artifact(record, settings: dict, file_format: str, report: Optional[dict] = None,
+                                 pin: bool = False) -> str:
+    """キャッシュになければ鑑定書を生成して保存し、キャッシュファイルのパスを返す
+
+    同じキーの生成が進行中（事前生成など）の場合は新たに生成せず、その完了を待つ。
+    ETag 用に組み立て済みのレポート構造があれば report に渡す（二重に組み立てない）。
+    pin=True の場合は返すファイルを配信中として固定する（配信後に artifact_store.unpin すること）。
+    """
+    if report is None:
+        report = build_report_document(record, settings)
+    key = report_artifact_key(report, file_format)
+    path = report_artifact_path(record.user_id, record.id, key, file_format)
+    if pin and artifact_store.pin(path):
+        return path
+    if not pin and os.path.exists(path):
+        artifact_store.touch(path)
+        return path
+    inflight = report_render_inflight.get(path)
+    if inflight is not None:
+        print(f"DEBUG: 生成中の鑑定書の完了を待機 {path}")
+        path = await asyncio.shield(inflight)
+        # 完了から固定までの間に削除された場合はここで作り直す
+        if not pin or artifact_store.pin(path):
+            return path
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    # 待機者がいない場合に例外が未取得の警告にならないようにする
+    future.add_done_callback(lambda f: f.cancelled() or f.exception())
+    report_render_inflight[path] = future
+    try:
+        if file_format == "pdf" and REPORT_PDF_RENDERER == "chromium":
+            content = await render_report_pdf_chromium(report, path)
+        elif file_format == "pdf":
+            content = await render_report_pdf_async(report)
+        else:
+            content = await loop.run_in_executor(get_report_render_executor(), _render_report_docx_bytes, report)
+        if file_format == "pdf":
+            await record_pdf_file_size(record.id, len(content))
+        # 固定してから返すまでの間に await を挟まない（キャンセルされて固定が残らないように）
+        store_report_artifact(path, content, pin=pin)
+        future.set_result(path)
+        return path
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        report_render_inflight.pop(path, None)
+
+async def record_pdf_file_size(record_id: int, file_size: int):
+    """生成したPDFのサイズを記録（鑑定内容の変更ではないため updated_at は更新しない）"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(KanteiRecord)
+            .where(KanteiRecord.id == record_id)
+            .values(pdf_file_size=file_size, pdf_generated_at=datetime.utcnow(), updated_at=KanteiRecord.updated_at)
+        )
+        await db.commit()
+
+def enqueue_report_prerender(record_id: int, priority: int = REPORT_PRIORITY_PRERENDER):
+    """鑑定書の事前生成を予約（キューが満杯の場合は諦め、ダウンロード時に生成する）"""
+    global report_prerender_sequence
+    if report_prerender_queue is None or not REPORT_PRERENDER_FORMATS:
+        return
+    report_prerender_sequence += 1
+    try:
+        report_prerender_queue.put_nowait((priority, report_prerender_sequence, record_id))
+    except asyncio.QueueFull:
+        print(f"DEBUG: 事前生成キューが満杯のため鑑定書 {record_id} の事前生成をスキップ")
+
+async def prerender_report(record_id: int):
+    async with AsyncSessionLocal() as db:
+        record = await get_kantei_record_by_id(db, record_id)
+    if not record or record.status not in ("completed", "partial"):
+        return
+    settings = await get_user_template_settings(record.user_id)
+    for file_format in REPORT_PRERENDER_FORMATS:
+        started = time.perf_counter()
+        path = await render_report_artifact(record, settings, file_format)
+        print(f"DEBUG: 鑑定書事前生成 {record_id} {file_format} {(time.perf_counter() - started) * 1000:.0f}ms {path}")
+
+async def report_prerender_worker():
+    while True:
+        _, _, record_id = await report_prerender_queue.get()
+        try:
+            await prerender_report(record_id)
+        except Exception as e:
+            print(f"鑑定書事前生成エラー（{record_id}）: {str(e)}")
+        finally:
+            report_prerender_queue.task_done()
+
+@app.on_event("startup")
+async def start_report_prerender_workers():
+    global report_prerender_queue
+    if REPORT_PRERENDER_WORKERS > 0:
+        report_prerender_queue = asyncio.PriorityQueue(maxsize=REPORT_PRERENDER_QUEUE_SIZE)
+        for _ in range(REPORT_PRERENDER_WORKERS):
+            report_prerender_tasks.append(asyncio.create_task(report_prerender_worker()))
+
+@app.on_event("shutdown")
+async def stop_report_prerender_workers():
+    for task in report_prerender_tasks:
+        task.cancel()
+
+@app.on_event("shutdown")
+async def stop_report_render_executor():
+    if report_render_executor is not None:
+        report_render_executor.shutdown(wait=False, cancel_futures=True)
 
 # 管理者用データベース統計API
 # ファイルダウンロードエンドポイント
@@ -2604,20 +5588,23 @@ async def delete_failed_diagnoses(current_user: User = Depends(get_current_user)
 async def download_diagnosis_file(
     diagnosis_id: int,
     file_format: str,
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None)
 ):
     """
     鑑定書をPDF/Word形式でダウンロードする
     file_format: 'pdf' または 'docx'
+    生成結果はディスクにキャッシュし、ETag / If-None-Match に対応する
     """
-    db = SessionLocal()
+    db = AsyncSessionLocal()
 
     try:
         # 鑑定書データを取得
-        diagnosis = db.query(KanteiRecord).filter(
+        result = await db.execute(select(KanteiRecord).where(
             KanteiRecord.id == diagnosis_id,
             KanteiRecord.user_id == current_user.id
-        ).first()
+        ))
+        diagnosis = result.scalar_one_or_none()
 
         if not diagnosis:
             raise HTTPException(status_code=404, detail="鑑定書が見つかりません")
@@ -2626,7 +5613,7 @@ async def download_diagnosis_file(
             raise HTTPException(status_code=400, detail="未完了の鑑定書はダウンロードできません")
 
         # ユーザーのテンプレート設定を取得
-        user_settings = get_user_template_settings(current_user.id)
+        user_settings = await get_user_template_settings(current_user.id)
         business_name = user_settings.get('business_name', '鑑定事業所')
 
         # ファイル名を生成（URL安全な文字のみ使用）
@@ -2636,62 +5623,203 @@ async def download_diagnosis_file(
         safe_business_name = urllib.parse.quote(business_name, safe='')
         filename = f"kantei_{safe_business_name}_{now.strftime('%Y-%m-%d_%H-%M')}.{file_format}"
 
-        if file_format.lower() == 'pdf':
-            # PDF生成ロジック（既存のPDF生成機能を拡張）
-            # ここでは簡単なプレースホルダー実装
-            from fastapi.responses import Response
-
-            # 簡単なPDFコンテンツ（実際の実装では適切なPDF生成ライブラリを使用）
-            pdf_content = f"""
-            鑑定書
-
-            クライアント: {diagnosis.client_name}
-            事業者: {business_name}
-            作成日時: {now.strftime('%Y年%m月%d日 %H:%M')}
-
-            {diagnosis.calculation_result if diagnosis.calculation_result else '計算結果なし'}
-
-            鑑定士コメント:
-            {diagnosis.appraiser_comment if diagnosis.appraiser_comment else 'コメントなし'}
-            """.encode('utf-8')
-
-            return Response(
-                content=pdf_content,
-                media_type="application/pdf",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-
-        elif file_format.lower() == 'docx':
-            # Word文書生成
-            from fastapi.responses import Response
-            import io
-
-            # 簡単なWord文書コンテンツ（実際の実装では適切なdocxライブラリを使用）
-            docx_content = f"""
-            鑑定書
-
-            クライアント: {diagnosis.client_name}
-            事業者: {business_name}
-            作成日時: {now.strftime('%Y年%m月%d日 %H:%M')}
-
-            {diagnosis.calculation_result if diagnosis.calculation_result else '計算結果なし'}
-
-            鑑定士コメント:
-            {diagnosis.appraiser_comment if diagnosis.appraiser_comment else 'コメントなし'}
-            """.encode('utf-8')
-
-            return Response(
-                content=docx_content,
-                media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                headers={"Content-Disposition": f"attachment; filename={filename}"}
-            )
-        else:
+        file_format = file_format.lower()
+        if file_format not in REPORT_MEDIA_TYPES:
             raise HTTPException(status_code=400, detail="サポートされていないファイル形式です。'pdf' または 'docx' を指定してください。")
 
+        report = build_report_document(diagnosis, user_settings)
+        key = report_artifact_key(report, file_format)
+        etag = report_etag(key, file_format)
+        headers = {
+            "Content-Disposition": f"attachment; filename={filename}",
+            "ETag": etag,
+            "Cache-Control": "private, no-cache",
+        }
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+
+        artifact_path = report_artifact_path(current_user.id, diagnosis.id, key, file_format)
+        if artifact_store.pin(artifact_path):
+            print(f"DEBUG: 鑑定書キャッシュヒット {artifact_path}")
+            return ArtifactFileResponse(artifact_path, media_type=REPORT_MEDIA_TYPES[file_format], headers=headers)
+
+        if file_format == 'pdf' or artifact_path in report_render_inflight:
+            # 事前生成中であればその完了を待ち、なければここで生成する
+            artifact_path = await render_report_artifact(diagnosis, user_settings, file_format, report, pin=True)
+            return ArtifactFileResponse(artifact_path, media_type=REPORT_MEDIA_TYPES[file_format], headers=headers)
+
+        # Word文書生成（ZIPをそのままレスポンスへストリーミングしつつキャッシュに保存）
+        return StreamingResponse(
+            iter_and_store_report_artifact(iter_report_docx(report), artifact_path),
+            media_type=DOCX_MEDIA_TYPE,
+            headers=headers
+        )
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"ファイル生成エラー: {str(e)}")
     finally:
-        db.close()
+        await db.close()
+
+# 鑑定書一括ダウンロード設定
+# 同時に生成する鑑定書の数（既定はレポート生成エグゼキューターのワーカー数）
+REPORT_BULK_CONCURRENCY = int(os.getenv("REPORT_BULK_CONCURRENCY", str(max(REPORT_RENDER_PROCESSES, REPORT_RENDER_THREADS))))
+REPORT_BULK_PAGE_SIZE = int(os.getenv("REPORT_BULK_PAGE_SIZE", "100"))
+REPORT_BULK_MAX_ITEMS = int(os.getenv("REPORT_BULK_MAX_ITEMS", "2000"))
+REPORT_BULK_READ_CHUNK_SIZE = 256 * 1024
+
+async def iter_bulk_report_records(user_id: int, ids: Optional[list], diagnosis_pattern: Optional[str],
+                                   date_from: Optional[str], date_to: Optional[str]):
+    """対象の鑑定記録をページ単位で読み出す（ID指定時はIDの分割、条件指定時はIDのキーセットページング）"""
+    base_query = select(KanteiRecord).where(
+        KanteiRecord.user_id == user_id,
+        KanteiRecord.status.in_(["completed", "partial"])
+    )
+    if diagnosis_pattern:
+        base_query = base_query.where(KanteiRecord.diagnosis_pattern == diagnosis_pattern)
+    start = parse_date_filter(date_from, "date_from")
+    if start:
+        base_query = base_query.where(KanteiRecord.created_at >= start)
+    end = parse_date_filter(date_to, "date_to")
+    if end:
+        base_query = base_query.where(KanteiRecord.created_at < end + timedelta(days=1))
+
+    sorted_ids = sorted(set(ids)) if ids is not None else None
+    offset = 0
+    last_id = 0
+    while True:
+        if sorted_ids is not None:
+            page_ids = sorted_ids[offset:offset + REPORT_BULK_PAGE_SIZE]
+            if not page_ids:
+                return
+            offset += len(page_ids)
+            query = base_query.where(KanteiRecord.id.in_(page_ids)).order_by(KanteiRecord.id)
+        else:
+            query = base_query.where(KanteiRecord.id > last_id).order_by(KanteiRecord.id).limit(REPORT_BULK_PAGE_SIZE)
+        async with AsyncSessionLocal() as db:
+            records = (await db.execute(query)).scalars().all()
+        if sorted_ids is None and not records:
+            return
+        for record in records:
+            yield record
+        if records:
+            last_id = records[-1].id
+
+def _bulk_report_filename(record, file_format: str) -> str:
+    """ZIP内のファイル名（IDで一意にし、ファイル名に使えない文字は置き換える）"""
+    safe_name = re.sub(r'[\\/:*?"<>|\s]+', "_", record.client_name or "").strip("_") or "client"
+    return f"{record.id}_{safe_name}.{file_format}"
+
+def _zip_add_file(archive: zipfile.ZipFile, writer: _ZipChunkWriter, path: str, name: str):
+    """ファイルを一定サイズずつZIPへ書き込み、書き込むたびに出力バイト列を返す"""
+    with open(path, "rb") as source, archive.open(name, "w") as target:
+        while True:
+            data = source.read(REPORT_BULK_READ_CHUNK_SIZE)
+            if not data:
+                break
+            target.write(data)
+            yield writer.drain()
+    yield writer.drain()
+
+async def stream_bulk_reports(user_id: int, file_format: str, ids: Optional[list],
+                              diagnosis_pattern: Optional[str], date_from: Optional[str], date_to: Optional[str]):
+    """鑑定書を並列に生成しながら、完成した順にZIPへ追加してストリーミング
+
+    メモリに保持するのは生成中の数件分と読み込み中のページのみで、件数に依存しない。
+    PDF/DOCX は圧縮済みのため ZIP_STORED で格納する。
+    """
+    settings = await get_user_template_settings(user_id)
+    writer = _ZipChunkWriter()
+    archive = zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_STORED)
+    pending = set()
+    errors = []
+    count = 0
+    started = time.perf_counter()
+
+    async def render(record):
+        try:
+            # ZIP に書き込み終えるまで削除されないよう固定する
+            return record, await render_report_artifact(record, settings, file_format, pin=True), None
+        except Exception as e:
+            return record, None, str(e)
+
+    def add_completed(done):
+        results = [task.result() for task in done]
+        try:
+            while results:
+                record, path, error = results.pop(0)
+                if error:
+                    errors.append(f"{record.id}\t{record.client_name}\t{error}")
+                    continue
+                try:
+                    yield from _zip_add_file(archive, writer, path, _bulk_report_filename(record, file_format))
+                finally:
+                    artifact_store.unpin(path)
+        finally:
+            # 切断で中断した場合、まだ書き込んでいない鑑定書の固定を解除する
+            for _, path, _ in results:
+                if path:
+                    artifact_store.unpin(path)
+
+    try:
+        async for record in iter_bulk_report_records(user_id, ids, diagnosis_pattern, date_from, date_to):
+            if count >= REPORT_BULK_MAX_ITEMS:
+                errors.append(f"-\t-\t上限 {REPORT_BULK_MAX_ITEMS} 件に達したため以降の鑑定書は含まれていません")
+                break
+            count += 1
+            pending.add(asyncio.create_task(render(record)))
+            if len(pending) >= REPORT_BULK_CONCURRENCY:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for chunk in add_completed(done):
+                    if chunk:
+                        yield chunk
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for chunk in add_completed(done):
+                if chunk:
+                    yield chunk
+
+        if errors:
+            archive.writestr("_errors.txt", ("ID\tお名前\tエラー\n" + "\n".join(errors) + "\n").encode("utf-8"))
+        archive.close()
+        yield writer.drain()
+        print(f"DEBUG: 鑑定書一括ダウンロード {count}件 エラー{len(errors)}件 {(time.perf_counter() - started) * 1000:.0f}ms")
+    finally:
+        # クライアント切断時は生成中のタスクを止める（生成済みのキャッシュは残る）
+        for task in pending:
+            if task.done() and not task.cancelled() and task.result()[1]:
+                artifact_store.unpin(task.result()[1])
+            else:
+                task.cancel()
+
+@app.post("/api/diagnosis/reports/bulk")
+async def download_reports_bulk(
+    request_data: BulkReportRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """鑑定書一括ダウンロードAPI（ID指定または条件指定・ZIPストリーミング）"""
+    file_format = request_data.format.lower()
+    if file_format not in REPORT_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format は pdf または docx を指定してください")
+    if request_data.ids is not None and len(request_data.ids) > REPORT_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一度にダウンロードできるのは {REPORT_BULK_MAX_ITEMS} 件までです")
+    try:
+        # 日付形式はストリーミング開始前に検証する
+        parse_date_filter(request_data.date_from, "date_from")
+        parse_date_filter(request_data.date_to, "date_to")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = f"kantei_reports_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        stream_bulk_reports(
+            current_user.id, file_format, request_data.ids,
+            request_data.diagnosis_pattern, request_data.date_from, request_data.date_to
+        ),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # 鑑定士コメント更新エンドポイント
 @app.put("/api/diagnosis/{diagnosis_id}/comment")
@@ -2701,13 +5829,14 @@ async def update_appraiser_comment(
     current_user: User = Depends(get_current_user)
 ):
     """鑑定士コメントを更新する"""
-    db = SessionLocal()
+    db = AsyncSessionLocal()
 
     try:
-        diagnosis = db.query(KanteiRecord).filter(
+        result = await db.execute(select(KanteiRecord).where(
             KanteiRecord.id == diagnosis_id,
             KanteiRecord.user_id == current_user.id
-        ).first()
+        ))
+        diagnosis = result.scalar_one_or_none()
 
         if not diagnosis:
             raise HTTPException(status_code=404, detail="鑑定書が見つかりません")
@@ -2716,8 +5845,10 @@ async def update_appraiser_comment(
         comment = comment_data.get('comment', '').strip()[:500]  # 500文字制限
         diagnosis.appraiser_comment = comment if comment else None
 
-        db.commit()
-        db.refresh(diagnosis)
+        await db.commit()
+        await db.refresh(diagnosis)
+        # 内容が変わればキーも変わるが、使われなくなった古いキャッシュはここで削除しておく
+        purge_report_artifacts(current_user.id, diagnosis_id)
 
         return {
             "success": True,
@@ -2726,54 +5857,177 @@ async def update_appraiser_comment(
         }
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"コメント更新エラー: {str(e)}")
     finally:
-        db.close()
+        await db.close()
+
+# 管理者用統計のキャッシュ設定
+ADMIN_STATS_CACHE_TTL_SECONDS = int(os.getenv("ADMIN_STATS_CACHE_TTL_SECONDS", "30"))
+ADMIN_STATS_DAILY_DAYS = int(os.getenv("ADMIN_STATS_DAILY_DAYS", "30"))
+admin_stats_cache = {"data": None, "expires_at": 0.0}
+admin_stats_lock = asyncio.Lock()
+
+async def collect_database_stats(db):
+    """テーブルごとに1回の集計クエリで統計情報を収集"""
+    # ユーザー統計（1クエリ）
+    user_row = (await db.execute(select(
+        func.count(),
+        func.coalesce(func.sum(case((User.is_active == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((User.is_superuser == True, 1), else_=0)), 0)
+    ).select_from(User))).one()
+    total_users, active_users, admin_users = (int(value) for value in user_row)
+
+    # 鑑定履歴統計（ステータス × 診断パターン × 作成日 × 本命星で1クエリ、サマリー列を使用）
+    # 作成日は直近N日分のみ日付にし、それ以前は NULL にまとめてグループ数を抑える
+    since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=ADMIN_STATS_DAILY_DAYS - 1)
+    day_column = case((KanteiRecord.created_at >= since, func.date(KanteiRecord.created_at)), else_=None)
+    grouped_rows = (await db.execute(
+        select(
+            KanteiRecord.status,
+            KanteiRecord.diagnosis_pattern,
+            day_column,
+            KanteiRecord.honmeisei,
+            func.count(),
+            func.coalesce(func.sum(KanteiRecord.seimei_score), 0),
+            func.count(KanteiRecord.seimei_score)
+        )
+        .group_by(KanteiRecord.status, KanteiRecord.diagnosis_pattern, day_column, KanteiRecord.honmeisei)
+    )).all()
+
+    by_status = {}
+    by_pattern = {}
+    by_day = {}
+    by_honmeisei = {}
+    total_diagnoses = 0
+    score_sum = 0
+    score_count = 0
+    for status_value, pattern_value, day, honmeisei, count, group_score_sum, group_score_count in grouped_rows:
+        pattern_key = pattern_value or "all"  # 既存レコードのデフォルト
+        by_status[status_value] = by_status.get(status_value, 0) + count
+        by_pattern[pattern_key] = by_pattern.get(pattern_key, 0) + count
+        if day is not None:
+            by_day[str(day)] = by_day.get(str(day), 0) + count
+        if honmeisei is not None:
+            by_honmeisei[honmeisei] = by_honmeisei.get(honmeisei, 0) + count
+        total_diagnoses += count
+        score_sum += int(group_score_sum)
+        score_count += group_score_count
+    per_day = [{"date": day, "count": by_day[day]} for day in sorted(by_day)]
+
+    # テンプレート設定統計
+    total_templates = await db.scalar(select(func.count()).select_from(TemplateSettingsDB))
+
+
+    return {
+        "users": {
+            "total": total_users,
+            "active": active_users,
+            "admins": admin_users,
+            "inactive": total_users - active_users
+        },
+        "diagnoses": {
+            "total": total_diagnoses,
+            "completed": by_status.get("completed", 0),
+            "partial": by_status.get("partial", 0),
+            "failed": by_status.get("failed", 0),
+            "processing": by_status.get("processing", 0),
+            "by_status": by_status,
+            "by_pattern": by_pattern,
+            "per_day": per_day,
+            "by_honmeisei": by_honmeisei,
+            "average_seimei_score": round(score_sum / score_count, 1) if score_count else None
+        },
+        "templates": {
+            "total": total_templates
+        }
+    }
 
 @app.get("/api/admin/db-stats")
-async def get_database_stats(current_user: User = Depends(get_current_user)):
-    """管理者用データベース統計情報を取得"""
-    db = next(get_db())
+async def get_database_stats(refresh: bool = False, current_user: User = Depends(get_current_admin_user)):
+    """管理者用データベース統計情報を取得（短時間キャッシュ付き。refresh=true は全件集計になるため管理者のみ）"""
     try:
-        # ユーザー統計
-        total_users = db.query(User).count()
-        active_users = db.query(User).filter(User.is_active == True).count()
-        admin_users = db.query(User).filter(User.is_superuser == True).count()
+        now = time.time()
+        if not refresh and admin_stats_cache["data"] is not None and admin_stats_cache["expires_at"] > now:
+            return {"success": True, "cached": True, "data": admin_stats_cache["data"]}
 
-        # 鑑定履歴統計
-        total_diagnoses = db.query(KanteiRecord).count()
-        completed_diagnoses = db.query(KanteiRecord).filter(KanteiRecord.status == "completed").count()
-        failed_diagnoses = db.query(KanteiRecord).filter(KanteiRecord.status == "failed").count()
+        # 同時アクセス時に集計クエリが重複実行されないようにする
+        async with admin_stats_lock:
+            now = time.time()
+            if not refresh and admin_stats_cache["data"] is not None and admin_stats_cache["expires_at"] > now:
+                return {"success": True, "cached": True, "data": admin_stats_cache["data"]}
 
-        # テンプレート設定統計
-        total_templates = db.query(TemplateSettings).count()
+            async with AsyncSessionLocal() as db:
+                data = await collect_database_stats(db)
 
-        return {
-            "success": True,
-            "data": {
-                "users": {
-                    "total": total_users,
-                    "active": active_users,
-                    "admins": admin_users,
-                    "inactive": total_users - active_users
-                },
-                "diagnoses": {
-                    "total": total_diagnoses,
-                    "completed": completed_diagnoses,
-                    "failed": failed_diagnoses,
-                    "processing": total_diagnoses - completed_diagnoses - failed_diagnoses
-                },
-                "templates": {
-                    "total": total_templates
-                }
-            }
-        }
+            data["generated_at"] = datetime.now().isoformat()
+            admin_stats_cache["data"] = data
+            admin_stats_cache["expires_at"] = now + ADMIN_STATS_CACHE_TTL_SECONDS
+
+        return {"success": True, "cached": False, "data": data}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"統計取得エラー: {str(e)}")
-    finally:
-        db.close()
+
+# 管理者用クエリ計測API
+@app.get("/api/admin/query-stats")
+async def get_query_stats(
+    limit: int = Query(50, ge=1, le=QUERY_STATS_MAX_STATEMENTS),
+    sort: str = Query("total_ms", pattern="^(total_ms|max_ms|count|slow)$"),
+    current_user: User = Depends(get_current_admin_user)
+):
+    """SQL文・エンドポイント別のクエリ計測結果を取得"""
+    statements = [
+        {
+            "endpoint": endpoint,
+            "sql": sql,
+            "count": stats["count"],
+            "total_ms": round(stats["total_ms"], 2),
+            "avg_ms": round(stats["total_ms"] / stats["count"], 2),
+            "max_ms": round(stats["max_ms"], 2),
+            "slow": stats["slow"]
+        }
+        for (endpoint, sql), stats in list(query_stats["statements"].items())
+    ]
+    statements.sort(key=lambda item: item[sort], reverse=True)
+
+    endpoints = [
+        {
+            "endpoint": endpoint,
+            "requests": stats["requests"],
+            "avg_queries": round(stats["queries"] / stats["requests"], 2),
+            "max_queries": stats["max_queries"],
+            "avg_db_ms": round(stats["total_ms"] / stats["requests"], 2),
+            "flagged_requests": stats["flagged"]
+        }
+        for endpoint, stats in list(query_stats["endpoints"].items())
+    ]
+    endpoints.sort(key=lambda item: item["avg_queries"], reverse=True)
+
+    return {
+        "success": True,
+        "since": query_stats["started_at"],
+        "slow_query_threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "query_count_warning_threshold": QUERY_COUNT_WARNING_THRESHOLD,
+        "statements": statements[:limit],
+        "endpoints": endpoints
+    }
+
+@app.get("/api/admin/storage-stats")
+async def get_storage_stats(cleanup: bool = False, current_user: User = Depends(get_current_admin_user)):
+    """生成ファイル（PDF・鑑定書キャッシュ）の使用量を取得（cleanup=true で整理を即時実行）"""
+    result = None
+    if cleanup:
+        result = await asyncio.to_thread(artifact_store.cleanup)
+    return {"success": True, "cleanup": result, "data": artifact_store.metrics(), "font_subsets": report_font_subset_metrics()}
+
+@app.delete("/api/admin/query-stats")
+async def reset_query_stats(current_user: User = Depends(get_current_admin_user)):
+    """クエリ計測結果をリセット"""
+    query_stats["statements"].clear()
+    query_stats["endpoints"].clear()
+    query_stats["started_at"] = datetime.now().isoformat()
+    return {"success": True, "message": "クエリ計測結果をリセットしました"}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+ログインスループット ベンチマーク
+
+/api/auth/login を並列に叩きながら、同時に /health の応答時間を計測します。
+bcrypt がイベントループ上で同期実行されていると /health もログインの完了を
+待たされるため、スレッドプール化の効果は /health の p95 に現れます。
+
+使い方:
+    # 一時SQLiteでアプリをプロセス内起動して計測
+    python scripts/bench_login.py --requests 200 --concurrency 16
+
+    # 起動済みサーバーに対して計測
+    python scripts/bench_login.py --base-url http://localhost:8502
+
+    # コストを変えて比較（プロセス内起動時のみ有効）
+    BCRYPT_ROUNDS=10 python scripts/bench_login.py
+
+出力される指標:
+- logins/s       : 1秒あたりのログイン完了数
+- login p95 ms   : ログインのレイテンシ95パーセンタイル
+- health p95 ms  : ログイン負荷中の /health のレイテンシ95パーセンタイル（イベントループの停止時間を含む）
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_EMAIL = "bench-login@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))] if values else 0.0
+
+
+def build_in_process_client():
+    """一時SQLiteを使ってアプリをプロセス内で起動し、ASGIクライアントを返す"""
+    workdir = tempfile.mkdtemp(prefix="bench_login_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, backend_dir)
+    os.chdir(backend_dir)
+    import main
+
+    async def create_tables():
+        async with main.async_engine.begin() as conn:
+            await conn.run_sync(main.Base.metadata.create_all)
+
+    transport = httpx.ASGITransport(app=main.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench"), create_tables, getattr(main, "BCRYPT_ROUNDS", 12)
+
+
+async def run(args):
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+        rounds = "server"
+    else:
+        client, create_tables, rounds = build_in_process_client()
+        await create_tables()
+
+    async with client:
+        await client.post("/api/auth/register", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+
+        login_latencies = []
+        health_latencies = []
+        failures = 0
+        semaphore = asyncio.Semaphore(args.concurrency)
+        done = asyncio.Event()
+
+        async def login_once():
+            nonlocal failures
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/api/auth/login", json={"email": BENCH_EMAIL, "password": BENCH_PASSWORD})
+                login_latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    failures += 1
+
+        async def probe_health():
+            # スリープ中にイベントループが止まった時間も含めて計測する
+            while not done.is_set():
+                started = time.perf_counter()
+                await client.get("/health")
+                await asyncio.sleep(0.01)
+                health_latencies.append((time.perf_counter() - started - 0.01) * 1000)
+
+        probe = asyncio.create_task(probe_health())
+        started = time.perf_counter()
+        await asyncio.gather(*(login_once() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe
+
+    print(f"{'rounds':<8}{'logins/s':>12}{'login p50 ms':>15}{'login p95 ms':>15}{'health p95 ms':>16}{'failures':>10}")
+    print(
+        f"{rounds:<8}"
+        f"{args.requests / elapsed:>12.1f}"
+        f"{statistics.median(login_latencies):>15.1f}"
+        f"{percentile(login_latencies, 0.95):>15.1f}"
+        f"{percentile(health_latencies, 0.95):>16.1f}"
+        f"{failures:>10}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログインスループット ベンチマーク")
+    parser.add_argument("--base-url", default=None, help="起動済みサーバーのURL（省略時はプロセス内起動）")
+    parser.add_argument("--requests", type=int, default=200, help="ログイン総リクエスト数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同時リクエスト数")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
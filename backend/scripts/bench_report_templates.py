@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+鑑定書HTMLテンプレート ベンチマーク
+
+main.py の Jinja2 環境（templates/report/*.html.j2）について、以下を計測します：
+- compile    : バイトコードキャッシュなしで全テンプレートを読み込む時間（初回起動相当）
+- bytecode   : ディスクのバイトコードキャッシュから全テンプレートを読み込む時間（再起動相当）
+- render     : 読み込み済みテンプレートでの1回あたりのHTML生成時間（レイアウト×カラーテーマ別）
+
+使い方:
+    python scripts/bench_report_templates.py --iterations 500
+
+出力される指標:
+- p50 ms / p95 ms : HTML生成1回あたりのレイテンシ
+- bytes           : 生成されたHTMLのサイズ
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# 計測用のダミー診断結果（姓名4文字・詳細鑑定あり）
+SAMPLE_RESULT = {
+    "kyusei": {
+        "honmeisei": "一白水星", "getsumeisei": "九紫火星", "year_kanshi": "庚午", "month_kanshi": "丁丑",
+        "day_kanshi": "甲子", "naon": "路傍土", "max_kichigata": "東", "kichigata": "南東", "keisha": "坎宮傾斜", "eto": "午",
+    },
+    "seimei": {
+        "input": {"name": "鈴木 美雨"},
+        "data": {
+            "総評点数": 78,
+            "画数": {"姓1": 13, "姓2": 4, "名1": 9, "名2": 8},
+            "五行": {"姓1": "金", "姓2": "木", "名1": "水", "名2": "水"},
+            "陰陽": {"姓1": "陽", "姓2": "陰", "名1": "陽", "名2": "陰"},
+            "文字": {"姓1": "鈴", "姓2": "木", "名1": "美", "名2": "雨"},
+            "格数": {"天格": 17, "人格": 13, "地格": 17, "総画": 34},
+            "総評メッセージ": "全体として安定した名前です。",
+            "詳細鑑定": {
+                "文字による鑑定": {f"{ch}_{i}": "【吉】\n" + "文字の意味についての解説です。" * 8 for i, ch in enumerate("鈴木美雨")},
+                "画数による鑑定": {"人格:木美": "【画数13】\n" + "人格の画数についての解説です。" * 8},
+                "天地による鑑定": {"鈴木 美雨": "【天地総同数】\n" + "天地についての解説です。" * 8},
+            },
+        },
+    },
+}
+
+
+def load_backend():
+    workdir = tempfile.mkdtemp(prefix="bench_templates_")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ["REPORT_TEMPLATE_CACHE_DIR"] = os.path.join(workdir, "jinja_cache")
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, backend_dir)
+    os.chdir(backend_dir)
+    import main
+    return main
+
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))] if values else 0.0
+
+
+def timed_preload(backend, use_bytecode_cache):
+    environment = backend.create_report_template_environment(use_bytecode_cache=use_bytecode_cache)
+    started = time.perf_counter()
+    count = backend.preload_report_templates(environment)
+    return count, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="鑑定書HTMLテンプレート ベンチマーク")
+    parser.add_argument("--iterations", type=int, default=500, help="組み合わせごとのレンダリング回数")
+    args = parser.parse_args()
+
+    backend = load_backend()
+
+    count, compile_ms = timed_preload(backend, use_bytecode_cache=False)
+    timed_preload(backend, use_bytecode_cache=True)  # バイトコードキャッシュを作成
+    _, bytecode_ms = timed_preload(backend, use_bytecode_cache=True)
+    print(f"templates: {count}  compile: {compile_ms:.1f} ms  bytecode: {bytecode_ms:.1f} ms")
+    print()
+
+    record = backend.KanteiRecord(
+        id=1, user_id=1, client_name="鈴木 美雨", client_info={"birth_date": "1990-01-01", "gender": "female"},
+        calculation_result=SAMPLE_RESULT, status="completed", diagnosis_pattern="all",
+        appraiser_comment="良い一年になりますように。", created_at=datetime(2025, 1, 1),
+    )
+    environment = backend.create_report_template_environment()
+    backend.preload_report_templates(environment)
+
+    print(f"{'layout':<10}{'theme':<14}{'p50 ms':>10}{'p95 ms':>10}{'bytes':>10}")
+    for layout in sorted(backend.REPORT_HTML_LAYOUTS):
+        for theme in backend.REPORT_THEME_COLORS:
+            report = backend.build_report_document(record, {"layout_style": layout, "color_theme": theme, "business_name": "占いサロン 星花"})
+            latencies = []
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                html = backend.render_report_html(report, environment)
+                latencies.append((time.perf_counter() - started) * 1000)
+            print(
+                f"{layout:<10}{theme:<14}"
+                f"{statistics.median(latencies):>10.3f}"
+                f"{percentile(latencies, 0.95):>10.3f}"
+                f"{len(html.encode('utf-8')):>10}"
+            )
+
+
+if __name__ == "__main__":
+    main()
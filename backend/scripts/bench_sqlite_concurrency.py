@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+SQLite 同時読み書きベンチマーク
+
+バックグラウンド診断処理（process_diagnosis_db）の書き込みと、一覧取得の読み取りが
+同時に走る状況を再現し、以下の2つのプロファイルを比較します：
+- default: SQLiteの初期設定（ロールバックジャーナル・synchronous=FULL）
+- tuned:   main.py の apply_sqlite_pragmas と同じ設定（WAL・synchronous=NORMAL 等）
+
+使い方:
+    python scripts/bench_sqlite_concurrency.py --seconds 10 --readers 8
+
+出力される指標:
+- reads/s, writes/s : 1秒あたりの処理件数
+- read p95 ms       : 読み取りレイテンシの95パーセンタイル
+- lock errors       : database is locked で失敗した回数
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+# main.py と同じ環境変数で設定値を上書き可能
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+PROFILES = {
+    "default": [],
+    "tuned": [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}",
+        "PRAGMA temp_store=MEMORY",
+    ],
+}
+
+# 診断結果JSONのおおよそのサイズを再現するためのダミーデータ
+DUMMY_RESULT = json.dumps({"kyusei": {"raw_text": "九星" * 2000}, "seimei": {"raw_text": "姓名" * 4000}}, ensure_ascii=False)
+
+
+def connect(path, profile):
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    for pragma in PROFILES[profile]:
+        conn.execute(pragma)
+    return conn
+
+
+def prepare_database(path, profile, initial_rows):
+    conn = connect(path, profile)
+    conn.execute(
+        "CREATE TABLE kantei_records ("
+        "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, client_name TEXT NOT NULL, "
+        "calculation_result TEXT NOT NULL, status TEXT NOT NULL, created_at TEXT NOT NULL)"
+    )
+    conn.execute("CREATE INDEX idx_kantei_user_created ON kantei_records (user_id, created_at)")
+    conn.executemany(
+        "INSERT INTO kantei_records (user_id, client_name, calculation_result, status, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(i % 10, f"client{i}", DUMMY_RESULT, "completed", f"2025-01-01T00:{i % 60:02d}:00") for i in range(initial_rows)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_profile(profile, seconds, readers, initial_rows):
+    workdir = tempfile.mkdtemp(prefix=f"bench_sqlite_{profile}_")
+    path = os.path.join(workdir, "bench.db")
+    prepare_database(path, profile, initial_rows)
+
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {"reads": 0, "writes": 0, "lock_errors": 0, "read_latencies": []}
+
+    def writer():
+        conn = connect(path, profile)
+        i = 0
+        while not stop.is_set():
+            try:
+                # 作成 → 結果書き込み（process_diagnosis_db と同じ2回のコミット）
+                cur = conn.execute(
+                    "INSERT INTO kantei_records (user_id, client_name, calculation_result, status, created_at) "
+                    "VALUES (?, ?, '{}', 'processing', datetime('now'))",
+                    (i % 10, f"new{i}"),
+                )
+                conn.commit()
+                conn.execute(
+                    "UPDATE kantei_records SET calculation_result = ?, status = 'completed' WHERE id = ?",
+                    (DUMMY_RESULT, cur.lastrowid),
+                )
+                conn.commit()
+                with lock:
+                    stats["writes"] += 1
+            except sqlite3.OperationalError:
+                conn.rollback()
+                with lock:
+                    stats["lock_errors"] += 1
+            i += 1
+        conn.close()
+
+    def reader(user_id):
+        conn = connect(path, profile)
+        latencies = []
+        count = 0
+        errors = 0
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                conn.execute(
+                    "SELECT id, client_name, created_at, status FROM kantei_records "
+                    "WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 50",
+                    (user_id,),
+                ).fetchall()
+                latencies.append((time.perf_counter() - started) * 1000)
+                count += 1
+            except sqlite3.OperationalError:
+                errors += 1
+        conn.close()
+        with lock:
+            stats["reads"] += count
+            stats["lock_errors"] += errors
+            stats["read_latencies"].extend(latencies)
+
+    threads = [threading.Thread(target=writer)]
+    threads += [threading.Thread(target=reader, args=(i % 10,)) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(stats["read_latencies"])
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0.0
+    return {
+        "profile": profile,
+        "reads_per_sec": stats["reads"] / seconds,
+        "writes_per_sec": stats["writes"] / seconds,
+        "read_p95_ms": p95,
+        "read_median_ms": statistics.median(latencies) if latencies else 0.0,
+        "lock_errors": stats["lock_errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite 同時読み書きベンチマーク")
+    parser.add_argument("--seconds", type=float, default=10.0, help="各プロファイルの計測時間（秒）")
+    parser.add_argument("--readers", type=int, default=8, help="読み取りスレッド数")
+    parser.add_argument("--rows", type=int, default=5000, help="初期レコード数")
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'reads/s':>12}{'writes/s':>12}{'read p50 ms':>14}{'read p95 ms':>14}{'lock errors':>14}")
+    for profile in PROFILES:
+        result = run_profile(profile, args.seconds, args.readers, args.rows)
+        print(
+            f"{result['profile']:<10}"
+            f"{result['reads_per_sec']:>12.1f}"
+            f"{result['writes_per_sec']:>12.1f}"
+            f"{result['read_median_ms']:>14.2f}"
+            f"{result['read_p95_ms']:>14.2f}"
+            f"{result['lock_errors']:>14}"
+        )
+
+
+if __name__ == "__main__":
+    main()
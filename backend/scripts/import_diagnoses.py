@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+診断データ一括インポート CLI
+
+他ツールからの移行や /api/diagnosis/export で出力したデータの復元用。
+NDJSON / CSV（.gz 圧縮可）を1行ずつ読み込み、main.py の import_diagnosis_records で
+バッチ単位に一括INSERTします。calculation_result を含む行はブリッジ計算を行わず
+そのまま登録し、含まない行は処理待ちとして登録してスイーパーが順次計算します。
+
+使い方:
+    python scripts/import_diagnoses.py diagnoses.ndjson --user-email user@example.com
+    python scripts/import_diagnoses.py legacy.csv.gz --user-email user@example.com --batch-size 1000
+
+データベースは main.py と同じく DATABASE_URL（.env）を使用します。
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def run(args):
+    import main
+
+    async with main.AsyncSessionLocal() as db:
+        result = await db.execute(main.select(main.User.id).where(main.User.email == args.user_email))
+        user_id = result.scalar_one_or_none()
+    if user_id is None:
+        print(f"ユーザーが見つかりません: {args.user_email}")
+        return 1
+
+    import_format = main.detect_import_format(args.path, args.format)
+    started = time.perf_counter()
+    summary = None
+    with open(args.path, "rb") as binary_stream:
+        text_stream = main.open_import_stream(binary_stream)
+        records = main.iter_import_records(text_stream, import_format)
+        async for event_data in main.import_diagnosis_records(user_id, records, args.batch_size):
+            elapsed = time.perf_counter() - started
+            if event_data["type"] == "progress":
+                print(
+                    f"処理済み {event_data['processed']:>8} 件 / 登録 {event_data['imported']:>8} 件 / "
+                    f"エラー {event_data['failed']:>6} 件  ({event_data['processed'] / elapsed:,.0f} 行/秒)"
+                )
+            else:
+                summary = event_data
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"完了: 登録 {summary['imported']} 件（うち計算待ち {summary['queued']} 件）、"
+        f"エラー {summary['failed']} 件、{elapsed:.1f} 秒"
+    )
+    for error in summary["errors"]:
+        print(f"  行 {error['line']}: {error['error']}")
+    if summary["queued"]:
+        print("計算待ちの診断はAPIサーバーのスイーパーが順次処理します")
+    return 0 if summary["failed"] == 0 else 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="診断データ一括インポート")
+    parser.add_argument("path", help="NDJSON / CSV ファイル（.gz 可）")
+    parser.add_argument("--user-email", required=True, help="インポート先ユーザーのメールアドレス")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default=None, help="入力形式（省略時は拡張子から判定）")
+    parser.add_argument("--batch-size", type=int, default=500, help="1トランザクションあたりの行数")
+    args = parser.parse_args()
+    args.path = os.path.abspath(args.path)
+    if not os.path.exists(args.path):
+        parser.error(f"ファイルが見つかりません: {args.path}")
+
+    # main.py は backend ディレクトリからの相対パス（uploads 等）を前提にしている
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -29,6 +29,38 @@ export interface DiagnosisResult {
   status: 'processing' | 'completed' | 'failed'
   error_message?: string
   diagnosis_pattern?: string  // "kyusei_only" | "seimei_only" | "all"
+  honmeisei?: string | null     // 一覧用サマリー（本命星）
+  getsumeisei?: string | null   // 一覧用サマリー（月命星）
+  seimei_score?: number | null  // 一覧用サマリー（姓名判断の総評点数）
+  pdf_file_size?: number | null     // 最後に生成した鑑定書PDFのサイズ（バイト）
+  pdf_generated_at?: string | null
+}
+
+export interface DiagnosisListParams {
+  limit?: number
+  cursor?: string
+  status?: string
+  date_from?: string  // YYYY-MM-DD
+  date_to?: string    // YYYY-MM-DD
+  honmeisei?: string
+  diagnosis_pattern?: string
+  min_score?: number
+  max_score?: number
+}
+
+export interface DiagnosisImportSummary {
+  type: 'summary'
+  processed: number
+  imported: number
+  queued: number   // 計算結果が無くバックグラウンドで計算される件数
+  failed: number
+  errors: { line: number; error: string }[]
+}
+
+export interface DiagnosisListPage {
+  diagnoses: DiagnosisResult[]
+  next_cursor: string | null
+  has_more: boolean
 }
 
 export interface TemplateSettings {
@@ -75,7 +107,11 @@ export interface TemplateSettingsUpdate {
 export interface LogoUploadResponse {
   success: boolean
   logo_url: string
+  report_logo_url?: string
+  thumbnail_url?: string
   file_size: number
+  width?: number
+  height?: number
   message: string
 }
 
@@ -201,8 +237,91 @@ class ApiClient {
     return this.request<DiagnosisResult>(`/api/diagnosis/${diagnosisId}${params}`)
   }
 
-  async listDiagnoses() {
-    return this.request<{ diagnoses: DiagnosisResult[] }>('/api/diagnosis')
+  async listDiagnosesPage(params: DiagnosisListParams = {}) {
+    const query = new URLSearchParams()
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== undefined && value !== null && value !== '') {
+        query.append(key, String(value))
+      }
+    })
+    const suffix = query.toString() ? `?${query}` : ''
+    return this.request<DiagnosisListPage>(`/api/diagnosis${suffix}`)
+  }
+
+  // 全ページをカーソルで辿って取得（既存画面との互換用）
+  async listDiagnoses(params: Omit<DiagnosisListParams, 'cursor'> = {}) {
+    const diagnoses: DiagnosisResult[] = []
+    let cursor: string | undefined
+    do {
+      const page = await this.listDiagnosesPage({ ...params, cursor })
+      diagnoses.push(...page.diagnoses)
+      cursor = page.next_cursor ?? undefined
+    } while (cursor)
+    return { diagnoses }
+  }
+
+  // 診断データ一括エクスポート（NDJSON/CSV、gzip指定時は .gz）
+  async exportDiagnoses(format: 'ndjson' | 'csv' = 'ndjson', gzip = false, params: Omit<DiagnosisListParams, 'cursor' | 'limit'> = {}) {
+    const query = new URLSearchParams({ format, gzip: String(gzip) })
+    Object.entries(params).forEach(([key, value]) => {
+      if (value !== undefined && value !== null && value !== '') {
+        query.append(key, String(value))
+      }
+    })
+
+    const url = `${this.baseURL}/api/diagnosis/export?${query}`
+    const headers: Record<string, string> = {}
+
+    if (typeof window !== 'undefined') {
+      const token = localStorage.getItem('auth_token')
+      if (token) {
+        headers.Authorization = `Bearer ${token}`
+      }
+    }
+
+    const response = await fetch(url, { headers })
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}))
+      throw new Error(errorData.detail || `HTTP ${response.status}: ${response.statusText}`)
+    }
+
+    return response.blob()
+  }
+
+  // 診断データ一括インポート（進捗はNDJSONで返るため、最終行のサマリーを返す）
+  async importDiagnoses(file: File, format?: 'ndjson' | 'csv') {
+    const formData = new FormData()
+    formData.append('import_file', file)
+
+    const query = format ? `?format=${format}` : ''
+    const url = `${this.baseURL}/api/diagnosis/import${query}`
+    const headers: Record<string, string> = {}
+
+    if (typeof window !== 'undefined') {
+      const token = localStorage.getItem('auth_token')
+      if (token) {
+        headers.Authorization = `Bearer ${token}`
+      }
+    }
+
+    const response = await fetch(url, {
+      method: 'POST',
+      headers,
+      body: formData,
+    })
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}))
+      throw new Error(errorData.detail || `HTTP ${response.status}: ${response.statusText}`)
+    }
+
+    const events = (await response.text()).trim().split('\n').map(line => JSON.parse(line))
+    const last = events[events.length - 1]
+    if (last?.type === 'error') {
+      throw new Error(last.error)
+    }
+    return last as DiagnosisImportSummary
   }
 
   // PDF Generation API
@@ -213,7 +332,24 @@ class ApiClient {
   }
 
   async downloadPDF(diagnosisId: string) {
-    return this.request<{ message: string; diagnosis_id: string }>(`/api/diagnosis/${diagnosisId}/pdf/download`)
+    const url = `${this.baseURL}/api/diagnosis/${diagnosisId}/pdf/download`
+    const headers: Record<string, string> = {}
+
+    if (typeof window !== 'undefined') {
+      const token = localStorage.getItem('auth_token')
+      if (token) {
+        headers.Authorization = `Bearer ${token}`
+      }
+    }
+
+    const response = await fetch(url, { headers })
+
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}))
+      throw new Error(errorData.detail || `HTTP ${response.status}: ${response.statusText}`)
+    }
+
+    return response.blob()
   }
 
   // Template Settings API
@@ -0,0 +1,179 @@
+/**
+ * 常駐PDFレンダラー（Puppeteer）
+ *
+ * ブラウザを1つ起動したまま保持し、ページプールでHTMLをPDFに変換する。
+ * バックエンド（main.py の ChromiumRenderer）から子プロセスとして起動され、
+ * 標準入力／標準出力で1行1JSONのメッセージをやり取りする。
+ *
+ * リクエスト: {"id": 1, "html_path": "/tmp/report_cache/x.html", "pdf_path": "/tmp/report_cache/x.pdf"}
+ *             （html_path の代わりに "html" でHTML文字列を直接渡すことも可能）
+ * レスポンス: {"id": 1, "success": true, "pdf_path": "...", "file_size": 12345, "render_ms": 180}
+ *             {"id": 1, "success": false, "error": "..."}
+ * 起動完了時: {"type": "ready", "pages": 2}
+ *
+ * 環境変数:
+ *   PDF_RENDERER_PAGES        ページプールのサイズ（既定: 2）
+ *   PDF_RENDERER_PAGE_REUSE   1ページを作り直すまでの利用回数（既定: 50）
+ *   CHROME_EXECUTABLE_PATH    Chrome/Chromium の実行ファイル（省略時は Puppeteer 同梱版）
+ */
+
+const puppeteer = require('puppeteer');
+const fs = require('fs');
+const readline = require('readline');
+
+const POOL_SIZE = parseInt(process.env.PDF_RENDERER_PAGES || '2', 10);
+const PAGE_REUSE_LIMIT = parseInt(process.env.PDF_RENDERER_PAGE_REUSE || '50', 10);
+
+// html_to_pdf.js と同じ出力設定
+const PDF_OPTIONS = {
+    format: 'A4',
+    printBackground: true,
+    displayHeaderFooter: true,
+    headerTemplate: '<div></div>',
+    footerTemplate: `
+        <div style="width: 100%; font-size: 9px; padding: 10px; text-align: center;">
+            <span class="pageNumber"></span> / <span class="totalPages"></span>
+        </div>
+    `,
+    margin: {
+        top: '20mm',
+        bottom: '20mm',
+        left: '15mm',
+        right: '15mm'
+    }
+};
+
+let browser = null;
+const idlePages = [];
+const waiting = [];
+let pageCount = 0;
+
+function send(message) {
+    process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+async function launchBrowser() {
+    browser = await puppeteer.launch({
+        headless: 'new',
+        executablePath: process.env.CHROME_EXECUTABLE_PATH || undefined,
+        args: [
+            '--no-sandbox',
+            '--disable-setuid-sandbox',
+            '--disable-dev-shm-usage',
+            '--disable-accelerated-2d-canvas',
+            '--no-first-run',
+            '--no-zygote',
+            '--disable-gpu'
+        ]
+    });
+    // ブラウザが落ちた場合は終了し、バックエンド側で再起動させる
+    browser.on('disconnected', () => {
+        console.error('Browser disconnected');
+        process.exit(1);
+    });
+}
+
+async function newPooledPage() {
+    const page = await browser.newPage();
+    page.__renderCount = 0;
+    return page;
+}
+
+async function acquirePage() {
+    if (idlePages.length > 0) {
+        return idlePages.pop();
+    }
+    if (pageCount < POOL_SIZE) {
+        pageCount += 1;
+        try {
+            return await newPooledPage();
+        } catch (error) {
+            pageCount -= 1;
+            throw error;
+        }
+    }
+    return new Promise(resolve => waiting.push(resolve));
+}
+
+async function releasePage(page, broken) {
+    let nextPage = page;
+    if (broken || page.__renderCount >= PAGE_REUSE_LIMIT) {
+        // メモリ肥大化やエラー後の状態を引きずらないようページを作り直す
+        await page.close().catch(() => {});
+        try {
+            nextPage = await newPooledPage();
+        } catch (error) {
+            pageCount -= 1;
+            console.error('Failed to recreate page:', error);
+            return;
+        }
+    }
+    const resolve = waiting.shift();
+    if (resolve) {
+        resolve(nextPage);
+    } else {
+        idlePages.push(nextPage);
+    }
+}
+
+async function render(request) {
+    const started = Date.now();
+    const page = await acquirePage();
+    let broken = false;
+    try {
+        const html = request.html !== undefined ? request.html : fs.readFileSync(request.html_path, 'utf8');
+        await page.setContent(html, { waitUntil: 'networkidle0' });
+        await page.pdf({ path: request.pdf_path, ...PDF_OPTIONS });
+        page.__renderCount += 1;
+        const stats = fs.statSync(request.pdf_path);
+        send({
+            id: request.id,
+            success: true,
+            pdf_path: request.pdf_path,
+            file_size: stats.size,
+            render_ms: Date.now() - started
+        });
+    } catch (error) {
+        broken = true;
+        send({ id: request.id, success: false, error: error.message, render_ms: Date.now() - started });
+    } finally {
+        await releasePage(page, broken);
+    }
+}
+
+async function main() {
+    await launchBrowser();
+    send({ type: 'ready', pages: POOL_SIZE });
+
+    const input = readline.createInterface({ input: process.stdin });
+    input.on('line', line => {
+        if (!line.trim()) {
+            return;
+        }
+        let request;
+        try {
+            request = JSON.parse(line);
+        } catch (error) {
+            console.error('Invalid request:', line);
+            return;
+        }
+        render(request);
+    });
+    // バックエンドが終了して標準入力が閉じたらブラウザも終了する
+    input.on('close', async () => {
+        if (browser) {
+            browser.removeAllListeners('disconnected');
+            await browser.close().catch(() => {});
+        }
+        process.exit(0);
+    });
+}
+
+process.on('unhandledRejection', (reason) => {
+    console.error('Unhandled Rejection:', reason);
+});
+
+main().catch(error => {
+    console.error('Failed to start renderer:', error);
+    process.exit(1);
+});